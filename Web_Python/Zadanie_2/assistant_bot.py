@@ -1,8 +1,54 @@
-from collections import UserDict
-import re
+import time
+
+# Taken first, so --startup-profile can report how long the imports took.
+IMPORTS_STARTED = time.perf_counter()
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, UserDict, namedtuple
+from itertools import combinations, islice
+from operator import itemgetter
+import argparse
+import calendar
+import contextlib
+import heapq
+import io
+import math
+import os
 import pickle
-from datetime import datetime, timedelta
+import re
+import struct
+import sys
+import threading
+import unicodedata
+from datetime import date, datetime, timedelta
 from abc import ABC, abstractmethod
+from pathlib import Path
+
+try:
+    import readline
+except ImportError:  # Not available on Windows.
+    readline = None
+
+# The phone, email and date rules come from validation.py at the repository root.
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+import validation
+
+IMPORT_SECONDS = time.perf_counter() - IMPORTS_STARTED
+
+# Lines written to stdout at once by print_lines.
+OUTPUT_CHUNK = 1000
+
+
+def print_lines(lines):
+    """Prints the lines, writing them out a chunk at a time instead of one by one."""
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, OUTPUT_CHUNK))
+        if not chunk:
+            break
+        chunk.append("")
+        sys.stdout.write("\n".join(chunk))
 
 
 class UserInterface(ABC):
@@ -17,110 +63,284 @@ class UserInterface(ABC):
 
         pass
 
+    @abstractmethod
+    def display_message(self, message):
+
+        pass
+
     @abstractmethod
     def get_input(self, prompt):
 
         pass
 
+    def set_completer(self, complete):
+        """Installs complete(prefix), returning suggestions for the typed word."""
+
 
 class ConsoleInterface(UserInterface):
 
     def display_contacts(self, contacts):
 
         print("Kontakty:")
-        for i, contact in enumerate(contacts, start=1):
-            print(f"{i}. {contact}")
+        today = date.today()
+        print_lines(
+            f"{i}. {contact.to_string(today)}"
+            for i, contact in enumerate(contacts, start=1)
+        )
 
     def display_notes(self, notes):
 
         print("Notatki:")
-        for i, note in enumerate(notes, start=1):
-            print(f"{i}. {note}")
+        for note in notes:
+            print(f"{note.id}. {note}")
+
+    def display_message(self, message):
+
+        print(message)
 
     def get_input(self, prompt):
 
         return input(prompt)
 
+    def set_completer(self, complete):
+        """Completes the word being typed with the Tab key, where readline exists."""
+        if readline is None:
+            return
+        matches = []
+
+        def completer(text, state):
+            if state == 0:
+                matches[:] = complete(text)
+            return matches[state] if state < len(matches) else None
+
+        readline.set_completer(completer)
+        readline.parse_and_bind("tab: complete")
+
 
 class Field:
-    """Base class for entry fields."""
+    """Base class for entry fields.
+
+    Fields are slotted and keep their value in the most compact form; the
+    value property always returns the string the user entered.
+    """
+
+    __slots__ = ("_value",)
 
     def __init__(self, value):
         self.value = value
 
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    def __getstate__(self):
+        return (self.value,)
+
+    def __setstate__(self, state):
+        # Books pickled before the fields were slotted store a __dict__.
+        if isinstance(state, dict):
+            state = (state["value"],)
+        (self.value,) = state
+
 
 class Name(Field):
-    pass
+    __slots__ = ()
 
 
 class PhoneNumber(Field):
+    """Phone number packed into an integer of its nine digits."""
+
+    __slots__ = ()
+
     def __init__(self, value):
         if not self.validate_phone(value):
             raise ValueError("Niepoprawny numer telefonu")
         super().__init__(value)
 
+    @property
+    def value(self):
+        return f"{self._value:09d}"
+
+    @value.setter
+    def value(self, value):
+        # int() would also take spaces, a sign and digits of other scripts.
+        if not (len(value) == 9 and value.isascii() and value.isdigit()):
+            raise ValueError("Niepoprawny numer telefonu")
+        self._value = int(value)
+
     @staticmethod
     def validate_phone(value):
-        pattern = re.compile(r"^\d{9}$")
-        return pattern.match(value) is not None
+        return validation.is_valid_phone(value)
 
 
 class EmailAddress(Field):
+    """Email address with the domain interned, as many addresses share it."""
+
+    __slots__ = ("_domain",)
+
     def __init__(self, value):
         if not self.validate_email(value):
             raise ValueError("Niepoprawny adres email")
         super().__init__(value)
 
+    @property
+    def value(self):
+        return f"{self._value}@{self._domain}"
+
+    @value.setter
+    def value(self, value):
+        local_part, _, domain = value.rpartition("@")
+        self._value = local_part
+        self._domain = sys.intern(domain)
+
+    @property
+    def domain(self):
+        return self._domain
+
     @staticmethod
     def validate_email(value):
-        pattern = re.compile(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$")
-        return pattern.match(value) is not None
+        return validation.is_valid_email(value)
 
 
 class BirthDate(Field):
+    """Birthdate stored as the ordinal of the date."""
+
+    __slots__ = ()
+
     def __init__(self, value):
         if not self.validate_birthdate(value):
             raise ValueError("Niepoprawna data urodzenia")
         super().__init__(value)
 
+    @property
+    def value(self):
+        return self.date.isoformat()
+
+    @value.setter
+    def value(self, value):
+        self._value = validation.parse_date(value).toordinal()
+
+    @property
+    def date(self):
+        return date.fromordinal(self._value)
+
     @staticmethod
     def validate_birthdate(value):
-        try:
-            datetime.strptime(value, "%Y-%m-%d")
-            return True
-        except ValueError:
-            return False
+        return validation.is_valid_date(value)
 
 
 class Address(Field):
+    __slots__ = ("street", "city", "postal_code", "country")
+
     def __init__(self, street, city, postal_code, country):
         self.street = street
         self.city = city
         self.postal_code = postal_code
         self.country = country
-        super().__init__(value=f"{street}, {city}, {postal_code}, {country}")
+
+    @property
+    def value(self):
+        return f"{self.street}, {self.city}, {self.postal_code}, {self.country}"
+
+    def __getstate__(self):
+        return (self.street, self.city, self.postal_code, self.country)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            state = (
+                state["street"],
+                state["city"],
+                state["postal_code"],
+                state["country"],
+            )
+        self.street, self.city, self.postal_code, self.country = state
 
 
 class Record:
+    """Entry of the address book.
+
+    Phone numbers and email addresses are kept in tuples, which cost nothing
+    while empty and nothing extra for spare capacity. The text to_string
+    renders is cached with the ID and the day it was rendered for; the
+    mutators below clear it, so fields are changed through them.
+    """
+
+    __slots__ = (
+        "id",
+        "name",
+        "phone_numbers",
+        "email_addresses",
+        "birthdate",
+        "address",
+        "rendered",
+        "__weakref__",
+    )
+
     def __init__(self, name: Name, birthdate: BirthDate = None):
         self.id = None  # The ID will be assigned by AddressBook
         self.name = name
-        self.phone_numbers = []
-        self.email_addresses = []
+        self.phone_numbers = ()
+        self.email_addresses = ()
         self.birthdate = birthdate
         self.address = None  # Add a new property to store the address
+        self.rendered = None  # (ID, day, text) of the last to_string
+
+    def __getstate__(self):
+        return (
+            self.id,
+            self.name,
+            self.phone_numbers,
+            self.email_addresses,
+            self.birthdate,
+            self.address,
+        )
+
+    def __setstate__(self, state):
+        # Books pickled before the records were slotted store a __dict__.
+        if isinstance(state, dict):
+            state = (
+                state["id"],
+                state["name"],
+                tuple(state["phone_numbers"]),
+                tuple(state["email_addresses"]),
+                state["birthdate"],
+                state["address"],
+            )
+        (
+            self.id,
+            self.name,
+            self.phone_numbers,
+            self.email_addresses,
+            self.birthdate,
+            self.address,
+        ) = state
+        self.rendered = None
 
     def add_address(self, address: Address):
         """Adds an address."""
         self.address = address
+        self.rendered = None
+
+    def remove_address(self):
+        """Removes the address."""
+        self.address = None
+        self.rendered = None
 
     def add_phone_number(self, phone_number: PhoneNumber):
         """Adds a phone number."""
-        self.phone_numbers.append(phone_number)
+        self.phone_numbers += (phone_number,)
+        self.rendered = None
 
     def remove_phone_number(self, phone_number: PhoneNumber):
         """Removes a phone number."""
-        self.phone_numbers.remove(phone_number)
+        phone_numbers = list(self.phone_numbers)
+        phone_numbers.remove(phone_number)
+        self.phone_numbers = tuple(phone_numbers)
+        self.rendered = None
 
     def edit_phone_number(
         self, old_phone_number: PhoneNumber, new_phone_number: PhoneNumber
@@ -131,11 +351,15 @@ class Record:
 
     def add_email_address(self, email_address: EmailAddress):
         """Adds an email address."""
-        self.email_addresses.append(email_address)
+        self.email_addresses += (email_address,)
+        self.rendered = None
 
     def remove_email_address(self, email_address: EmailAddress):
         """Removes an email address."""
-        self.email_addresses.remove(email_address)
+        email_addresses = list(self.email_addresses)
+        email_addresses.remove(email_address)
+        self.email_addresses = tuple(email_addresses)
+        self.rendered = None
 
     def edit_email_address(
         self, old_email_address: EmailAddress, new_email_address: EmailAddress
@@ -147,20 +371,41 @@ class Record:
     def edit_name(self, new_name: Name):
         """Changes the first and last name."""
         self.name = new_name
+        self.rendered = None
+
+    def edit_birthdate(self, new_birthdate: BirthDate = None):
+        """Changes the birthdate, or removes it if None."""
+        self.birthdate = new_birthdate
+        self.rendered = None
+
+    def days_to_birthdate(self, today=None):
+        """Returns the number of days to the next birthdate, 0 on the day itself.
 
-    def days_to_birthdate(self):
-        """Returns the number of days to the next birthdate."""
-        if not self.birthdate or not self.birthdate.value:
+        Listings pass the same today to every record instead of asking the
+        clock for each one.
+        """
+        if not self.birthdate:
             return "Brak daty urodzenia"
-        today = datetime.now()
-        bday = datetime.strptime(self.birthdate.value, "%Y-%m-%d")
-        next_birthday = bday.replace(year=today.year)
-        if today > next_birthday:
-            next_birthday = next_birthday.replace(year=today.year + 1)
-        return (next_birthday - today).days
+        today = today or date.today()
+        birthdate = self.birthdate.date
+        next_birthday = birthday_in_year(birthdate, today.year)
+        if next_birthday < today:
+            next_birthday = birthday_in_year(birthdate, today.year + 1)
+        return next_birthday.toordinal() - today.toordinal()
 
     def __str__(self):
-        """Returns a string representation of the entry, including the ID."""
+        return self.to_string()
+
+    def to_string(self, today=None):
+        """Returns a string representation of the entry, including the ID.
+
+        The days to the birthdate change every day, so the text is rendered
+        again on a new day, as well as after a change.
+        """
+        today = today or date.today()
+        rendered = self.rendered
+        if rendered is not None and rendered[0] == self.id and rendered[1] == today:
+            return rendered[2]
         phone_numbers = ", ".join(
             phone_number.value for phone_number in self.phone_numbers
         )
@@ -169,34 +414,744 @@ class Record:
         )
         birthdate_str = f", Urodziny: {self.birthdate.value}" if self.birthdate else ""
         days_to_birthdate_str = (
-            f", Dni do urodzin: {self.days_to_birthdate()}" if self.birthdate else ""
+            f", Dni do urodzin: {self.days_to_birthdate(today)}"
+            if self.birthdate
+            else ""
         )
         address_str = f"\nAdres: {self.address.value}" if self.address else ""
-        return (
+        text = (
             f"ID: {self.id}, Imię i nazwisko: {self.name.value}, "
-            f"Numery telefonów: {phone_numbers}, Adresy email: {email_addresses}{birthdate_str}{days_to_birthdate_str}{address_str}"
+            f"Numery telefonów: {phone_numbers}, Adresy email: {email_addresses}"
+            f"{birthdate_str}{days_to_birthdate_str}{address_str}"
         )
+        self.rendered = (self.id, today, text)
+        return text
+
+
+class NGramIndex:
+    """Inverted index from character n-grams to the keys of the entries with them."""
+
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = {}
+        self.grams_by_key = {}
+
+    def grams(self, text):
+        """Returns the set of case-folded n-grams of the text."""
+        text = text.casefold()
+        return {text[i : i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def add(self, key, texts):
+        """Indexes the texts under the given key, replacing what was indexed before."""
+        self.remove(key)
+        grams = set()
+        for text in texts:
+            grams |= self.grams(text)
+        self.grams_by_key[key] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        """Drops the key from the index."""
+        for gram in self.grams_by_key.pop(key, ()):
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def candidates(self, term):
+        """Returns the keys sharing all n-grams of the term, or None if the term is shorter than n."""
+        grams = self.grams(term)
+        if not grams:
+            return None
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        found = set(postings[0])
+        for keys in postings[1:]:
+            if not found:
+                break
+            found &= keys
+        return found
+
+
+# Letters that are not a base letter plus a combining mark in Unicode.
+FOLDED_LETTERS = str.maketrans(
+    {"ł": "l", "đ": "d", "ø": "o", "æ": "ae", "œ": "oe"}
+)
+
+
+def fold_text(text):
+    """Case-folds the text and drops diacritics, so "Łukasz" becomes "lukasz"."""
+    if text.isascii():
+        return text.casefold()
+    decomposed = unicodedata.normalize(
+        "NFKD", text.casefold().translate(FOLDED_LETTERS)
+    )
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class FuzzyNameIndex:
+    """Trigram similarity index over the diacritic-folded words of names.
+
+    Names repeat a lot, so the index works on the distinct words: each is split
+    into padded trigrams once, and a query is only compared with the words that
+    share a trigram with it. The similarity of two words is the number of shared
+    trigrams divided by the number of trigrams in either of them. For a query of
+    several words the keys of close words are intersected a pair of words at a
+    time, the closest first, and a bounded number of the keys found is scored,
+    so common words such as "jan" do not make a search read all their keys.
+    """
+
+    # Most keys a query of several words scores in full, and how many of the
+    # words close to each of its words are looked for together.
+    MAX_CANDIDATES = 2_000
+    PAIRED_WORDS = 50
+
+    def __init__(self, min_similarity=0.3):
+        self.min_similarity = min_similarity
+        self.tokens_by_key = {}
+        self.keys_by_token = {}
+        self.tokens_by_gram = {}
+        self.gram_counts = {}
+
+    @staticmethod
+    def tokens(name):
+        """Returns the set of folded words of the name."""
+        return set(fold_text(name).split())
+
+    @staticmethod
+    def grams(token):
+        """Returns the trigrams of the word, padded so short words have some too."""
+        padded = f"  {token} "
+        return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, key, name):
+        """Indexes the name under the given key, replacing what was indexed before."""
+        self.remove(key)
+        tokens = self.tokens(name)
+        self.tokens_by_key[key] = tokens
+        for token in tokens:
+            keys = self.keys_by_token.get(token)
+            if keys is None:
+                keys = self.keys_by_token[token] = set()
+                grams = self.grams(token)
+                self.gram_counts[token] = len(grams)
+                for gram in grams:
+                    self.tokens_by_gram.setdefault(gram, set()).add(token)
+            keys.add(key)
+
+    def remove(self, key):
+        """Drops the key from the index, and the words no other key uses."""
+        for token in self.tokens_by_key.pop(key, ()):
+            keys = self.keys_by_token[token]
+            keys.discard(key)
+            if keys:
+                continue
+            del self.keys_by_token[token]
+            del self.gram_counts[token]
+            for gram in self.grams(token):
+                tokens = self.tokens_by_gram[gram]
+                tokens.discard(token)
+                if not tokens:
+                    del self.tokens_by_gram[gram]
+
+    def similar_tokens(self, token):
+        """Returns (similarity, word) for the indexed words close to it, best first."""
+        grams = self.grams(token)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.tokens_by_gram.get(gram, ()))
+        similar = []
+        for candidate, count in shared.items():
+            similarity = count / (len(grams) + self.gram_counts[candidate] - count)
+            if similarity >= self.min_similarity:
+                similar.append((similarity, candidate))
+        similar.sort(reverse=True)
+        return similar
+
+    def ranked_keys(self, similar):
+        """Yields (key, similarity) for the keys of the words, best words first."""
+        for similarity, candidate in similar:
+            for key in self.keys_by_token[candidate]:
+                yield key, similarity
+
+    def search(self, query, limit=5):
+        """Returns up to limit (key, score) pairs, the most similar names first.
+
+        The score averages, over the words of the query, the similarity of the
+        closest word of the name; 1.0 means every word of the query is in the
+        name, ignoring case and diacritics.
+        """
+        query_tokens = self.tokens(query)
+        if not query_tokens:
+            return []
+        ranked = [self.similar_tokens(token) for token in query_tokens]
+        found = {}
+        if len(ranked) > 1:
+            # Keys close to several words of the query are scored in full. They
+            # are found by intersecting the keys of two close words at a time, the
+            # closest pairs first, until MAX_CANDIDATES of them are found.
+            closest = [similar[: self.PAIRED_WORDS] for similar in ranked]
+            pairs = sorted(
+                (
+                    (first_similarity + second_similarity, first, second)
+                    for first_similar, second_similar in combinations(closest, 2)
+                    for first_similarity, first in first_similar
+                    for second_similarity, second in second_similar
+                ),
+                reverse=True,
+            )
+            shared = set()
+            for _, first, second in pairs:
+                room = self.MAX_CANDIDATES - len(shared)
+                if not room:
+                    break
+                keys = self.keys_by_token[first] & self.keys_by_token[second]
+                shared.update(islice(keys - shared, room))
+            similarities = [
+                {candidate: similarity for similarity, candidate in similar}
+                for similar in ranked
+            ]
+            for key in shared:
+                tokens = self.tokens_by_key[key]
+                found[key] = sum(
+                    max(word_similarities.get(token, 0) for token in tokens)
+                    for word_similarities in similarities
+                )
+        # ...the others score one word, so only the best few of each word can win.
+        shared = set(found)
+        for similar in ranked:
+            other_keys = (
+                item for item in self.ranked_keys(similar) if item[0] not in shared
+            )
+            for key, similarity in islice(other_keys, limit):
+                found.setdefault(key, similarity)
+        return [
+            (key, score / len(query_tokens))
+            for key, score in heapq.nlargest(limit, found.items(), key=itemgetter(1))
+        ]
+
+
+class TrieNode:
+    """Node of NameTrie.
+
+    Children are kept in a string of their first letters and a tuple of nodes
+    instead of a dict, which is several times smaller for the one or two
+    children most nodes have.
+    """
+
+    __slots__ = ("chars", "nodes", "word", "count", "top")
+
+    def __init__(self):
+        self.chars = ""
+        self.nodes = ()
+        self.word = None
+        self.count = 0
+        self.top = ()
+
+    def child(self, char):
+        """Returns the child under the letter, or None."""
+        index = self.chars.find(char)
+        return self.nodes[index] if index >= 0 else None
+
+    def add_child(self, char):
+        """Returns the child under the letter, creating it if needed."""
+        node = self.child(char)
+        if node is None:
+            node = TrieNode()
+            self.chars += char
+            self.nodes += (node,)
+        return node
+
+    def remove_child(self, char):
+        """Drops the child under the letter."""
+        index = self.chars.find(char)
+        self.chars = self.chars[:index] + self.chars[index + 1 :]
+        self.nodes = self.nodes[:index] + self.nodes[index + 1 :]
+
+
+class NameTrie:
+    """Prefix tree over the folded words of names, for autocompletion.
+
+    Words are folded like in FuzzyNameIndex, so "luk" completes to "Łukasz".
+    Every node caches the most common words below it. A change only clears the
+    caches on the path of its word, and they are rebuilt from the children the
+    next time a prefix reaches them, so loading a book costs no ranking at all
+    and a completion usually costs the length of the prefix.
+    """
+
+    def __init__(self, top_size=10):
+        self.top_size = top_size
+        self.root = TrieNode()
+        self.words_by_key = {}
+
+    def add(self, key, name):
+        """Indexes the words of the name under the key, replacing the old ones."""
+        self.remove(key)
+        words = {fold_text(word): sys.intern(word) for word in name.split()}
+        self.words_by_key[key] = tuple(words.values())
+        for folded, word in words.items():
+            self.update(folded, word, 1)
+
+    def remove(self, key):
+        """Drops the words of the key."""
+        for word in self.words_by_key.pop(key, ()):
+            self.update(fold_text(word), word, -1)
+
+    def update(self, folded, word, change):
+        """Changes how many names use the word and clears the caches above it."""
+        path = [self.root]
+        for char in folded:
+            path.append(path[-1].add_child(char))
+        end = path[-1]
+        end.count += change
+        end.word = word if end.count > 0 else None
+        for node in reversed(path):
+            if node.top is None:
+                # The caches above were cleared by an earlier change.
+                break
+            node.top = None
+        # Prune the branch the word leaves empty.
+        for char, parent, node in zip(
+            reversed(folded), reversed(path[:-1]), reversed(path[1:])
+        ):
+            if node.count or node.chars:
+                break
+            parent.remove_child(char)
+
+    def top(self, node):
+        """Returns (-count, folded word, word) of the best words below the node."""
+        if node.top is None:
+            if node.word is None and len(node.nodes) == 1:
+                # A chain of single children shares one tuple.
+                node.top = self.top(node.nodes[0])
+            else:
+                candidates = [
+                    entry for child in node.nodes for entry in self.top(child)
+                ]
+                if node.word is not None:
+                    candidates.append(
+                        (-node.count, fold_text(node.word), node.word)
+                    )
+                node.top = tuple(heapq.nsmallest(self.top_size, candidates))
+        return node.top
+
+    def complete(self, prefix, limit=5):
+        """Returns up to limit words starting with the prefix, most common first."""
+        node = self.root
+        for char in fold_text(prefix):
+            node = node.child(char)
+            if node is None:
+                return []
+        return [word for _, _, word in self.top(node)[:limit]]
+
+
+class ValueIndex:
+    """Inverted index from exact values of records, such as cities, to their keys."""
+
+    def __init__(self):
+        self.keys_by_value = {}
+        self.values_by_key = {}
+
+    def add(self, key, values):
+        """Indexes the values under the key, replacing what was indexed before."""
+        self.remove(key)
+        values = set(values)
+        if values:
+            self.values_by_key[key] = values
+        for value in values:
+            self.keys_by_value.setdefault(value, set()).add(key)
+
+    def remove(self, key):
+        """Drops the key from the index."""
+        for value in self.values_by_key.pop(key, ()):
+            keys = self.keys_by_value[value]
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_value[value]
+
+    def get(self, value):
+        """Returns the keys indexed under the value."""
+        return self.keys_by_value.get(value, set())
+
+
+class PhoneDigitIndex:
+    """Index of the digits of phone numbers, for prefix, suffix and infix searches.
+
+    Each number is filed once for every digit it can be searched from. For a
+    given start, the rest of every number is packed together with the slot of
+    the number into one integer and kept in a sorted array, so the numbers with
+    given digits at that start form one range found by bisection. Numbers added
+    since the arrays were sorted are checked one by one, and the writer calls
+    settle after every change to sort them in once there are more than a few;
+    removed ones are skipped until enough of them are dropped at once. Searches
+    only read the index.
+    """
+
+    DIGITS = 9
+    SLOT_BITS = 32
+    # Most numbers a search checks one by one.
+    PENDING_LIMIT = 256
+
+    def __init__(self):
+        self.entries = []  # (key, number) by slot, None once removed
+        self.slots_by_key = {}
+        self.suffixes = [array("Q") for _ in range(self.DIGITS)]
+        self.pending = []
+        self.removed = 0
+
+    def add(self, key, phone_numbers):
+        """Indexes the numbers under the key, replacing what was indexed before."""
+        self.remove(key)
+        slots = []
+        for phone_number in phone_numbers:
+            slots.append(len(self.entries))
+            self.entries.append((key, int(phone_number)))
+        if slots:
+            self.slots_by_key[key] = slots
+            self.pending.extend(slots)
+
+    def remove(self, key):
+        """Drops the numbers of the key."""
+        for slot in self.slots_by_key.pop(key, ()):
+            self.entries[slot] = None
+            self.removed += 1
+
+    def rebuild(self):
+        """Drops the removed numbers and sorts all numbers into the arrays."""
+        self.entries = [entry for entry in self.entries if entry is not None]
+        self.slots_by_key = {}
+        for slot, (key, _) in enumerate(self.entries):
+            self.slots_by_key.setdefault(key, []).append(slot)
+        for start in range(self.DIGITS):
+            modulus = 10 ** (self.DIGITS - start)
+            self.suffixes[start] = array(
+                "Q",
+                sorted(
+                    number % modulus << self.SLOT_BITS | slot
+                    for slot, (_, number) in enumerate(self.entries)
+                ),
+            )
+        self.pending = []
+        self.removed = 0
+
+    def settle(self):
+        """Sorts the pending numbers in once a search would check too many of them.
+
+        Many removed numbers are dropped by rebuilding the index instead.
+        """
+        if self.removed > max(1024, len(self.entries) // 16):
+            self.rebuild()
+        elif len(self.pending) > self.PENDING_LIMIT:
+            for start in range(self.DIGITS):
+                modulus = 10 ** (self.DIGITS - start)
+                suffixes = self.suffixes[start] + array(
+                    "Q",
+                    sorted(
+                        self.entries[slot][1] % modulus << self.SLOT_BITS | slot
+                        for slot in self.pending
+                        if self.entries[slot] is not None
+                    ),
+                )
+                # Two sorted runs, which sorting merges in linear time.
+                self.suffixes[start] = array("Q", sorted(suffixes))
+            self.pending = []
+
+    def search(self, digits, where="any"):
+        """Returns (key, phone number) for every number with the digits.
+
+        where is "prefix" or "suffix" to match only the start or the end of the
+        number, or "any" to match the digits anywhere in it.
+        """
+        if not (digits.isascii() and digits.isdigit()) or len(digits) > self.DIGITS:
+            return []
+        length = len(digits)
+        if where == "prefix":
+            starts = [0]
+        elif where == "suffix":
+            starts = [self.DIGITS - length]
+        else:
+            starts = range(self.DIGITS - length + 1)
+        query = int(digits)
+        slot_mask = (1 << self.SLOT_BITS) - 1
+        slots = set()
+        for start in starts:
+            scale = 10 ** (self.DIGITS - start - length)
+            suffixes = self.suffixes[start]
+            low = bisect_left(suffixes, query * scale << self.SLOT_BITS)
+            high = bisect_left(suffixes, (query + 1) * scale << self.SLOT_BITS)
+            slots.update(packed & slot_mask for packed in suffixes[low:high])
+        for slot in self.pending:
+            entry = self.entries[slot]
+            if entry is None:
+                continue
+            text = f"{entry[1]:09d}"
+            if (
+                text.startswith(digits)
+                if where == "prefix"
+                else text.endswith(digits)
+                if where == "suffix"
+                else digits in text
+            ):
+                slots.add(slot)
+        found = []
+        for slot in sorted(slots):
+            entry = self.entries[slot]
+            if entry is not None:
+                found.append((entry[0], f"{entry[1]:09d}"))
+        return found
+
+
+UpcomingBirthday = namedtuple("UpcomingBirthday", ["record", "birthday", "days"])
+
+
+def birthday_in_year(birthdate, year):
+    """Returns the birthday in the given year; Feb 29 moves to Feb 28 in common years."""
+    if birthdate.month == 2 and birthdate.day == 29 and not calendar.isleap(year):
+        return date(year, 2, 28)
+    return birthdate.replace(year=year)
+
+
+class BirthdayIndex:
+    """Calendar of 366 day-of-year buckets with the IDs of records born on that day."""
+
+    LEAP_YEAR = 2000
+    FEB_29 = 59
+
+    def __init__(self):
+        self.buckets = [set() for _ in range(366)]
+        self.bucket_by_key = {}
+
+    @classmethod
+    def bucket(cls, month, day):
+        """Returns the bucket of the day, counted in a leap year so Feb 29 has one."""
+        return date(cls.LEAP_YEAR, month, day).timetuple().tm_yday - 1
+
+    def add(self, key, birthdate):
+        """Files the key under the day of the birthdate, replacing its old entry."""
+        self.remove(key)
+        bucket = self.bucket(birthdate.month, birthdate.day)
+        self.buckets[bucket].add(key)
+        self.bucket_by_key[key] = bucket
+
+    def remove(self, key):
+        """Drops the key from the calendar."""
+        bucket = self.bucket_by_key.pop(key, None)
+        if bucket is not None:
+            self.buckets[bucket].discard(key)
+
+    @classmethod
+    def window(cls, today, days):
+        """Yields (day, days to it, buckets) for each of the next days, soonest first.
+
+        A window longer than a year stops once every bucket has been seen, and
+        no bucket is returned twice.
+        """
+        seen = set()
+        for offset in range(min(days, 365) + 1):
+            day = today + timedelta(days=offset)
+            buckets = [cls.bucket(day.month, day.day)]
+            if buckets[0] == cls.FEB_29 - 1 and not calendar.isleap(day.year):
+                buckets.append(cls.FEB_29)
+            buckets = [bucket for bucket in buckets if bucket not in seen]
+            seen.update(buckets)
+            yield day, offset, buckets
+
+    def upcoming(self, today, days):
+        """Yields (birthday, days to it, keys) for the next days, soonest first.
+
+        Only the buckets of the days in the window are visited.
+        """
+        for day, offset, buckets in self.window(today, days):
+            keys = set()
+            for bucket in buckets:
+                keys |= self.buckets[bucket]
+            if keys:
+                yield day, offset, keys
+
+
+class IdAllocator:
+    """Hands out the smallest free record ID.
+
+    Released IDs wait on a min-heap and IDs above the high-water mark have never
+    been used, so allocating and releasing cost O(log n) without looking at the
+    records. IDs taken off the free set are dropped from the heap lazily.
+    """
+
+    def __init__(self, high_water=0):
+        self.high_water = high_water
+        self.heap = []
+        self.free = set()
+
+    @classmethod
+    def from_ids(cls, used_ids):
+        """Rebuilds the allocator from the IDs in use, treating gaps as released."""
+        allocator = cls(max(used_ids, default=0))
+        allocator.heap = [
+            record_id
+            for record_id in range(1, allocator.high_water + 1)
+            if record_id not in used_ids
+        ]
+        allocator.free = set(allocator.heap)
+        return allocator
+
+    def allocate(self):
+        """Returns the smallest free ID and marks it as used."""
+        while self.heap:
+            record_id = heapq.heappop(self.heap)
+            if record_id in self.free:
+                self.free.remove(record_id)
+                return record_id
+        self.high_water += 1
+        return self.high_water
+
+    def release(self, record_id):
+        """Returns the ID to the pool."""
+        if record_id <= self.high_water and record_id not in self.free:
+            self.free.add(record_id)
+            heapq.heappush(self.heap, record_id)
+
+    def reserve(self, record_id):
+        """Marks the ID as used, e.g. while replaying a journal."""
+        if record_id > self.high_water:
+            previous_high_water, self.high_water = self.high_water, record_id
+            for free_id in range(previous_high_water + 1, record_id):
+                self.release(free_id)
+        else:
+            self.free.discard(record_id)
 
 
 class AddressBook(UserDict):
+    # Structured queries may use the in-memory indexes (see query.py).
+    query_indexes = True
+
     def __init__(self):
         super().__init__()
-        self.next_id = 1
-        self.free_ids = set()
+        self.ids = IdAllocator()
+        self.name_index = NGramIndex()
+        self.contact_index = NGramIndex()
+        self.birthday_index = BirthdayIndex()
+        self.fuzzy_index = FuzzyNameIndex()
+        self.name_trie = NameTrie()
+        self.phone_index = PhoneDigitIndex()
+        self.domain_index = ValueIndex()
+        self.city_index = ValueIndex()
+        self.positions = {}
+        self.next_position = 0
+        self.journal = None
+        # Records added and removed, so cursors know when the IDs changed.
+        self.id_changes = 0
+
+    def log_change(self, *entry):
+        """Writes the change to the journal, if the book has one."""
+        if self.journal is not None:
+            self.journal.append(entry)
+
+    def close(self):
+        """Closes the journal, if the book has one, and what else the storage holds."""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def index_record(self, record_id, record):
+        """Adds the record to the search indexes."""
+        if record_id not in self.positions:
+            self.positions[record_id] = self.next_position
+            self.next_position += 1
+        self.name_index.add(record_id, [record.name.value])
+        self.fuzzy_index.add(record_id, record.name.value)
+        self.name_trie.add(record_id, record.name.value)
+        self.contact_index.add(
+            record_id,
+            [email_address.value for email_address in record.email_addresses],
+        )
+        self.phone_index.add(
+            record_id, [phone_number.value for phone_number in record.phone_numbers]
+        )
+        self.domain_index.add(
+            record_id,
+            [
+                email_address.domain.casefold()
+                for email_address in record.email_addresses
+            ],
+        )
+        self.city_index.add(
+            record_id, [fold_text(record.address.city)] if record.address else []
+        )
+        if record.birthdate:
+            self.birthday_index.add(record_id, record.birthdate.date)
+        else:
+            self.birthday_index.remove(record_id)
+
+    def unindex_record(self, record_id):
+        """Removes the record from the search indexes."""
+        self.name_index.remove(record_id)
+        self.fuzzy_index.remove(record_id)
+        self.name_trie.remove(record_id)
+        self.contact_index.remove(record_id)
+        self.phone_index.remove(record_id)
+        self.domain_index.remove(record_id)
+        self.city_index.remove(record_id)
+        self.birthday_index.remove(record_id)
+        self.positions.pop(record_id, None)
+
+    def reindex_record(self, record_id):
+        """Refreshes the search indexes after the record was edited."""
+        self.index_record(record_id, self.data[record_id])
+
+    def update_record(self, record_id):
+        """Reindexes and journals the record after it was edited."""
+        self.reindex_record(record_id)
+        self.settle_indexes()
+        self.log_change("edit", record_id, self.data[record_id])
+
+    def rebuild_index(self):
+        """Indexes all records from scratch, e.g. after loading the book from a file."""
+        self.name_index = NGramIndex()
+        self.contact_index = NGramIndex()
+        self.birthday_index = BirthdayIndex()
+        self.fuzzy_index = FuzzyNameIndex()
+        self.name_trie = NameTrie()
+        self.phone_index = PhoneDigitIndex()
+        self.domain_index = ValueIndex()
+        self.city_index = ValueIndex()
+        self.positions = {}
+        self.next_position = 0
+        for record_id, record in self.data.items():
+            self.index_record(record_id, record)
+        self.settle_indexes()
+
+    def settle_indexes(self):
+        """Does the index upkeep after a change, so that searches only read."""
+        self.phone_index.settle()
+
+    def ordered_ids(self, record_ids):
+        """Sorts the record IDs in the order of the book."""
+        return sorted(record_ids, key=self.positions.__getitem__)
 
     def add_record(self, record: Record):
         """Adds an entry to the address book with ID management."""
-        while self.next_id in self.data or self.next_id in self.free_ids:
-            self.next_id += 1
-        if self.free_ids:
-            record.id = min(self.free_ids)
-            self.free_ids.remove(record.id)
-        else:
-            record.id = self.next_id
-            self.next_id += 1
-        self.data[record.id] = record
+        self.add_records([record])
         print(f"Dodano wpis z ID: {record.id}.")
 
+    def add_records(self, records):
+        """Adds many entries at once without reporting each of them."""
+        for record in records:
+            record.id = self.ids.allocate()
+            self.data[record.id] = record
+            self.index_record(record.id, record)
+            self.log_change("add", record.id, record)
+        self.id_changes += len(records)
+        self.settle_indexes()
+
+    def remove_record(self, record_id):
+        """Removes the record with the ID from the book, its indexes and journal."""
+        del self.data[record_id]
+        self.id_changes += 1
+        self.unindex_record(record_id)
+        self.settle_indexes()
+        self.log_change("delete", record_id)
+        self.ids.release(record_id)  # Add the ID back to the free ID pool
+
     def delete_record_by_id(self):
         """Deletes a record based on ID."""
         user_input = input("Podaj ID rekordu, który chcesz usunąć: ").strip()
@@ -205,8 +1160,7 @@ class AddressBook(UserDict):
         try:
             record_id = int(record_id_str)
             if record_id in self.data:
-                del self.data[record_id]
-                self.free_ids.add(record_id)
+                self.remove_record(record_id)
                 print(f"Usunięto rekord o ID: {record_id}.")
             else:
                 print("Nie znaleziono rekordu o podanym ID.")
@@ -215,50 +1169,103 @@ class AddressBook(UserDict):
 
     def find_record(self, search_term):
         """Finds entries containing the exact phrase provided."""
+        phone_ids = {record.id for record, _ in self.find_phone_numbers(search_term)}
         found_records = []
-        for record in self.data.values():
+        for record in self.search_candidates(search_term, phone_ids):
+            if record.id in phone_ids:
+                found_records.append(record)
+                continue
             if search_term.lower() in record.name.value.lower():
                 found_records.append(record)
                 continue
-            for phone_number in record.phone_numbers:
-                if search_term in phone_number.value:
-                    found_records.append(record)
-                    break
             for email_address in record.email_addresses:
                 if search_term in email_address.value:
                     found_records.append(record)
                     break
         return found_records
 
+    def search_candidates(self, search_term, record_ids=frozenset()):
+        """Returns the records that may contain the phrase, in the order of the book.
+
+        Phone numbers are searched with the digit index; the IDs it found are
+        passed in to be included.
+        """
+        name_ids = self.name_index.candidates(search_term)
+        contact_ids = self.contact_index.candidates(search_term)
+        if name_ids is None or contact_ids is None:
+            return self.data.values()
+        return [
+            self.data[record_id]
+            for record_id in self.ordered_ids(name_ids | contact_ids | record_ids)
+        ]
+
+    def find_phone_numbers(self, digits, where="any"):
+        """Finds the phone numbers with the digits, as (record, phone number) pairs.
+
+        where is "prefix" or "suffix" to match only the start or the end of a
+        number, or "any" to match the digits anywhere in it.
+        """
+        return [
+            (self.data[record_id], phone_number)
+            for record_id, phone_number in self.phone_index.search(digits, where)
+        ]
+
+    def find_similar_records(self, search_term, limit=5):
+        """Finds the records whose names are closest to the phrase, best first.
+
+        Tolerates typos and missing Polish diacritics; returns (record, score)
+        pairs with scores between 0 and 1.
+        """
+        return [
+            (self.data[record_id], score)
+            for record_id, score in self.fuzzy_index.search(search_term, limit)
+        ]
+
+    def complete_name(self, prefix, limit=5):
+        """Returns the most common words of names starting with the prefix."""
+        return self.name_trie.complete(prefix, limit)
+
+    def query(self, text, today=None):
+        """Returns the records matching a query such as "name:kowal bday<30"."""
+        from query import QueryPlan
+
+        return QueryPlan(self, text, today).execute()
+
+    def query_candidates(self, conditions, today):
+        """Returns the IDs of the records the storage finds for query conditions.
+
+        Queries ask for them when query_indexes is off. The result is None, or
+        the IDs in the order of the book and the conditions used to find them; a
+        book in memory has no storage to ask, so every record is checked.
+        """
+        return None
+
     def find_records_by_name(self, name):
         """Finds records that match the given name and surname."""
         matching_records = []
-        for record_id, record in self.data.items():
+        record_ids = self.name_index.candidates(name)
+        if record_ids is None:
+            record_ids = self.data.keys()
+        else:
+            record_ids = self.ordered_ids(record_ids)
+        for record_id in record_ids:
+            record = self.data[record_id]
             if name.lower() in record.name.value.lower():
                 matching_records.append((record_id, record))
         return matching_records
 
-    def upcoming_birthdays(self, days):
-        today = datetime.now().date()
-        days = int(days)
-        print(today)
+    def upcoming_birthdays(self, days, today=None):
+        """Returns the birthdays within the next days, soonest first."""
+        today = today or datetime.now().date()
         upcoming_birthdays = []
-        for record in self.data.values():
-            if record.birthdate:
-
-                bday = datetime.strptime(record.birthdate.value, "%Y-%m-%d").date()
-                print(bday)
-                next_birthday = bday.replace(year=today.year)
-                if today > next_birthday:
-                    next_birthday = next_birthday.replace(year=today.year + 1)
-
-                days_to = (next_birthday - today).days
-                print(days_to)
-                if (next_birthday - today).days <= days:
-                    upcoming_birthdays.append(record.name.value)
-
-        element = ", ".join(upcoming_birthdays)
-        print(f"W ciągu najblizszych {days} dni, urodziny mają: \n{element}")
+        for birthday, days_to, record_ids in self.birthday_index.upcoming(
+            today, int(days)
+        ):
+            for record_id in self.ordered_ids(record_ids):
+                upcoming_birthdays.append(
+                    UpcomingBirthday(self.data[record_id], birthday, days_to)
+                )
+        return upcoming_birthdays
 
     def delete_record(self):
         """Deletes the record based on the selected ID after searching by name."""
@@ -270,16 +1277,14 @@ class AddressBook(UserDict):
             return
 
         print("Znaleziono następujące pasujące rekordy:")
+        today = date.today()
         for record_id, record in matching_records:
-            print(f"ID: {record_id}, Rekord: {record}")
+            print(f"ID: {record_id}, Rekord: {record.to_string(today)}")
 
         try:
             record_id_to_delete = int(input("Podaj ID rekordu, który chcesz usunąć: "))
             if record_id_to_delete in self.data:
-                del self.data[record_id_to_delete]
-                self.free_ids.add(
-                    record_id_to_delete
-                )  # Add the ID back to the free ID pool
+                self.remove_record(record_id_to_delete)
                 print(f"Usunięto rekord o ID: {record_id_to_delete}.")
             else:
                 print("Nie znaleziono rekordu o podanym ID.")
@@ -291,29 +1296,85 @@ class AddressBook(UserDict):
         if not self.data:
             print("Książka adresowa jest pusta.")
             return
-        for name, record in self.data.items():
-            print(record)
+        today = date.today()
+        print_lines(record.to_string(today) for record in self.data.values())
+
+    def cursor(self, page_size=5, after_key=None):
+        """Returns a cursor paging through the records, optionally after an ID."""
+        return AddressBookCursor(self, page_size, after_key)
+
+    def __iter__(self):
+        """Returns an iterator over pages of the address book records."""
+        return self.cursor()
+
+
+class AddressBookCursor:
+    """Pages through the records of a book in the order of their IDs.
+
+    Every cursor keeps its own position, so several of them can page through
+    the same book at once. The position is the last ID shown, and a page starts
+    at the first ID above it, found by bisecting the sorted IDs, so a record
+    deleted since, even the last one shown, does not lose the place. The IDs
+    are sorted again after records were added or removed; most are in order
+    already.
+    """
+
+    def __init__(self, book, page_size=5, after_key=None):
+        self.book = book
+        self.page_size = page_size
+        self.last_key = after_key
+        self.keys = None
+        self.id_changes = None
+
+    def next_page(self):
+        """Returns the next page of records, empty at the end of the book."""
+        if self.id_changes != self.book.id_changes:
+            self.keys = sorted(self.book.data)
+            self.id_changes = self.book.id_changes
+        place = 0 if self.last_key is None else bisect_right(self.keys, self.last_key)
+        page = []
+        while len(page) < self.page_size and place < len(self.keys):
+            key = self.keys[place]
+            place += 1
+            if key in self.book.data:
+                page.append(self.book.data[key])
+                self.last_key = key
+        return page
 
     def __iter__(self):
-        """Returns an iterator over the address book records."""
-        self.current = 0
         return self
 
     def __next__(self):
-        if self.current < len(self.data):
-            records = list(self.data.values())[self.current : self.current + 5]
-            self.current += 5
-            return records
-        else:
+        records = self.next_page()
+        if not records:
             raise StopIteration
+        return records
+
+
+def select_record(book, name):
+    """Returns the ID of the record with the name, asking which one if several match."""
+    matching_records = book.find_records_by_name(name)
+    if len(matching_records) <= 1:
+        return matching_records[0][0] if matching_records else None
+
+    print("Znaleziono następujące pasujące rekordy:")
+    today = date.today()
+    for record_id, record in matching_records:
+        print(f"ID: {record_id}, Rekord: {record.to_string(today)}")
+    try:
+        record_id = int(input("Podaj ID rekordu, który chcesz edytować: "))
+    except ValueError:
+        return None
+    return record_id if record_id in dict(matching_records) else None
 
 
 def edit_record(book):
     """Edits an existing record in the address book."""
     name_to_edit = input("Wprowadź imię i nazwisko które chcesz edytować: ")
-    if name_to_edit in book.data:
-        record = book.data[name_to_edit]
-        print(f"Edytowanie: {name_to_edit}.")
+    record_id = select_record(book, name_to_edit)
+    if record_id is not None:
+        record = book.data[record_id]
+        print(f"Edytowanie: {record.name.value}.")
 
         # Name and surname edit
         new_name_input = input(
@@ -377,29 +1438,245 @@ def edit_record(book):
         else:
             print("Brak adresów e-mail.")
 
+        book.update_record(record_id)
         print("Wpis zaktualizowany.")
     else:
         print("Wpisu nie znaleziono.")
 
 
+class Journal:
+    """Append-only log of changes kept next to a pickled snapshot.
+
+    Entries are pickled and length-prefixed, so a save costs only the changes
+    made since the previous one. Compaction seals the log and folds it into a
+    new snapshot in a background thread; the snapshot is written to a temporary
+    file and atomically renamed, so a crash at any point leaves a loadable state.
+
+    The state type is called without arguments for an empty state, converts an
+    unpickled snapshot with from_snapshot and replays entries with apply.
+    """
+
+    HEADER = struct.Struct("<I")
+    COMPACT_MIN_SIZE = 1 << 20
+
+    def __init__(self, filename, state_type):
+        self.filename = filename
+        self.state_type = state_type
+        self.log_filename = filename + ".journal"
+        self.sealed_filename = filename + ".journal.sealed"
+        self.log = None
+        self.compaction = None
+
+    @classmethod
+    def read_payloads(cls, file):
+        """Streams the raw entries of an open log file, stopping at a torn tail."""
+        while True:
+            header = file.read(cls.HEADER.size)
+            if len(header) < cls.HEADER.size:
+                return
+            (length,) = cls.HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            yield payload
+
+    @classmethod
+    def read_entries(cls, filename):
+        """Streams the entries of a log file."""
+        try:
+            file = open(filename, "rb")
+        except FileNotFoundError:
+            return
+        with file:
+            for payload in cls.read_payloads(file):
+                yield load_pickle(io.BytesIO(payload))
+
+    def read_snapshot(self):
+        """Returns the last snapshot, or an empty state if there is none yet."""
+        try:
+            with open(self.filename, "rb") as file:
+                return self.state_type.from_snapshot(load_pickle(file))
+        except FileNotFoundError:
+            return self.state_type()
+
+    def load(self):
+        """Returns the snapshot with the sealed and the current log replayed on it."""
+        state = self.read_snapshot()
+        for filename in (self.sealed_filename, self.log_filename):
+            for entry in self.read_entries(filename):
+                state.apply(entry)
+        return state
+
+    def open(self):
+        """Opens the log for appending, cutting off an entry torn by a crash."""
+        valid_size = 0
+        try:
+            with open(self.log_filename, "rb") as file:
+                for _ in self.read_payloads(file):
+                    valid_size = file.tell()
+        except FileNotFoundError:
+            pass
+        self.log = open(self.log_filename, "ab")
+        self.log.truncate(valid_size)
+        self.log.seek(0, os.SEEK_END)
+
+    def replace_snapshot(self, state):
+        """Writes the snapshot to a temporary file and renames it over the old one."""
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "wb") as file:
+            pickle.dump(state, file, pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, self.filename)
+
+    def write_state(self, state):
+        """Replaces the snapshot and both logs with the given state."""
+        if self.log is not None:
+            self.log.close()
+        self.replace_snapshot(state)
+        for filename in (self.sealed_filename, self.log_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.log = open(self.log_filename, "ab")
+
+    def exists(self):
+        """Checks whether there is anything on disk to load."""
+        return any(
+            os.path.exists(filename)
+            for filename in (self.filename, self.sealed_filename, self.log_filename)
+        )
+
+    def append(self, entry):
+        """Appends the entry to the log."""
+        if self.log is None:
+            self.open()
+        payload = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        self.log.write(self.HEADER.pack(len(payload)))
+        self.log.write(payload)
+        self.log.flush()
+
+    def sync(self):
+        """Makes the appended entries durable."""
+        if self.log is not None:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+
+    def should_compact(self):
+        """Checks whether the log has grown large compared to the snapshot."""
+        if self.log is None:
+            return False
+        try:
+            snapshot_size = os.path.getsize(self.filename)
+        except FileNotFoundError:
+            snapshot_size = 0
+        log_size = self.log.tell()
+        return log_size >= self.COMPACT_MIN_SIZE and log_size * 2 >= snapshot_size
+
+    def compact(self, background=True):
+        """Seals the log and folds it into a new snapshot."""
+        if self.compaction is not None and self.compaction.is_alive():
+            return
+        if not os.path.exists(self.sealed_filename):
+            self.sync()
+            if self.log is not None:
+                self.log.close()
+            os.replace(self.log_filename, self.sealed_filename)
+            self.log = open(self.log_filename, "ab")
+        self.compaction = threading.Thread(target=self.write_snapshot)
+        self.compaction.start()
+        if not background:
+            self.compaction.join()
+
+    def write_snapshot(self):
+        """Writes the snapshot with the sealed log applied and drops the sealed log."""
+        try:
+            state = self.read_snapshot()
+            for entry in self.read_entries(self.sealed_filename):
+                state.apply(entry)
+            self.replace_snapshot(state)
+            os.remove(self.sealed_filename)
+        except Exception as e:
+            print(f"Błąd przy kompaktowaniu dziennika {self.log_filename}: {e}")
+
+    def close(self):
+        """Syncs and closes the log, waiting for a running compaction."""
+        self.sync()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        if self.compaction is not None:
+            self.compaction.join()
+
+
+class BookState:
+    """Records of an address book and their ID allocator, as its journal keeps them."""
+
+    def __init__(self, records=None, ids=None):
+        self.records = {} if records is None else records
+        self.ids = IdAllocator.from_ids(self.records) if ids is None else ids
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        # Books saved before the journal existed pickle only the records.
+        if isinstance(snapshot, dict):
+            return cls(snapshot)
+        return snapshot
+
+    def apply(self, entry):
+        """Replays one journal entry; replaying an entry twice changes nothing."""
+        operation, record_id = entry[0], entry[1]
+        if operation == "delete":
+            if self.records.pop(record_id, None) is not None:
+                self.ids.release(record_id)
+        else:
+            self.ids.reserve(record_id)
+            self.records[record_id] = entry[2]
+
+
+class BotUnpickler(pickle.Unpickler):
+    """Resolves classes pickled by the bot whether it ran as a script or a module."""
+
+    def find_class(self, module, name):
+        if module in ("__main__", "assistant_bot"):
+            module = __name__
+        return super().find_class(module, name)
+
+
+def load_pickle(file):
+    """Unpickles an object written by the bot."""
+    return BotUnpickler(file).load()
+
+
 def save_address_book(book, filename="address_book.pkl"):
     try:
-        with open(filename, "wb") as file:
-            pickle.dump(book.data, file)
+        if book.journal is None:
+            book.journal = Journal(filename, BookState)
+            book.journal.write_state(BookState(book.data, book.ids))
+        book.journal.sync()
+        if book.journal.should_compact():
+            book.journal.compact()
     except Exception as e:
         print(f"Błąd przy zapisie książki adresowej: {e}")
 
 
 def load_address_book(filename="address_book.pkl"):
+    journal = Journal(filename, BookState)
+    if not journal.exists():
+        print("Plik nie istnieje, tworzenie nowej książki adresowej.")
+        book = AddressBook()
+        book.journal = journal
+        return book
     try:
-        with open(filename, "rb") as file:
-            data = pickle.load(file)
+        state = journal.load()
+        journal.open()
         book = AddressBook()
-        book.data = data
+        book.data = state.records
+        book.ids = state.ids
+        book.rebuild_index()
+        book.journal = journal
+        if os.path.exists(journal.sealed_filename):
+            journal.compact()
         return book
-    except FileNotFoundError:
-        print("Plik nie istnieje, tworzenie nowej książki adresowej.")
-        return AddressBook()
     except Exception as e:
         print(f"Błąd przy ładowaniu książki adresowej: {e}")
         return AddressBook()
@@ -488,108 +1765,810 @@ def create_record():
     return record
 
 
+class FullTextIndex:
+    """Inverted index from the words of texts to the documents with them.
+
+    Words are folded like names, so "żółw" also finds "zolw". Each word keeps
+    its positions in every document, which give the word counts for BM25
+    ranking and answer phrase queries.
+
+    Removing a document only marks it deleted; searches skip it, and its
+    postings are dropped all at once when deleted documents make up a quarter
+    of the index. Until then they still count in how common a word is.
+    """
+
+    WORD = re.compile(r"\w+")
+    PHRASE = re.compile(r'"([^"]*)"')
+    K1 = 1.2
+    B = 0.75
+    # Share of deleted documents at which their postings are dropped.
+    PURGE_RATIO = 0.25
+
+    def __init__(self):
+        self.postings = {}  # word: {document: positions}
+        self.lengths = {}  # document: number of words
+        self.total_length = 0
+        self.deleted = set()
+
+    @classmethod
+    def words(cls, text):
+        """Returns the folded words of the text."""
+        return cls.WORD.findall(fold_text(text))
+
+    def __len__(self):
+        return len(self.lengths) - len(self.deleted)
+
+    def add(self, document, text):
+        """Indexes the text under the document, a number not used before."""
+        words = self.words(text)
+        positions = {}
+        for position, word in enumerate(words):
+            positions.setdefault(word, []).append(position)
+        for word, word_positions in positions.items():
+            self.postings.setdefault(word, {})[document] = tuple(word_positions)
+        self.lengths[document] = len(words)
+        self.total_length += len(words)
+
+    def remove(self, document):
+        """Marks the document deleted, dropping the deleted ones if there are many."""
+        self.total_length -= self.lengths[document]
+        self.deleted.add(document)
+        if len(self.deleted) > self.PURGE_RATIO * len(self.lengths):
+            self.purge()
+
+    def replace(self, document, old_text, text):
+        """Indexes the document anew with the text in place of the old one."""
+        self.total_length -= self.lengths[document]
+        for word in set(self.words(old_text)):
+            documents = self.postings[word]
+            del documents[document]
+            if not documents:
+                del self.postings[word]
+        self.add(document, text)
+
+    def purge(self):
+        """Drops the postings of the deleted documents."""
+        deleted = self.deleted
+        for word, documents in list(self.postings.items()):
+            for document in deleted.intersection(documents):
+                del documents[document]
+            if not documents:
+                del self.postings[word]
+        for document in deleted:
+            del self.lengths[document]
+        deleted.clear()
+
+    def phrase_documents(self, phrase):
+        """Returns the documents with the words of the phrase one after another."""
+        postings = [self.postings.get(word) for word in phrase]
+        if not all(postings):
+            return set()
+        found = set()
+        for document in min(postings, key=len):
+            if document in self.deleted or not all(
+                document in documents for documents in postings
+            ):
+                continue
+            starts = set(postings[0][document])
+            for offset, documents in enumerate(postings[1:], start=1):
+                starts &= {position - offset for position in documents[document]}
+                if not starts:
+                    break
+            else:
+                found.add(document)
+        return found
+
+    def parse(self, query):
+        """Returns the folded words of the query and its phrases in quotes."""
+        phrases = [
+            words for words in map(self.words, self.PHRASE.findall(query)) if words
+        ]
+        words = self.words(self.PHRASE.sub(" ", query))
+        words.extend(word for phrase in phrases for word in phrase)
+        return words, phrases
+
+    def required_documents(self, phrases):
+        """Returns the documents with all of the phrases, or None if there are none."""
+        required = None
+        for phrase in phrases:
+            found = self.phrase_documents(phrase)
+            required = found if required is None else required & found
+            if not required:
+                break
+        return required
+
+    def matches(self, query):
+        """Returns the documents the query finds, unranked."""
+        words, phrases = self.parse(query)
+        required = self.required_documents(phrases)
+        if required is not None:
+            return required
+        return set().union(*(self.postings.get(word, ()) for word in words)) - (
+            self.deleted
+        )
+
+    def search(self, query, limit=10):
+        """Returns up to limit (document, score) pairs matching the query, best first.
+
+        Words in quotes are phrases every document found must contain; the
+        other words are optional and only raise the score of those having them.
+        """
+        words, phrases = self.parse(query)
+        count = len(self)
+        if not count or not words:
+            return []
+        required = self.required_documents(phrases)
+        if required is not None and not required:
+            return []
+        average_length = self.total_length / count or 1
+        deleted = self.deleted
+        scores = {}
+        for word in dict.fromkeys(words):
+            documents = self.postings.get(word)
+            if not documents:
+                continue
+            weight = math.log(
+                1 + max(count - len(documents) + 0.5, 0.5) / (len(documents) + 0.5)
+            )
+            if required is not None and len(required) < len(documents):
+                matches = (
+                    (document, documents[document])
+                    for document in required
+                    if document in documents
+                )
+            else:
+                matches = documents.items()
+            for document, positions in matches:
+                if document in deleted or (
+                    required is not None and document not in required
+                ):
+                    continue
+                frequency = len(positions)
+                norm = self.K1 * (
+                    1 - self.B + self.B * self.lengths[document] / average_length
+                )
+                scores[document] = scores.get(document, 0.0) + weight * (
+                    frequency * (self.K1 + 1) / (frequency + norm)
+                )
+        return heapq.nlargest(
+            limit, scores.items(), key=lambda item: (item[1], -item[0])
+        )
+
+
+class TagIndex:
+    """Index from tags to the IDs of the notes having them."""
+
+    def __init__(self):
+        self.note_ids = {}  # tag: set of note IDs
+        self.sorted_tags = []
+
+    def add(self, tag, note_id):
+        note_ids = self.note_ids.get(tag)
+        if note_ids is None:
+            note_ids = self.note_ids[tag] = set()
+            self.sorted_tags.insert(bisect_left(self.sorted_tags, tag), tag)
+        note_ids.add(note_id)
+
+    def remove(self, tags, note_id):
+        """Drops the note from the given tags of it."""
+        for tag in tags:
+            note_ids = self.note_ids[tag]
+            note_ids.discard(note_id)
+            if not note_ids:
+                del self.note_ids[tag]
+                del self.sorted_tags[bisect_left(self.sorted_tags, tag)]
+
+    def match_all(self, tags):
+        """Returns the IDs of the notes having every one of the tags."""
+        postings = sorted((self.note_ids.get(tag, set()) for tag in tags), key=len)
+        if not postings:
+            return set()
+        found = set(postings[0])
+        for note_ids in postings[1:]:
+            if not found:
+                break
+            found &= note_ids
+        return found
+
+    def match_any(self, tags):
+        """Returns the IDs of the notes having at least one of the tags."""
+        return set().union(*(self.note_ids.get(tag, ()) for tag in tags))
+
+
+class CreationIndex:
+    """Note IDs sorted by the time the notes were created, in compact arrays.
+
+    Notes are mostly added in time order, so adding one is usually an append.
+    """
+
+    def __init__(self):
+        self.times = array("d")  # POSIX timestamps, ascending
+        self.note_ids = array("Q")  # the ID of the note created at each time
+
+    def add(self, note_id, created_at):
+        timestamp = created_at.timestamp()
+        place = bisect_right(self.times, timestamp)
+        if place == len(self.times):
+            self.times.append(timestamp)
+            self.note_ids.append(note_id)
+        else:
+            self.times.insert(place, timestamp)
+            self.note_ids.insert(place, note_id)
+
+    def remove(self, note_id, created_at):
+        place = bisect_left(self.times, created_at.timestamp())
+        while self.note_ids[place] != note_id:
+            place += 1
+        del self.times[place]
+        del self.note_ids[place]
+
+    def bounds(self, start=None, end=None):
+        """Returns the places of the notes created from start until before end."""
+        low = 0 if start is None else bisect_left(self.times, start.timestamp())
+        if end is None:
+            high = len(self.times)
+        else:
+            high = bisect_left(self.times, end.timestamp())
+        return low, max(low, high)
+
+    def newest_first(self, start=None, end=None):
+        """Yields the IDs of the notes created in the range, newest first."""
+        low, high = self.bounds(start, end)
+        note_ids = self.note_ids
+        for place in range(high - 1, low - 1, -1):
+            yield note_ids[place]
+
+
 class Note:
     def __init__(self, content):
+        self.id = None
         self.content = content
         self.created_at = datetime.now()
-        self.tags = []
+        # Used as an ordered set.
+        self.tags = {}
+
+    def __setstate__(self, state):
+        # Notes saved by older versions keep their tags in a list and lack IDs.
+        if isinstance(state.get("tags"), list):
+            state["tags"] = dict.fromkeys(state["tags"])
+        state.setdefault("id", None)
+        self.__dict__.update(state)
 
     def add_tag(self, tag):
-        self.tags.append(tag)
+        self.tags[tag] = None
 
     def __str__(self):
         return f"Data dodania: {self.created_at},\nNotatka: {self.content}"
 
 
+class NotebookState:
+    """Notes of a notebook and the next note ID, as its journal keeps them.
+
+    Journal entries are (version, operation, *arguments), and the state
+    remembers the version of the last one applied. Replaying an entry already
+    in the state, as after a crash during compaction, changes nothing.
+    """
+
+    def __init__(self, notes=None, next_id=1, version=0):
+        # Notes by ID, in the order they were added. IDs increase and are
+        # never given out again, so they stay valid in the indexes.
+        self.notes = {} if notes is None else notes
+        self.next_id = next_id
+        self.version = version
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        if isinstance(snapshot, list):
+            # Notebooks saved before notes had IDs pickle only the notes.
+            for note_id, note in enumerate(snapshot, start=1):
+                note.id = note_id
+            snapshot = (len(snapshot) + 1, snapshot)
+        if isinstance(snapshot, tuple):
+            # Then as the next ID and the notes, before the journal existed.
+            next_id, notes = snapshot
+            return cls({note.id: note for note in notes}, next_id)
+        return snapshot
+
+    def apply(self, entry):
+        """Replays one journal entry."""
+        version, operation, *arguments = entry
+        if version <= self.version:
+            return
+        self.version = version
+        if operation == "add":
+            (note,) = arguments
+            self.notes[note.id] = note
+            self.next_id = max(self.next_id, note.id + 1)
+        elif operation == "edit":
+            note_id, content = arguments
+            self.notes[note_id].content = content
+        elif operation == "tag":
+            note_id, tag = arguments
+            self.notes[note_id].add_tag(tag)
+        elif operation == "delete":
+            (note_id,) = arguments
+            del self.notes[note_id]
+
+
 class Notebook:
     def __init__(self):
-        self.notes = []
-        # A list for storing notes, each note can be a dictionary or a class instance
+        self.state = NotebookState()
+        self.search_index = FullTextIndex()
+        self.tag_index = TagIndex()
+        self.creation_index = CreationIndex()
+        self.journal = None
+        # Version of the notes the saved indexes are at, None if none are saved.
+        self.indexes_version = None
+
+    @property
+    def notes(self):
+        return self.state.notes
+
+    def change(self, operation, *arguments):
+        """Makes a change to the notes and the indexes and writes it to the journal."""
+        entry = (self.state.version + 1, operation, *arguments)
+        self.apply(entry)
+        if self.journal is not None:
+            self.journal.append(entry)
+
+    def apply(self, entry, reindex=True):
+        """Applies a journal entry to the notes and, if reindex is set, the indexes."""
+        if entry[0] <= self.state.version:
+            return
+        if reindex:
+            self.index_change(entry)
+        self.state.apply(entry)
+
+    def index_change(self, entry):
+        """Updates the indexes for a journal entry about to be applied."""
+        version, operation, *arguments = entry
+        if operation == "add":
+            (note,) = arguments
+            self.search_index.add(note.id, note.content)
+            for tag in note.tags:
+                self.tag_index.add(tag, note.id)
+            self.creation_index.add(note.id, note.created_at)
+        elif operation == "edit":
+            note_id, content = arguments
+            self.search_index.replace(note_id, self.notes[note_id].content, content)
+        elif operation == "tag":
+            note_id, tag = arguments
+            self.tag_index.add(tag, note_id)
+        elif operation == "delete":
+            (note_id,) = arguments
+            note = self.notes[note_id]
+            self.search_index.remove(note_id)
+            self.tag_index.remove(note.tags, note_id)
+            self.creation_index.remove(note_id, note.created_at)
 
     def add_note(self, note_content):
         note = Note(note_content)
-        self.notes.append(note)
+        note.id = self.state.next_id
+        self.change("add", note)
         print("Notatka dodana.")
 
+    def edit_note(self, note_id, note_content):
+        if note_id in self.notes:
+            self.change("edit", note_id, note_content)
+            print(f"Zmieniono notatkę: {note_id}")
+        else:
+            print("Nie ma notatki o podanym ID.")
+
     def show_notes(self):
         if not self.notes:
             print("Nie ma notatek do wyświetlenia.")
         else:
             print("Twoje notatki:")
-            for i, note in enumerate(self.notes, start=1):
-                print(f"{i}. {note},\nTagi: {', '.join(note.tags)}")
+            for note in self.notes.values():
+                print(f"{note.id}. {note},\nTagi: {', '.join(note.tags)}")
 
     def delete_note(self, note_id):
         # Deleting a note
-        if 1 <= note_id <= len(self.notes):
-            del self.notes[note_id - 1]
+        if note_id in self.notes:
+            self.change("delete", note_id)
             print(f"Usunięto notatkę: {note_id}")
         else:
             print("Nie ma notatki o podanym ID.")
 
     def save_notes(self, filename="notes.pkl"):
+        """Makes the changes durable, folding the journal into a snapshot when large.
+
+        The indexes are saved whenever the snapshot is written, and whenever
+        the saved ones are missing or were rebuilt on load; the changes after
+        them are replayed onto them when the notes are loaded.
+        """
         try:
-            with open(filename, "wb") as file:
-                pickle.dump(self.notes, file)
+            if self.journal is None:
+                # Nothing was journalled, e.g. the notes failed to load, so the
+                # notes in memory are written whole.
+                self.journal = Journal(filename, NotebookState)
+                self.journal.write_state(self.state)
+                self.indexes_version = None
+            elif not os.path.exists(self.journal.filename):
+                self.journal.write_state(self.state)
+                self.indexes_version = None
+            self.journal.sync()
+            if self.journal.should_compact():
+                self.journal.compact()
+                self.indexes_version = None
+            if self.indexes_version is None:
+                self.save_indexes(filename)
         except Exception as e:
             print(f"Wystąpił błąd podczas zapisu notatek: {e}")
 
     def load_notes(self, filename="notes.pkl"):
-        try:
-            with open(filename, "rb") as file:
-                self.notes = pickle.load(file)
-        except FileNotFoundError:
+        """Loads the snapshot and replays the journal entry by entry on it.
+
+        The saved indexes are caught up with the entries newer than them; they
+        are only rebuilt when they are missing or do not match the notes.
+        """
+        self.close()
+        journal = Journal(filename, NotebookState)
+        if not journal.exists():
             print("Plik z notatkami nie istnieje. Tworzenie nowego pliku.")
-            self.notes = []
+        try:
+            self.state = journal.read_snapshot()
+            indexed_version = self.load_indexes(filename)
+            if indexed_version is not None and indexed_version < self.state.version:
+                # Changes already folded into the snapshot are missing from them.
+                indexed_version = None
+            for log_filename in (journal.sealed_filename, journal.log_filename):
+                for entry in journal.read_entries(log_filename):
+                    reindex = indexed_version is not None and entry[0] > indexed_version
+                    self.apply(entry, reindex)
+            if (
+                indexed_version is None
+                or indexed_version > self.state.version
+                or len(self.search_index) != len(self.notes)
+            ):
+                self.rebuild_indexes()
+                indexed_version = None
+            self.indexes_version = indexed_version
+            journal.open()
+            self.journal = journal
+            if os.path.exists(journal.sealed_filename):
+                journal.compact()
+                # The new snapshot may hold changes newer than the saved indexes.
+                self.indexes_version = None
         except Exception as e:
             print(f"Wystąpił błąd podczas wczytywania notatek: {e}")
 
+    def close(self):
+        """Closes the journal, waiting for a running compaction."""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def notes_of(self, note_ids):
+        """Returns the notes with the IDs in the order they were added."""
+        return [self.notes[note_id] for note_id in sorted(note_ids)]
+
+    def search_notes(self, query, limit=10):
+        """Returns up to limit (note, score) pairs matching the query, best first."""
+        return [
+            (self.notes[note_id], score)
+            for note_id, score in self.search_index.search(query, limit)
+        ]
+
+    def find_notes(
+        self,
+        start=None,
+        end=None,
+        tags=(),
+        match_all=True,
+        query="",
+        offset=0,
+        limit=10,
+    ):
+        """Returns a page of notes created from start until before end, newest first.
+
+        Only notes with the tags, all or any of them, and found by the query
+        are included. Those come from the tag and search indexes as sets of
+        IDs, which the IDs in the time range are checked against.
+        """
+        filters = []
+        if tags:
+            tag_index = self.tag_index
+            filters.append(
+                tag_index.match_all(tags) if match_all else tag_index.match_any(tags)
+            )
+        if query:
+            filters.append(self.search_index.matches(query))
+        filters.sort(key=len)
+        if filters and not filters[0]:
+            return []
+        found = (
+            note_id
+            for note_id in self.creation_index.newest_first(start, end)
+            if all(note_id in note_ids for note_ids in filters)
+        )
+        page = islice(found, offset, offset + limit)
+        return [self.notes[note_id] for note_id in page]
+
+    def rebuild_indexes(self):
+        self.search_index = FullTextIndex()
+        self.tag_index = TagIndex()
+        self.creation_index = CreationIndex()
+        for note in self.notes.values():
+            self.search_index.add(note.id, note.content)
+            for tag in note.tags:
+                self.tag_index.add(tag, note.id)
+        by_time = sorted(
+            (note.created_at.timestamp(), note.id) for note in self.notes.values()
+        )
+        self.creation_index.times.extend(timestamp for timestamp, _ in by_time)
+        self.creation_index.note_ids.extend(note_id for _, note_id in by_time)
+
+    def save_indexes(self, filename):
+        """Saves the indexes next to the notes file with the version they are at."""
+        temp_filename = filename + ".index.tmp"
+        with open(temp_filename, "wb") as file:
+            pickle.dump(
+                (
+                    self.state.version,
+                    self.search_index,
+                    self.tag_index,
+                    self.creation_index,
+                ),
+                file,
+                pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temp_filename, filename + ".index")
+        self.indexes_version = self.state.version
+
+    def load_indexes(self, filename):
+        """Loads the indexes saved with the notes and returns their version.
+
+        Returns None, with empty indexes, when there are none to load.
+        """
+        self.search_index = FullTextIndex()
+        self.tag_index = TagIndex()
+        self.creation_index = CreationIndex()
+        try:
+            with open(filename + ".index", "rb") as file:
+                version, search_index, tag_index, creation_index = load_pickle(file)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        self.search_index = search_index
+        self.tag_index = tag_index
+        self.creation_index = creation_index
+        return version
+
+
+def parse_tags(text):
+    """Returns the tags typed as "a, b" (all of them) or "a | b" (any), and which."""
+    match_all = "|" not in text
+    tags = [tag.strip() for tag in text.split("," if match_all else "|")]
+    return [tag for tag in tags if tag], match_all
+
 
 class Tag:
     def __init__(self, notes):
         self.notes = notes
 
-    def add_tag(self, note_index, tag):
-        if 1 <= note_index <= len(self.notes.notes):
-            note = self.notes.notes[note_index - 1]
-            note.add_tag(tag)
+    def add_tag(self, note_id, tag):
+        if note_id in self.notes.notes:
+            self.notes.change("tag", note_id, tag)
             print(f"Do notatki dodano tag: {tag}")
         else:
             print("Nieprawidłowy numer notatki.")
 
     def search_tag(self, tag):
-        notes_with_tag = []
-        for note in self.notes.notes:
-            if tag in note.tags:
-                notes_with_tag.append(note)
-        return notes_with_tag
-
-    def sort_tags(self):
-        sorted_dict = {}
-        all_tags = set(tag for note in self.notes.notes for tag in note.tags)
+        return self.search_tags([tag])
 
-        for tag in sorted(all_tags):
-            sorted_dict[tag] = [note for note in self.notes.notes if tag in note.tags]
+    def search_tags(self, tags, match_all=True):
+        """Returns the notes with all of the tags, or with any of them."""
+        tag_index = self.notes.tag_index
+        if match_all:
+            note_ids = tag_index.match_all(tags)
+        else:
+            note_ids = tag_index.match_any(tags)
+        return self.notes.notes_of(note_ids)
 
-        return sorted_dict
+    def sort_tags(self):
+        tag_index = self.notes.tag_index
+        return {
+            tag: self.notes.notes_of(tag_index.note_ids[tag])
+            for tag in tag_index.sorted_tags
+        }
+
+
+def open_address_book(storage="pickle", shards=None):
+    """Opens the address book kept in the given way."""
+    if storage == "sqlite":
+        from sqlite_store import SQLiteAddressBook
+
+        return SQLiteAddressBook()
+    if storage == "mmap":
+        from mmap_store import MappedAddressBook
+
+        return MappedAddressBook()
+    if storage == "sharded":
+        from sharded_store import ShardedAddressBook
+
+        return ShardedAddressBook(shards=shards)
+    return load_address_book()
+
+
+def load_notebook(filename="notes.pkl"):
+    notebook = Notebook()
+    notebook.load_notes(filename)
+    return notebook
+
+
+class ThreadOutput:
+    """Standard output keeping what some threads print, so it can be shown later.
+
+    Background loads print as they would in the foreground, and their lines
+    would otherwise land in the middle of the prompt the user is typing at.
+    """
+
+    lock = threading.Lock()
+    # Kept once uninstalled: before Python 3.12 print does not hold a reference
+    # to sys.stdout while writing, and freeing it under a print crashes.
+    output = None
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text):
+        buffer = self.buffers.get(threading.get_ident())
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @classmethod
+    @contextlib.contextmanager
+    def captured(cls):
+        """Collects what the current thread prints into the StringIO it yields."""
+        buffer = io.StringIO()
+        with cls.lock:
+            if sys.stdout is not cls.output:
+                if cls.output is None or cls.output.stream is not sys.stdout:
+                    cls.output = cls(sys.stdout)
+                sys.stdout = cls.output
+            output = cls.output
+            output.buffers[threading.get_ident()] = buffer
+        try:
+            yield buffer
+        finally:
+            with cls.lock:
+                del output.buffers[threading.get_ident()]
+                if not output.buffers and sys.stdout is output:
+                    sys.stdout = output.stream
+
+
+class LazyLoad:
+    """Value made by a loader on first use, or ahead of it in a background thread.
+
+    What a background load prints, and the error it fails with, are kept and
+    shown by the next get, on the thread that asks for the value.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded = False
+        self.seconds = None
+        self.thread = None
+        self.messages = ""
+        self.error = None
+
+    def start(self):
+        """Starts loading in a background thread; get waits for it to finish."""
+        self.thread = threading.Thread(target=self.load_in_background, daemon=True)
+        self.thread.start()
+
+    def started(self):
+        return self.loaded or self.thread is not None
+
+    def load(self):
+        started = time.perf_counter()
+        self.value = self.loader()
+        self.seconds = time.perf_counter() - started
+        self.loaded = True
+
+    def load_in_background(self):
+        with self.lock, ThreadOutput.captured() as output:
+            try:
+                self.load()
+            except Exception as e:
+                # get loads again, so the error surfaces as it would without
+                # loading in the background.
+                self.error = e
+            self.messages = output.getvalue()
+
+    def get(self):
+        with self.lock:
+            if self.messages:
+                print(self.messages, end="")
+                self.messages = ""
+            if self.error is not None:
+                print(f"Wczytywanie w tle nie powiodło się: {self.error}")
+                self.error = None
+            if not self.loaded:
+                self.load()
+        return self.value
 
 
 class AssistantBot:
-    def __init__(self, user_interface):
+    def __init__(
+        self,
+        user_interface,
+        storage="pickle",
+        shards=None,
+        preload=False,
+        startup_profile=False,
+    ):
+        self.started = time.perf_counter()
         self.ui = user_interface
-        self.notebook = Notebook()
-        self.notebook.load_notes()
-        self.book = load_address_book()
-        self.tag_manager = Tag(self.notebook)
+        # Each store is loaded when first used, so the menu shows at once.
+        self.book_loader = LazyLoad(lambda: open_address_book(storage, shards))
+        self.notebook_loader = LazyLoad(load_notebook)
+        if preload:
+            self.book_loader.start()
+            self.notebook_loader.start()
+        self.startup_profile = startup_profile
+        self.first_menu_seconds = None
+        self.ui.set_completer(self.complete_name)
+
+    @property
+    def book(self):
+        return self.book_loader.get()
+
+    @property
+    def notebook(self):
+        return self.notebook_loader.get()
+
+    @property
+    def tag_manager(self):
+        return Tag(self.notebook)
+
+    def complete_name(self, prefix):
+        # Loading the book here would freeze the prompt until it is done, so
+        # Tab starts loading it in the background and completes once it is.
+        if not self.book_loader.loaded:
+            if not self.book_loader.started():
+                self.book_loader.start()
+            return []
+        return self.book_loader.value.complete_name(prefix)
+
+    def print_startup_profile(self):
+        """Prints how long the imports, the first menu and the stores took."""
+        print("Profil startu:")
+        print(f"  importy: {IMPORT_SECONDS * 1000:.1f} ms")
+        if self.first_menu_seconds is not None:
+            print(f"  pierwsze menu: {self.first_menu_seconds * 1000:.1f} ms")
+        for name, loader in (
+            ("książka adresowa", self.book_loader),
+            ("notatki", self.notebook_loader),
+        ):
+            if loader.seconds is None:
+                state = "wczytywanie w tle" if loader.started() else "nie wczytano"
+                print(f"  {name}: {state}")
+            else:
+                where = " (w tle)" if loader.thread is not None else ""
+                print(f"  {name}: {loader.seconds * 1000:.1f} ms{where}")
 
     def main(self):
+        menu = (
+            "Witaj w Osobistym Asystencie proszę wybrać akcje :"
+            "\n Aby wybrać kontatkty wciśnij (1),"
+            "\n Aby wybrać notatki (2), "
+            "\n Wyjście (3): "
+        )
         while True:
-            action = self.ui.get_input(
-                "Witaj w Osobistym Asystencie proszę wybrać akcje :"
-                "\n Aby wybrać kontatkty wciśnij (1),"
-                "\n Aby wybrać notatki (2), "
-                "\n Wyjście (3): "
-            )
+            if self.startup_profile and self.first_menu_seconds is None:
+                # Shown before reading the choice, so it is timed once on screen.
+                self.ui.display_message(menu)
+                self.first_menu_seconds = time.perf_counter() - self.started
+                self.print_startup_profile()
+                action = self.ui.get_input("")
+            else:
+                action = self.ui.get_input(menu)
             if action == "1":
                 while True:
                     contact_action = self.ui.get_input(
@@ -601,8 +2580,29 @@ class AssistantBot:
                         self.book.add_record(record)
                         self.ui.display_message("Dodano kontakt.")
                     elif contact_action == "2":
-                        search_term = self.ui.get_input("Wpisz szukaną frazę: ")
-                        found = self.book.find_record(search_term)
+                        search_term = self.ui.get_input(
+                            "Wpisz szukaną frazę lub zapytanie "
+                            "(np. name:kowal city:Kraków bday<30): "
+                        )
+                        from query import is_structured
+
+                        if is_structured(search_term):
+                            try:
+                                found = self.book.query(search_term)
+                            except ValueError as e:
+                                print(e)
+                                continue
+                        else:
+                            found = self.book.find_record(search_term)
+                            if not found:
+                                found = [
+                                    record
+                                    for record, _ in self.book.find_similar_records(
+                                        search_term
+                                    )
+                                ]
+                                if found:
+                                    print("Brak dokładnych wyników, podobne kontakty:")
                         self.ui.display_contacts(found)
                     elif contact_action == "3":
                         self.book.delete_record_by_id()
@@ -618,23 +2618,34 @@ class AssistantBot:
                                 "Wpisz ilość dni w której należy wyszukać:"
                             )
                         )
-                        self.book.upcoming_birthdays(date)
+                        upcoming = self.book.upcoming_birthdays(date)
+                        element = ", ".join(
+                            f"{entry.record.name.value} ({entry.birthday}, za {entry.days} dni)"
+                            for entry in upcoming
+                        )
+                        print(
+                            f"W ciągu najblizszych {date} dni, urodziny mają: \n{element}"
+                        )
                     elif contact_action == "7":
                         break
             elif action == "2":
                 while True:
                     notes_action = self.ui.get_input(
-                        "Wybierz działanie:\n1. Dodaj notatkę\n2. Wyświetl notatki\n3. Edytuj notatkę\n4. Usuń notatkę\n5. Zapisz notatki\n6. Wczytaj notatki\n7. Dodaj tag do notatki\n8. Znajdź notatkę po tagu\n9. Posortuj notatki według tagów\n0. Powrót\n"
+                        "Wybierz działanie:\n1. Dodaj notatkę\n2. Wyświetl notatki\n3. Edytuj notatkę\n4. Usuń notatkę\n5. Zapisz notatki\n6. Wczytaj notatki\n7. Dodaj tag do notatki\n8. Znajdź notatki po tagach\n9. Posortuj notatki według tagów\n10. Szukaj w treści notatek\n11. Notatki z ostatnich dni\n0. Powrót\n"
                     )
 
                     if notes_action == "1":
                         note_content = self.ui.get_input("Wprowadź treść notatki: ")
                         self.notebook.add_note(note_content)
-                        self.ui.display_notes("Notatka dodana.")
                     elif notes_action == "2":
-                        self.ui.display_notes(self.notebook.notes)
+                        self.ui.display_notes(self.notebook.notes.values())
                     elif notes_action == "3":
-                        pass
+                        self.notebook.show_notes()
+                        note_id = int(
+                            self.ui.get_input("Podaj numer notatki do edycji: ")
+                        )
+                        note_content = self.ui.get_input("Wprowadź nową treść notatki: ")
+                        self.notebook.edit_note(note_id, note_content)
                     elif notes_action == "4":
                         self.notebook.show_notes()
                         note_id = int(
@@ -655,17 +2666,51 @@ class AssistantBot:
                         tag_content = input("Wprowadź tag: ")
                         self.tag_manager.add_tag(note_index, tag_content)
                     elif notes_action == "8":
-                        tag_to_search = input("Wprowadź tag do wyszukania: ")
-                        notes_with_tag = self.tag_manager.search_tag(tag_to_search)
-                        print(f"Notatki z tagiem '{tag_to_search}':")
-                        for i, note in enumerate(notes_with_tag, start=1):
-                            print(f"{i}. {note}")
+                        tag_to_search = input(
+                            "Wprowadź tagi (a, b - wszystkie; a | b - dowolny): "
+                        )
+                        tags, match_all = parse_tags(tag_to_search)
+                        notes_with_tag = self.tag_manager.search_tags(tags, match_all)
+                        print(f"Notatki z tagami '{tag_to_search}':")
+                        for note in notes_with_tag:
+                            print(f"{note.id}. {note}")
                     elif notes_action == "9":
                         sorted_tags = self.tag_manager.sort_tags()
                         for tag, notes in sorted_tags.items():
                             print(f"Tag: {tag}, Notatki:")
-                            for i, note in enumerate(notes, start=1):
-                                print(f"  {i}. {note}")
+                            for note in notes:
+                                print(f"  {note.id}. {note}")
+                    elif notes_action == "10":
+                        query = self.ui.get_input(
+                            "Wpisz szukane słowa (frazy w cudzysłowie): "
+                        )
+                        found = self.notebook.search_notes(query)
+                        if not found:
+                            print("Nie znaleziono notatek.")
+                        for note, score in found:
+                            print(f"{note.id}. ({score:.2f}) {note}")
+                    elif notes_action == "11":
+                        days = int(self.ui.get_input("Z ilu ostatnich dni? "))
+                        tags_input = self.ui.get_input(
+                            "Tagi (a, b - wszystkie; a | b - dowolny; Enter - bez): "
+                        )
+                        tags, match_all = parse_tags(tags_input)
+                        query = self.ui.get_input("Szukane słowa (Enter - bez): ")
+                        start = datetime.now() - timedelta(days=days)
+                        offset = 0
+                        while True:
+                            page = self.notebook.find_notes(
+                                start, None, tags, match_all, query, offset
+                            )
+                            if not page:
+                                if not offset:
+                                    print("Nie znaleziono notatek.")
+                                break
+                            self.ui.display_notes(page)
+                            offset += len(page)
+                            more = self.ui.get_input("Pokazać kolejne? (t/n): ")
+                            if more.strip().lower() != "t":
+                                break
                     elif notes_action == "0":
                         break
                     else:
@@ -677,12 +2722,50 @@ class AssistantBot:
             else:
                 print("Nie ma takiego polecenia, wybierz jeszcze raz")
 
-        save_address_book(self.book)
-        self.notebook.save_notes()
+        if self.book_loader.started():
+            save_address_book(self.book)
+            self.book.close()
+        if self.notebook_loader.started():
+            self.notebook.save_notes()
+            self.notebook.close()
+        if self.startup_profile:
+            self.print_startup_profile()
 
 
 if __name__ == "__main__":
+    # Storage modules import the classes from here; let them find this module.
+    sys.modules.setdefault("assistant_bot", sys.modules[__name__])
+    parser = argparse.ArgumentParser(description="Osobisty Asystent")
+    parser.add_argument(
+        "--storage",
+        choices=["pickle", "sqlite", "mmap", "sharded"],
+        default="pickle",
+        help="sposób przechowywania książki adresowej",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="liczba procesów podzielonej książki (domyślnie liczba procesorów)",
+    )
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        help="wczytuj książkę i notatki w tle od razu po starcie",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="wypisz czasy importów, wczytywania i pierwszego menu po jego "
+        "wyświetleniu i przy wyjściu",
+    )
+    args = parser.parse_args()
 
     console_interface = ConsoleInterface()
-    assistant_bot = AssistantBot(console_interface)
+    assistant_bot = AssistantBot(
+        console_interface,
+        storage=args.storage,
+        shards=args.shards,
+        preload=args.preload,
+        startup_profile=args.startup_profile,
+    )
     assistant_bot.main()
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""Measures how long a fuzzy name search takes on a large index.
+
+The names are made of a few common first names and surnames, which most
+contacts share, and many rarer surnames put together from syllables, so common
+words such as "jan" have a great many keys. Each query is run several times
+and the median and slowest time are reported:
+
+    python bench_fuzzy.py --records 1000000
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from assistant_bot import FuzzyNameIndex
+
+
+FIRST_NAMES = ["Jan", "Anna", "Łukasz", "Zofia", "Piotr", "Małgorzata", "Janina"]
+FIRST_NAMES += ["Janusz", "Katarzyna", "Krzysztof", "Tomasz", "Ewa"]
+LAST_NAMES = ["Kowalski", "Nowak", "Wiśniewska", "Żółkiewski", "Lewandowska"]
+LAST_NAMES += ["Kowalczyk", "Wójcik", "Kamińska", "Zieliński", "Szymański"]
+SYLLABLES = ["ko", "wal", "ski", "no", "wak", "wiś", "niew", "ska", "ża", "ró"]
+SYLLABLES += ["dzi", "ńska", "ma", "cz", "yk", "ber", "gu", "la", "pie", "trz"]
+QUERIES = [
+    "Jan Kowalski",
+    "Lukasz Wisniewska",
+    "anna nowak kowalczyk",
+    "Kowalsky",
+    "zofia",
+    "Jan Kowalsky",
+    "anna janina kowalczyk nowak",
+    "ko wal ski",
+]
+
+
+def build_index(count, seed=0):
+    """Returns a fuzzy index of count generated names."""
+    rng = random.Random(seed)
+    rare_names = [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        for _ in range(30000)
+    ]
+    index = FuzzyNameIndex()
+    for key in range(count):
+        last_name = rng.choice(LAST_NAMES if rng.random() < 0.5 else rare_names)
+        index.add(key, f"{rng.choice(FIRST_NAMES)} {last_name}")
+    return index
+
+
+def search_times(index, query, repeat=5):
+    """Returns the times of repeated searches for the query, in seconds."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        index.search(query)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = build_index(args.records, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Rekordów: {args.records}, indeks zbudowany w {elapsed:.1f} s")
+    for query in QUERIES:
+        times = search_times(index, query, args.repeat)
+        print(
+            f"{query:30} mediana {statistics.median(times) * 1000:6.1f} ms, "
+            f"najwolniej {max(times) * 1000:6.1f} ms"
+        )
@@ -0,0 +1,99 @@
+"""Measures how many bytes an address book needs per record.
+
+The same contacts are built once with the dict-based classes the bot used
+before its fields were slotted and once with the current classes, and the
+memory traced while building them is reported per record:
+
+    python bench_memory.py --records 100000
+"""
+
+import argparse
+import gc
+import random
+import tracemalloc
+
+from assistant_bot import BirthDate, EmailAddress, Name, PhoneNumber, Record
+
+
+FIRST_NAMES = ["Anna", "Jan", "Katarzyna", "Łukasz", "Małgorzata", "Piotr", "Zofia"]
+LAST_NAMES = ["Kowalski", "Nowak", "Wiśniewska", "Wójcik", "Kamińska", "Lewandowski"]
+DOMAINS = ["gmail.com", "wp.pl", "onet.pl", "interia.pl", "o2.pl"]
+
+
+class LegacyField:
+    def __init__(self, value):
+        self.value = value
+
+
+class LegacyRecord:
+    def __init__(self, name, birthdate=None):
+        self.id = None
+        self.name = name
+        self.phone_numbers = []
+        self.email_addresses = []
+        self.birthdate = birthdate
+        self.address = None
+
+
+def contact(rng, index):
+    """Returns the strings of one generated contact."""
+    first_name = rng.choice(FIRST_NAMES)
+    last_name = rng.choice(LAST_NAMES)
+    phones = [str(rng.randint(500000000, 899999999)) for _ in range(rng.randint(0, 2))]
+    emails = [
+        f"kontakt.{index}@{rng.choice(DOMAINS)}"
+        for _ in range(rng.randint(0, 1))
+    ]
+    birthdate = None
+    if rng.random() < 0.7:
+        birthdate = (
+            f"{rng.randint(1950, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        )
+    return f"{first_name} {last_name}", phones, emails, birthdate
+
+
+def build_legacy(name, phones, emails, birthdate):
+    record = LegacyRecord(
+        LegacyField(name), LegacyField(birthdate) if birthdate else None
+    )
+    for phone in phones:
+        record.phone_numbers.append(LegacyField(phone))
+    for email in emails:
+        record.email_addresses.append(LegacyField(email))
+    return record
+
+
+def build_current(name, phones, emails, birthdate):
+    record = Record(Name(name), BirthDate(birthdate) if birthdate else None)
+    for phone in phones:
+        record.add_phone_number(PhoneNumber(phone))
+    for email in emails:
+        record.add_email_address(EmailAddress(email))
+    return record
+
+
+def bytes_per_record(build, count, seed):
+    """Builds the records and returns the traced memory they hold, per record."""
+    rng = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    records = {index: build(*contact(rng, index)) for index in range(count)}
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return (end - start) / count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    before = bytes_per_record(build_legacy, args.records, args.seed)
+    after = bytes_per_record(build_current, args.records, args.seed)
+    print(f"Rekordów: {args.records}")
+    print(f"Przed (słowniki atrybutów): {before:8.1f} B/rekord")
+    print(f"Po (__slots__):             {after:8.1f} B/rekord")
+    print(f"Oszczędność:                {1 - after / before:8.1%}")
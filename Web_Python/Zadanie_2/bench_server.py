@@ -0,0 +1,112 @@
+"""Measures how many requests per second the book server answers.
+
+Many clients connect at once and each sends its requests one after another:
+searches, upcoming birthdays and, for the given share of requests, changes
+(adding a contact, editing it and deleting it again), so the book keeps its
+size. Throughput and latency percentiles are reported per kind of request:
+
+    python book_server.py --book address_book.pkl &
+    python bench_server.py --clients 50 --requests 200 --writes 0.1
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from book_server import BookClient
+
+
+SEARCH_TERMS = [
+    "kowal",
+    "nowak",
+    "anna",
+    "Jan",
+    "123",
+    "gmail",
+    "name:ann city:Kraków",
+]
+
+
+async def run_client(number, args, latencies):
+    """Sends the requests of one client, recording the latency of each."""
+    rng = random.Random(number)
+    client = await BookClient.connect(args.host, args.port)
+    added = []
+    try:
+        for request_number in range(args.requests):
+            if rng.random() < args.writes:
+                if added and rng.random() < 0.5:
+                    record_id = added.pop()
+                    kind = "delete"
+                    call = client.call("delete", id=record_id)
+                elif added:
+                    kind = "edit"
+                    call = client.call(
+                        "edit", id=added[-1], phones=[f"{rng.randrange(10**9):09d}"]
+                    )
+                else:
+                    kind = "add"
+                    call = client.call(
+                        "add",
+                        name=f"Test Klient{number}",
+                        emails=[f"klient{number}.{request_number}@test.pl"],
+                    )
+            elif rng.random() < 0.1:
+                kind = "birthdays"
+                call = client.call("birthdays", days=7)
+            else:
+                kind = "find"
+                call = client.call("find", term=rng.choice(SEARCH_TERMS), limit=20)
+            started = time.perf_counter()
+            result = await call
+            latencies.setdefault(kind, []).append(time.perf_counter() - started)
+            if kind == "add":
+                added.append(result)
+        for record_id in added:
+            await client.call("delete", id=record_id)
+    finally:
+        await client.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main(args):
+    latencies = {}
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(run_client(number, args, latencies) for number in range(args.clients))
+    )
+    elapsed = time.perf_counter() - started
+    total = sum(len(values) for values in latencies.values())
+    print(
+        f"{total} żądań w {elapsed:.2f} s: {total / elapsed:.0f} żądań/s "
+        f"({args.clients} klientów)"
+    )
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        median = percentile(values, 0.5) * 1000
+        slowest = percentile(values, 0.99) * 1000
+        print(
+            f"  {kind}: {len(values)}, mediana {median:.2f} ms, p99 {slowest:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Mierzy przepustowość serwera książki adresowej."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7878)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="żądań na klienta")
+    parser.add_argument(
+        "--writes",
+        type=float,
+        default=0.1,
+        help="udział żądań zmieniających książkę",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args))
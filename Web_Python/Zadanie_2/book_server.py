@@ -0,0 +1,389 @@
+"""Local network service sharing one address book between many clients.
+
+Every operator used to run the bot with their own copy of the book file, and
+the last one to save won. The server keeps one book in memory and answers
+requests over TCP, one JSON object per line each way:
+
+    {"op": "add", "name": "Jan Kowalski", "phones": ["123456789"],
+     "emails": ["jan@wp.pl"], "birthdate": "1990-01-02",
+     "address": {"street": "Długa 1", "city": "Kraków",
+                 "postal_code": "30-001", "country": "Polska"}}
+    {"op": "find", "term": "name:kowal city:Kraków", "limit": 20}
+    {"op": "edit", "id": 7, "phones": ["987654321"]}
+    {"op": "delete", "id": 7}
+    {"op": "birthdays", "days": 7}
+
+Edits change only the fields given. Answers are {"ok": true, "result": ...}
+or {"ok": false, "error": "..."}, in the order of the requests on the
+connection.
+
+Requests run in a thread pool under a reader/writer lock: searches share
+the book and run side by side, and a change waits for the searches already
+running and then has the book to itself. Searches arriving while a change
+waits queue behind it, so changes are never starved. Changes go to the
+journal at once and are synced to disk every --save-interval seconds and on
+exit:
+
+    python book_server.py --book address_book.pkl --port 7878
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+from datetime import date
+
+from assistant_bot import (
+    Address,
+    BirthDate,
+    EmailAddress,
+    Name,
+    PhoneNumber,
+    Record,
+    load_address_book,
+    save_address_book,
+)
+from query import is_structured
+
+
+class ReadWriteLock:
+    """Asyncio lock letting in any number of readers or a single writer.
+
+    A waiting writer keeps new readers out, so a steady stream of searches
+    cannot starve the changes. Searches thus wait for at most one change;
+    serving them from a copy of the book instead would mean copying the book
+    and its indexes on every change.
+    """
+
+    def __init__(self):
+        self._condition = None
+        self.readers = 0
+        self.writing_now = False
+        self.writers_waiting = 0
+
+    @property
+    def condition(self):
+        # Made in the running loop: before Python 3.10 a condition binds to the
+        # loop current when it is made, not to the one it is used in.
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @contextlib.asynccontextmanager
+    async def reading(self):
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: not self.writing_now and not self.writers_waiting
+            )
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def writing(self):
+        async with self.condition:
+            self.writers_waiting += 1
+            try:
+                await self.condition.wait_for(
+                    lambda: not self.writing_now and not self.readers
+                )
+            finally:
+                self.writers_waiting -= 1
+            self.writing_now = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writing_now = False
+                self.condition.notify_all()
+
+
+def record_to_json(record, today):
+    """Returns the record as a JSON-ready dict."""
+    address = record.address
+    return {
+        "id": record.id,
+        "name": record.name.value,
+        "phones": [phone_number.value for phone_number in record.phone_numbers],
+        "emails": [email_address.value for email_address in record.email_addresses],
+        "birthdate": record.birthdate.value if record.birthdate else None,
+        "days_to_birthdate": (
+            record.days_to_birthdate(today) if record.birthdate else None
+        ),
+        "address": (
+            {
+                "street": address.street,
+                "city": address.city,
+                "postal_code": address.postal_code,
+                "country": address.country,
+            }
+            if address
+            else None
+        ),
+    }
+
+
+def fields_from_json(request):
+    """Builds the fields given in the request, validating all of them first."""
+    fields = {}
+    if "name" in request:
+        name = str(request["name"] or "").strip()
+        if not name:
+            raise ValueError("Brak imienia i nazwiska")
+        fields["name"] = Name(name)
+    if "phones" in request:
+        fields["phones"] = [PhoneNumber(str(value)) for value in request["phones"]]
+    if "emails" in request:
+        fields["emails"] = [EmailAddress(str(value)) for value in request["emails"]]
+    if "birthdate" in request:
+        birthdate = request["birthdate"]
+        fields["birthdate"] = BirthDate(str(birthdate)) if birthdate else None
+    if "address" in request:
+        address = request["address"]
+        if address and not isinstance(address, dict):
+            raise ValueError("Niepoprawny adres")
+        fields["address"] = (
+            Address(
+                *(
+                    str(address.get(part) or "")
+                    for part in ("street", "city", "postal_code", "country")
+                )
+            )
+            if address
+            else None
+        )
+    return fields
+
+
+def apply_fields(record, fields):
+    """Sets the fields on the record, replacing all phones or emails if given."""
+    if "name" in fields:
+        record.edit_name(fields["name"])
+    if "phones" in fields:
+        for phone_number in record.phone_numbers:
+            record.remove_phone_number(phone_number)
+        for phone_number in fields["phones"]:
+            record.add_phone_number(phone_number)
+    if "emails" in fields:
+        for email_address in record.email_addresses:
+            record.remove_email_address(email_address)
+        for email_address in fields["emails"]:
+            record.add_email_address(email_address)
+    if "birthdate" in fields:
+        record.edit_birthdate(fields["birthdate"])
+    if "address" in fields:
+        if fields["address"] is None:
+            record.remove_address()
+        else:
+            record.add_address(fields["address"])
+
+
+class BookServer:
+    """Answers requests of many connections on one shared book."""
+
+    def __init__(self, book, filename, save_interval=1.0):
+        self.book = book
+        self.filename = filename
+        self.save_interval = save_interval
+        self.lock = ReadWriteLock()
+        self.changed = False
+        # Operation name: (handler, whether it changes the book).
+        self.operations = {
+            "add": (self.add, True),
+            "edit": (self.edit, True),
+            "delete": (self.delete, True),
+            "find": (self.find, False),
+            "birthdays": (self.birthdays, False),
+        }
+
+    def record_id(self, request):
+        """Returns the ID of the request, which must be in the book."""
+        record_id = request.get("id")
+        if record_id not in self.book.data:
+            raise LookupError(f"Nie znaleziono rekordu o ID: {record_id}")
+        return record_id
+
+    def add(self, request):
+        fields = fields_from_json(request)
+        if "name" not in fields:
+            raise ValueError("Brak imienia i nazwiska")
+        record = Record(fields.pop("name"))
+        apply_fields(record, fields)
+        self.book.add_records([record])
+        return record.id
+
+    def edit(self, request):
+        record_id = self.record_id(request)
+        fields = fields_from_json(request)
+        record = self.book.data[record_id]
+        apply_fields(record, fields)
+        self.book.update_record(record_id)
+        return record_to_json(record, date.today())
+
+    def delete(self, request):
+        record_id = self.record_id(request)
+        self.book.remove_record(record_id)
+        return record_id
+
+    def find(self, request):
+        term = str(request.get("term") or "")
+        if is_structured(term):
+            records = self.book.query(term)
+        else:
+            records = self.book.find_record(term)
+        today = date.today()
+        return [
+            record_to_json(record, today) for record in records[: request.get("limit")]
+        ]
+
+    def birthdays(self, request):
+        today = date.today()
+        upcoming = self.book.upcoming_birthdays(int(request.get("days", 7)), today)
+        return [
+            {
+                "record": record_to_json(entry.record, today),
+                "birthday": entry.birthday.isoformat(),
+                "days": entry.days,
+            }
+            for entry in upcoming
+        ]
+
+    async def respond(self, line):
+        """Returns the answer to one request line."""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"ok": False, "error": "Niepoprawny JSON"}
+        operation = request.get("op") if isinstance(request, dict) else None
+        if operation not in self.operations:
+            return {"ok": False, "error": f"Nieznana operacja: {operation}"}
+        handler, changes = self.operations[operation]
+        loop = asyncio.get_running_loop()
+        try:
+            if changes:
+                async with self.lock.writing():
+                    result = await loop.run_in_executor(None, handler, request)
+                    self.changed = True
+            else:
+                async with self.lock.reading():
+                    result = await loop.run_in_executor(None, handler, request)
+        except (ValueError, LookupError, TypeError) as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            # Any other failure still gets an answer, so the client is not left
+            # waiting for one.
+            return {"ok": False, "error": f"Błąd serwera: {e!r}"}
+        return {"ok": True, "result": result}
+
+    async def handle(self, reader, writer):
+        """Answers the requests of one connection until it closes."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.respond(line)
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # A dropped connection, or a line over the reader's limit.
+            pass
+        finally:
+            writer.close()
+
+    def sync(self):
+        """Makes the changes durable and returns whether to compact the journal."""
+        if self.book.journal is None:
+            # Writes the first snapshot, which only reads the book.
+            save_address_book(self.book, self.filename)
+        else:
+            self.book.journal.sync()
+        return self.book.journal is not None and self.book.journal.should_compact()
+
+    async def save_periodically(self):
+        """Syncs the journal every save_interval seconds if the book changed."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.save_interval)
+            if not self.changed:
+                continue
+            self.changed = False
+            # The journal is only appended to under the write lock, so syncing
+            # can run beside the searches.
+            async with self.lock.reading():
+                compact = await loop.run_in_executor(None, self.sync)
+            if compact:
+                # Compacting swaps the log file, which no change may append to
+                # meanwhile.
+                async with self.lock.writing():
+                    await loop.run_in_executor(
+                        None, save_address_book, self.book, self.filename
+                    )
+
+    async def serve(self, host, port):
+        """Accepts connections until cancelled."""
+        server = await asyncio.start_server(self.handle, host, port)
+        saver = asyncio.create_task(self.save_periodically())
+        print(f"Serwer książki adresowej nasłuchuje na {host}:{port}.")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            saver.cancel()
+
+
+class BookClient:
+    """Connection to a book server."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=7878):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def call(self, operation, **fields):
+        """Sends a request and returns its result, raising ValueError on an error."""
+        request = {"op": operation, **fields}
+        self.writer.write(json.dumps(request, ensure_ascii=False).encode() + b"\n")
+        await self.writer.drain()
+        response = json.loads(await self.reader.readline())
+        if not response["ok"]:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Udostępnia książkę adresową przez sieć lokalną."
+    )
+    parser.add_argument("--book", default="address_book.pkl")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7878)
+    parser.add_argument(
+        "--save-interval",
+        type=float,
+        default=1.0,
+        help="co ile sekund zapisywać zmiany na dysk",
+    )
+    args = parser.parse_args()
+
+    book = load_address_book(args.book)
+    server = BookServer(book, args.book, args.save_interval)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Zatrzymano serwer.")
+    finally:
+        save_address_book(book, args.book)
+        book.close()
@@ -0,0 +1,411 @@
+"""Bulk import of contacts from CSV and vCard files.
+
+Files are streamed, so memory use depends on the chunk size and not on the
+file. Each chunk is validated column by column with the shared rules of the
+validation module, rows that fail go to a reject file, and the valid ones are
+committed to the book together. After every commit the number of the
+last committed row and the byte offset after it are written next to the
+source file, so an interrupted import seeks there with --resume instead of
+reading the committed rows again. A crash between a commit and the
+checkpoint repeats at most that one chunk.
+
+CSV files need a header; the columns are name, phone, email, birthdate,
+street, city, postal_code and country, and several phone numbers or email
+addresses in one cell are separated with semicolons:
+
+    python bulk_import.py kontakty.csv --rejects odrzucone.csv
+    python bulk_import.py kontakty.vcf --storage sqlite --resume
+"""
+
+import argparse
+import codecs
+import csv
+import os
+import re
+import time
+from itertools import islice
+
+from assistant_bot import (
+    Address,
+    BirthDate,
+    EmailAddress,
+    Name,
+    PhoneNumber,
+    Record,
+    load_address_book,
+    save_address_book,
+)
+from validation import date_mask, email_mask, phone_mask
+
+
+CSV_COLUMNS = [
+    "name",
+    "phone",
+    "email",
+    "birthdate",
+    "street",
+    "city",
+    "postal_code",
+    "country",
+]
+REJECT_COLUMNS = ["row", "error"] + CSV_COLUMNS
+
+
+def split_values(cell):
+    """Splits a cell with semicolon-separated values, dropping empty ones."""
+    return [value.strip() for value in (cell or "").split(";") if value.strip()]
+
+
+class SourceLines:
+    """Decoded lines of a source file opened in binary mode.
+
+    Keeps the byte offset after the last line read, so the position after a
+    row can be saved and seeked to.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.offset = file.tell()
+
+    def seek(self, offset):
+        self.file.seek(offset)
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        start, self.offset = self.offset, self.offset + len(line)
+        if start == 0 and line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8) :]
+        return line.decode("utf-8")
+
+
+def read_csv(lines, offset=0, row_number=0):
+    """Yields (row number, offset after it, contact) for the rows of a CSV file.
+
+    The header is read first; with an offset the rows are read from there on,
+    numbered after row_number.
+    """
+    reader = csv.reader(lines)
+    columns = next(reader, None)
+    if columns is None:
+        return
+    if offset:
+        lines.seek(offset)
+    for values in reader:
+        if not values:
+            continue
+        row_number += 1
+        row = dict(zip(columns, values))
+        yield row_number, lines.offset, {
+            "name": (row.get("name") or "").strip(),
+            "phones": split_values(row.get("phone")),
+            "emails": split_values(row.get("email")),
+            "birthdate": (row.get("birthdate") or "").strip(),
+            "address": tuple(
+                (row.get(column) or "").strip()
+                for column in ("street", "city", "postal_code", "country")
+            ),
+        }
+
+
+def unfold_lines(lines):
+    """Yields the logical lines of a vCard file, joining folded continuations.
+
+    Each comes with the offset after its last part; the lines are read one
+    ahead to find the continuations.
+    """
+    line = None
+    end = lines.offset
+    for raw_line in lines:
+        raw_line = raw_line.rstrip("\r\n")
+        if raw_line[:1] in (" ", "\t") and line is not None:
+            line += raw_line[1:]
+            end = lines.offset
+            continue
+        if line is not None:
+            yield line, end
+        line = raw_line
+        end = lines.offset
+    if line is not None:
+        yield line, end
+
+
+def normalize_phone(value):
+    """Strips formatting and the Polish country code from a vCard phone number."""
+    digits = re.sub(r"[\s()./-]", "", value)
+    for prefix in ("+48", "0048"):
+        if digits.startswith(prefix) and len(digits) == len(prefix) + 9:
+            return digits[len(prefix) :]
+    return digits
+
+
+def normalize_date(value):
+    """Turns a vCard date such as 19900102 into the 1990-01-02 form."""
+    value = value.strip()
+    if re.fullmatch(r"\d{8}", value):
+        return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    return value
+
+
+def unescape(value):
+    """Removes vCard escaping from a text value."""
+    return (
+        value.replace("\\n", " ")
+        .replace("\\,", ",")
+        .replace("\\;", ";")
+        .replace("\\\\", "\\")
+    )
+
+
+def read_vcards(lines, offset=0, card_number=0):
+    """Yields (card number, offset after it, contact) for the cards of a vCard file.
+
+    With an offset the cards are read from there on, numbered after
+    card_number.
+    """
+    if offset:
+        lines.seek(offset)
+    card = None
+    for line, end in unfold_lines(lines):
+        key, _, value = line.partition(":")
+        prop = key.split(";")[0].rsplit(".", 1)[-1].upper()
+        if prop == "BEGIN" and value.strip().upper() == "VCARD":
+            card = {
+                "name": "",
+                "phones": [],
+                "emails": [],
+                "birthdate": "",
+                "address": ("", "", "", ""),
+            }
+        elif card is None:
+            continue
+        elif prop == "END":
+            card_number += 1
+            yield card_number, end, card
+            card = None
+        elif prop == "FN":
+            card["name"] = unescape(value).strip()
+        elif prop == "N" and not card["name"]:
+            parts = value.split(";") + ["", ""]
+            card["name"] = " ".join(part for part in (parts[1], parts[0]) if part)
+        elif prop == "TEL":
+            card["phones"].append(normalize_phone(value))
+        elif prop == "EMAIL":
+            card["emails"].append(value.strip())
+        elif prop == "BDAY":
+            card["birthdate"] = normalize_date(value)
+        elif prop == "ADR":
+            # PO box; extended address; street; city; region; postal code; country
+            parts = [unescape(part).strip() for part in value.split(";")] + [""] * 7
+            card["address"] = (parts[2], parts[3], parts[5], parts[6])
+
+
+def build_records(rows):
+    """Validates a batch of rows column by column and builds records of valid ones.
+
+    The rows are (row number, offset, contact). Returns the records and the
+    rejected rows as (row number, contact, error).
+    """
+    contacts = [row for _, _, row in rows]
+    phones = [
+        (index, phone)
+        for index, row in enumerate(contacts)
+        for phone in row["phones"]
+    ]
+    emails = [
+        (index, email)
+        for index, row in enumerate(contacts)
+        for email in row["emails"]
+    ]
+    birthdates = [
+        (index, row["birthdate"])
+        for index, row in enumerate(contacts)
+        if row["birthdate"]
+    ]
+    errors = {}
+    for column, mask, error in (
+        (birthdates, date_mask, "Niepoprawna data urodzenia"),
+        (emails, email_mask, "Niepoprawny adres email"),
+        (phones, phone_mask, "Niepoprawny numer telefonu"),
+    ):
+        valid = mask([value for _, value in column])
+        for (index, _), is_valid in zip(column, valid):
+            if not is_valid:
+                errors[index] = error
+    for index, row in enumerate(contacts):
+        if not row["name"]:
+            errors[index] = "Brak imienia i nazwiska"
+
+    records = []
+    rejected = []
+    for index, (row_number, _, row) in enumerate(rows):
+        if index in errors:
+            rejected.append((row_number, row, errors[index]))
+            continue
+        record = Record(
+            Name(row["name"]), BirthDate(row["birthdate"]) if row["birthdate"] else None
+        )
+        for phone in row["phones"]:
+            record.add_phone_number(PhoneNumber(phone))
+        for email in row["emails"]:
+            record.add_email_address(EmailAddress(email))
+        if any(row["address"]):
+            record.add_address(Address(*row["address"]))
+        records.append(record)
+    return records, rejected
+
+
+def write_rejects(writer, rejected):
+    """Writes rejected rows to the reject file in the CSV import format."""
+    for row_number, row, error in rejected:
+        writer.writerow(
+            [
+                row_number,
+                error,
+                row["name"],
+                ";".join(row["phones"]),
+                ";".join(row["emails"]),
+                row["birthdate"],
+            ]
+            + list(row["address"])
+        )
+
+
+def read_checkpoint(filename):
+    """Returns the number of the last committed row and the offset after it.
+
+    Returns (0, 0) without a checkpoint.
+    """
+    try:
+        with open(filename) as file:
+            fields = file.read().split()
+    except FileNotFoundError:
+        return 0, 0
+    if not fields:
+        return 0, 0
+    return int(fields[0]), int(fields[1])
+
+
+def write_checkpoint(filename, row_number, offset):
+    """Records the last committed row and the offset after it, atomically."""
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "w") as file:
+        file.write(f"{row_number} {offset}")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filename, filename)
+
+
+def import_contacts(
+    book,
+    source,
+    file_format=None,
+    rejects=None,
+    chunk_size=10000,
+    resume=False,
+):
+    """Streams contacts from the source file into the book in chunks.
+
+    Returns the numbers of imported and rejected rows.
+    """
+    if file_format is None:
+        file_format = "vcard" if source.lower().endswith((".vcf", ".vcard")) else "csv"
+    checkpoint = source + ".offset"
+    start_after, offset = read_checkpoint(checkpoint) if resume else (0, 0)
+    imported = rejected_count = 0
+    started = time.perf_counter()
+
+    reject_file = None
+    reject_writer = None
+    if rejects:
+        mode = "a" if resume else "w"
+        reject_file = open(rejects, mode, newline="", encoding="utf-8")
+        reject_writer = csv.writer(reject_file)
+        if reject_file.tell() == 0:
+            reject_writer.writerow(REJECT_COLUMNS)
+
+    try:
+        with open(source, "rb") as file:
+            read = read_vcards if file_format == "vcard" else read_csv
+            rows = read(SourceLines(file), offset, start_after)
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                records, rejected = build_records(chunk)
+                book.add_records(records)
+                save_address_book(book)
+                if reject_writer is not None:
+                    write_rejects(reject_writer, rejected)
+                    reject_file.flush()
+                write_checkpoint(checkpoint, chunk[-1][0], chunk[-1][1])
+                imported += len(records)
+                rejected_count += len(rejected)
+                elapsed = time.perf_counter() - started
+                print(
+                    f"Wiersz {chunk[-1][0]}: zaimportowano {imported}, "
+                    f"odrzucono {rejected_count} "
+                    f"({(imported + rejected_count) / max(elapsed, 1e-9):.0f} "
+                    "wierszy/s)"
+                )
+    finally:
+        if reject_file is not None:
+            reject_file.close()
+    return imported, rejected_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Importuje kontakty z pliku CSV lub vCard do książki adresowej."
+    )
+    parser.add_argument("source")
+    parser.add_argument("--format", choices=["csv", "vcard"])
+    parser.add_argument(
+        "--storage", choices=["pickle", "sqlite", "sharded"], default="pickle"
+    )
+    parser.add_argument(
+        "--shards", type=int, help="liczba procesów podzielonej książki"
+    )
+    parser.add_argument("--book", help="plik książki adresowej")
+    parser.add_argument("--rejects", help="plik CSV na odrzucone wiersze")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="kontynuuj od ostatniego zapisanego wiersza",
+    )
+    args = parser.parse_args()
+
+    if args.storage == "sqlite":
+        from sqlite_store import SQLiteAddressBook
+
+        book = SQLiteAddressBook(args.book or "address_book.db")
+    elif args.storage == "sharded":
+        from sharded_store import ShardedAddressBook
+
+        book = ShardedAddressBook(args.book or "address_book.pkl", args.shards)
+    else:
+        book = load_address_book(args.book or "address_book.pkl")
+
+    started = time.perf_counter()
+    try:
+        imported, rejected = import_contacts(
+            book,
+            args.source,
+            file_format=args.format,
+            rejects=args.rejects,
+            chunk_size=args.chunk_size,
+            resume=args.resume,
+        )
+    finally:
+        book.close()
+    elapsed = time.perf_counter() - started
+    print(
+        f"Gotowe: zaimportowano {imported}, odrzucono {rejected} w {elapsed:.1f} s "
+        f"({(imported + rejected) / max(elapsed, 1e-9):.0f} wierszy/s)."
+    )
@@ -0,0 +1,313 @@
+"""Finds and merges duplicate contacts in the address book.
+
+Comparing every pair of records is out of the question for a large book, so
+pairs are only formed within blocks and windows:
+
+- records sharing a phone number, an email address or the same name (words
+  folded and sorted, so "Kowalski Jan" is "Jan Kowalski") form a block, and
+  every pair within a small block is compared;
+- the records are sorted by their folded name, and by the same name read
+  backwards, and each is compared with the next few in both orders
+  (sorted neighbourhood), which catches typos that no block shares.
+
+Large blocks, such as a company email used by many people, are compared with
+the sorted neighbourhood too. The comparisons run in worker processes, with
+small blocks batched together so that a task is worth sending to one. Each
+pair gets a confidence: the name similarity, a shared phone number, a shared
+email address and the same birthdate add evidence, a different birthdate
+takes it away, and contacts with clearly different names only share a
+household phone. Candidates above the merge threshold can be merged into the
+first record of each group:
+
+    python dedupe.py --threshold 0.6
+    python dedupe.py --merge 0.9 --workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+from collections import namedtuple
+
+from assistant_bot import fold_text, load_address_book, save_address_book
+
+
+MergeCandidate = namedtuple(
+    "MergeCandidate", ["first_id", "second_id", "confidence", "reasons"]
+)
+
+NAME_WEIGHT = 0.6
+PHONE_WEIGHT = 0.9
+EMAIL_WEIGHT = 0.9
+BIRTHDATE_WEIGHT = 0.5
+# A different birthdate keeps this share of the confidence.
+BIRTHDATE_CONFLICT = 0.2
+# Below this name similarity the confidence shrinks in proportion.
+NAME_FLOOR = 0.5
+MAX_BLOCK_SIZE = 50
+TASK_SIZE = 2000
+
+# Contacts of the book, set in every worker process by set_contacts.
+contacts = None
+
+
+def name_key(name):
+    """Returns the folded words of the name in sorted order."""
+    return " ".join(sorted(fold_text(name).split()))
+
+
+def name_grams(key):
+    """Returns the padded trigrams of the name key."""
+    padded = f"  {key} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def contact_of(record_id, record):
+    """Returns the fields of the record that are compared, in a compact form."""
+    return (
+        record_id,
+        name_key(record.name.value),
+        frozenset(phone_number.value for phone_number in record.phone_numbers),
+        frozenset(
+            email_address.value.casefold() for email_address in record.email_addresses
+        ),
+        record.birthdate.date.toordinal() if record.birthdate else None,
+    )
+
+
+def set_contacts(book_contacts):
+    """Shares the contacts with a worker process."""
+    global contacts
+    contacts = book_contacts
+
+
+def score(first, second, first_grams, second_grams):
+    """Returns the confidence that the contacts are the same person, and why."""
+    _, _, first_phones, first_emails, first_birthdate = first
+    _, _, second_phones, second_emails, second_birthdate = second
+    shared_grams = len(first_grams & second_grams)
+    name_similarity = shared_grams / (
+        len(first_grams) + len(second_grams) - shared_grams
+    )
+    reasons = [f"imię i nazwisko {name_similarity:.2f}"]
+    doubt = 1 - NAME_WEIGHT * name_similarity
+    if not first_phones.isdisjoint(second_phones):
+        doubt *= 1 - PHONE_WEIGHT
+        reasons.append("wspólny telefon")
+    if not first_emails.isdisjoint(second_emails):
+        doubt *= 1 - EMAIL_WEIGHT
+        reasons.append("wspólny email")
+    confidence = 1 - doubt
+    if first_birthdate is not None and second_birthdate is not None:
+        if first_birthdate == second_birthdate:
+            confidence = 1 - doubt * (1 - BIRTHDATE_WEIGHT)
+            reasons.append("ta sama data urodzenia")
+        else:
+            confidence *= BIRTHDATE_CONFLICT
+            reasons.append("inna data urodzenia")
+    confidence *= min(1.0, name_similarity / NAME_FLOOR)
+    return confidence, reasons
+
+
+def compare(task):
+    """Compares the pairs of a task in a worker and returns those above the threshold.
+
+    A task is (parts, threshold), and each part (positions, window, first_count):
+    each of the first first_count positions is compared with the following ones
+    within the window, or with all following ones when the window is None.
+    """
+    parts, threshold = task
+    found = []
+    for positions, window, first_count in parts:
+        grams = [name_grams(contacts[position][1]) for position in positions]
+        for offset in range(first_count):
+            first = contacts[positions[offset]]
+            end = len(positions) if window is None else offset + window
+            for other in range(offset + 1, min(end, len(positions))):
+                second = contacts[positions[other]]
+                confidence, reasons = score(first, second, grams[offset], grams[other])
+                if confidence >= threshold:
+                    found.append((first[0], second[0], confidence, tuple(reasons)))
+    return found
+
+
+def window_tasks(order, window, threshold):
+    """Splits a sorted order into tasks, overlapping so no neighbours are missed."""
+    for start in range(0, len(order), TASK_SIZE):
+        positions = order[start : start + TASK_SIZE + window - 1]
+        first_count = min(TASK_SIZE, len(order) - start)
+        yield [(positions, window, first_count)], threshold
+
+
+def comparison_tasks(book_contacts, window, threshold):
+    """Yields the tasks comparing the blocks and the sorted neighbourhoods."""
+    blocks = {}
+    for position, (_, key, phones, emails, _) in enumerate(book_contacts):
+        blocks.setdefault(("name", key), []).append(position)
+        for phone_number in phones:
+            blocks.setdefault(("phone", phone_number), []).append(position)
+        for email_address in emails:
+            blocks.setdefault(("email", email_address), []).append(position)
+    # Most blocks are pairs, so they are batched into tasks of about as many
+    # comparisons as a task of the sorted neighbourhood.
+    batch = []
+    batch_pairs = 0
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        if len(block) <= MAX_BLOCK_SIZE:
+            batch.append((block, None, len(block) - 1))
+            batch_pairs += len(block) * (len(block) - 1) // 2
+            if batch_pairs >= TASK_SIZE * window:
+                yield batch, threshold
+                batch = []
+                batch_pairs = 0
+        else:
+            block.sort(key=lambda position: book_contacts[position][1])
+            yield from window_tasks(block, window, threshold)
+    if batch:
+        yield batch, threshold
+    del blocks, batch
+
+    positions = range(len(book_contacts))
+    for sort_key in (
+        lambda position: book_contacts[position][1],
+        lambda position: book_contacts[position][1][::-1],
+    ):
+        yield from window_tasks(sorted(positions, key=sort_key), window, threshold)
+
+
+def find_duplicates(book, threshold=0.5, window=8, workers=None):
+    """Returns the pairs of records that may be the same person, most likely first."""
+    book_contacts = [
+        contact_of(record_id, record) for record_id, record in book.data.items()
+    ]
+    tasks = comparison_tasks(book_contacts, window, threshold)
+    workers = workers or os.cpu_count() or 1
+    pool = None
+    if workers == 1 or len(book_contacts) < TASK_SIZE:
+        # Not worth starting processes for.
+        set_contacts(book_contacts)
+        results = map(compare, tasks)
+    else:
+        pool = multiprocessing.Pool(workers, set_contacts, (book_contacts,))
+        results = pool.imap_unordered(compare, tasks)
+    found = {}
+    try:
+        for pairs in results:
+            for first_id, second_id, confidence, reasons in pairs:
+                pair = (min(first_id, second_id), max(first_id, second_id))
+                found[pair] = MergeCandidate(*pair, confidence, reasons)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        set_contacts(None)
+    return sorted(
+        found.values(),
+        key=lambda candidate: (
+            -candidate.confidence,
+            candidate.first_id,
+            candidate.second_id,
+        ),
+    )
+
+
+def merge_duplicates(book, candidates, threshold=0.9):
+    """Merges the groups of records linked by candidates above the threshold.
+
+    Each group is merged into the record with the smallest ID, which gains the
+    phone numbers and email addresses it lacks and, if it has none, the
+    birthdate and address; the other records are removed. Returns the merges
+    as (kept ID, removed IDs).
+    """
+    parents = {}
+
+    def root(record_id):
+        while parents.get(record_id, record_id) != record_id:
+            record_id = parents[record_id]
+        return record_id
+
+    for candidate in candidates:
+        if candidate.confidence < threshold:
+            continue
+        first, second = root(candidate.first_id), root(candidate.second_id)
+        if first != second:
+            parents[max(first, second)] = min(first, second)
+
+    groups = {}
+    for record_id in parents:
+        groups.setdefault(root(record_id), []).append(record_id)
+
+    merges = []
+    for kept_id, merged_ids in sorted(groups.items()):
+        kept = book.data[kept_id]
+        for merged_id in sorted(merged_ids):
+            merged = book.data[merged_id]
+            phone_numbers = {phone_number.value for phone_number in kept.phone_numbers}
+            for phone_number in merged.phone_numbers:
+                if phone_number.value not in phone_numbers:
+                    kept.add_phone_number(phone_number)
+                    phone_numbers.add(phone_number.value)
+            email_addresses = {
+                email_address.value.casefold()
+                for email_address in kept.email_addresses
+            }
+            for email_address in merged.email_addresses:
+                if email_address.value.casefold() not in email_addresses:
+                    kept.add_email_address(email_address)
+                    email_addresses.add(email_address.value.casefold())
+            if kept.birthdate is None:
+                kept.edit_birthdate(merged.birthdate)
+            if kept.address is None and merged.address is not None:
+                kept.add_address(merged.address)
+            book.remove_record(merged_id)
+        book.update_record(kept_id)
+        merges.append((kept_id, sorted(merged_ids)))
+    return merges
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Wyszukuje i scala zduplikowane kontakty w książce adresowej."
+    )
+    parser.add_argument("--storage", choices=["pickle", "sqlite"], default="pickle")
+    parser.add_argument("--book", help="plik książki adresowej")
+    parser.add_argument(
+        "--threshold", type=float, default=0.5, help="najniższa pewność kandydata"
+    )
+    parser.add_argument(
+        "--merge",
+        type=float,
+        metavar="THRESHOLD",
+        help="scal kandydatów o co najmniej takiej pewności",
+    )
+    parser.add_argument("--window", type=int, default=8)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    if args.storage == "sqlite":
+        from sqlite_store import SQLiteAddressBook
+
+        book = SQLiteAddressBook(args.book or "address_book.db")
+    else:
+        book = load_address_book(args.book or "address_book.pkl")
+    try:
+        candidates = find_duplicates(book, args.threshold, args.window, args.workers)
+        for candidate in candidates:
+            first = book.data[candidate.first_id]
+            second = book.data[candidate.second_id]
+            print(
+                f"{candidate.confidence:.2f}  ID {candidate.first_id} "
+                f"{first.name.value} / ID {candidate.second_id} {second.name.value} "
+                f"({', '.join(candidate.reasons)})"
+            )
+        print(f"Kandydatów do scalenia: {len(candidates)}.")
+        if args.merge is not None:
+            merges = merge_duplicates(book, candidates, args.merge)
+            save_address_book(book, args.book or "address_book.pkl")
+            print(
+                f"Scalono {sum(len(merged_ids) for _, merged_ids in merges)} "
+                f"rekordów w {len(merges)} grupach."
+            )
+    finally:
+        book.close()
@@ -0,0 +1,412 @@
+"""Memory-mapped address book file, opened without reading the records.
+
+Unpickling a big book before the first menu takes long and holds every
+record in memory. This format is mapped into memory instead, and a record is
+only unpickled when it is touched, so opening a book costs the same for any
+size and memory follows the records in use. The file is laid out as:
+
+    header   magic, version, record count, the offsets of the arrays below,
+             the highest ID handed out and the number of free IDs
+    records  for each record in book order, its length and its pickle
+    ids      the record IDs in ascending order, eight bytes each
+    offsets  the offset of the record with the ID at the same place
+    order    the places in ids of the records in book order, four bytes each
+    free     the released IDs below the highest one, ascending, eight bytes each
+
+A record is found by bisecting ids. The free IDs and the highest one keep
+the ID allocator as it was, so an ID released at the top is not reused.
+Changes are appended to a journal next to the file, the same as for a pickled
+book, and kept in memory on top of the mapped records and the allocator; when
+the journal grows large the file is rewritten with them, copying unchanged
+records without unpickling them. The search indexes are built on the first
+search, so only that pays for reading every record.
+
+A pickled book is converted with:
+
+    python mmap_store.py address_book.pkl address_book.abk
+"""
+
+import argparse
+import io
+import mmap
+import os
+import pickle
+import struct
+import weakref
+from array import array
+from bisect import bisect_left
+from collections.abc import ItemsView, MutableMapping, ValuesView
+
+from assistant_bot import (
+    AddressBook,
+    IdAllocator,
+    Journal,
+    load_address_book,
+    load_pickle,
+)
+
+
+MAGIC = b"ADRBOOK\0"
+VERSION = 2
+# Magic, version, record count, the offsets of ids, offsets, order and free,
+# the highest ID handed out and the number of free IDs.
+HEADER = struct.Struct("<8sIIQQQQQQ")
+LENGTH = struct.Struct("<I")
+
+
+def write_book_file(filename, payloads, allocator=None):
+    """Writes (ID, pickled record) pairs, given in book order, as a mapped book.
+
+    The state of the ID allocator is written with them; without one, the gaps
+    between the IDs count as free. The file is written to a temporary name
+    and renamed over the old one.
+    """
+    temp_filename = filename + ".tmp"
+    ids = array("Q")
+    offsets = array("Q")
+    with open(temp_filename, "wb") as file:
+        file.write(bytes(HEADER.size))
+        for record_id, payload in payloads:
+            ids.append(record_id)
+            offsets.append(file.tell())
+            file.write(LENGTH.pack(len(payload)))
+            file.write(payload)
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        places = array("I", bytes(4 * len(ids)))
+        for place, slot in enumerate(order):
+            places[slot] = place
+        file.write(bytes(-file.tell() % 8))
+        ids_offset = file.tell()
+        array("Q", (ids[slot] for slot in order)).tofile(file)
+        offsets_offset = file.tell()
+        array("Q", (offsets[slot] for slot in order)).tofile(file)
+        order_offset = file.tell()
+        places.tofile(file)
+        if allocator is None:
+            allocator = IdAllocator.from_ids(set(ids))
+        free_ids = array("Q", sorted(allocator.free))
+        file.write(bytes(-file.tell() % 8))
+        free_offset = file.tell()
+        free_ids.tofile(file)
+        file.seek(0)
+        file.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(ids),
+                ids_offset,
+                offsets_offset,
+                order_offset,
+                free_offset,
+                allocator.high_water,
+                len(free_ids),
+            )
+        )
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filename, filename)
+
+
+class MappedFile:
+    """Read-only view of a mapped book file."""
+
+    def __init__(self, filename):
+        self.map = None
+        self.count = 0
+        self.ids = self.offsets = self.order = self.free_ids = ()
+        self.high_water = 0
+        try:
+            file = open(filename, "rb")
+        except FileNotFoundError:
+            return
+        with file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.map)
+        if fields[:2] != (MAGIC, VERSION):
+            self.close()
+            raise ValueError(f"Nieznany format pliku: {filename}")
+        self.count, ids_offset, offsets_offset, order_offset = fields[2:6]
+        free_offset, self.high_water, free_count = fields[6:]
+        view = memoryview(self.map)
+        self.ids = view[ids_offset : ids_offset + 8 * self.count].cast("Q")
+        self.offsets = view[offsets_offset : offsets_offset + 8 * self.count].cast("Q")
+        self.order = view[order_offset : order_offset + 4 * self.count].cast("I")
+        self.free_ids = view[free_offset : free_offset + 8 * free_count].cast("Q")
+
+    def allocator(self):
+        """Returns the ID allocator as it was when the file was written."""
+        allocator = IdAllocator(self.high_water)
+        allocator.heap = list(self.free_ids)  # ascending, so already a heap
+        allocator.free = set(allocator.heap)
+        return allocator
+
+    def place(self, record_id):
+        """Returns the place of the ID in ids, or None if the file lacks it."""
+        place = bisect_left(self.ids, record_id)
+        if place < self.count and self.ids[place] == record_id:
+            return place
+        return None
+
+    def payload(self, place):
+        """Returns the pickled record at the place."""
+        offset = self.offsets[place]
+        (length,) = LENGTH.unpack_from(self.map, offset)
+        start = offset + LENGTH.size
+        return self.map[start : start + length]
+
+    def record(self, place):
+        """Unpickles the record at the place."""
+        return load_pickle(io.BytesIO(self.payload(place)))
+
+    def close(self):
+        """Unmaps the file; the views into it must be released first."""
+        for view in (self.ids, self.offsets, self.order, self.free_ids):
+            if isinstance(view, memoryview):
+                view.release()
+        self.ids = self.offsets = self.order = self.free_ids = ()
+        self.high_water = 0
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.count = 0
+
+
+class MappedRecordValues(ValuesView):
+    def __iter__(self):
+        for _, record in self._mapping.items():
+            yield record
+
+
+class MappedRecordItems(ItemsView):
+    def __iter__(self):
+        records = self._mapping
+        for record_id in records:
+            yield record_id, records[record_id]
+
+
+class MappedRecords(MutableMapping):
+    """Mapping of record IDs to the records of a mapped file and the changes since.
+
+    Added and edited records are kept in changes. Records of the file that
+    were deleted are listed in removed; added ones, including records of the
+    file deleted and added again, go to the end of the book in added. Records
+    unpickled from the file are cached weakly, so an edited record is the same
+    object until it is written back.
+    """
+
+    def __init__(self, mapped, cache=None):
+        self.mapped = mapped
+        self.changes = {}
+        self.removed = set()
+        self.added = {}  # IDs in the order they were added
+        self.cache = weakref.WeakValueDictionary() if cache is None else cache
+
+    def in_file(self, record_id):
+        """Checks if the record is still in its place in the file."""
+        return (
+            record_id not in self.removed and self.mapped.place(record_id) is not None
+        )
+
+    def __getitem__(self, record_id):
+        record = self.changes.get(record_id)
+        if record is not None:
+            return record
+        record = self.cache.get(record_id)
+        if record is None:
+            place = None if record_id in self.removed else self.mapped.place(record_id)
+            if place is None:
+                raise KeyError(record_id)
+            record = self.cache[record_id] = self.mapped.record(place)
+        return record
+
+    def __setitem__(self, record_id, record):
+        record.id = record_id
+        if record_id not in self.changes and not self.in_file(record_id):
+            self.added[record_id] = None
+        self.changes[record_id] = record
+        self.cache[record_id] = record
+
+    def __delitem__(self, record_id):
+        if record_id not in self:
+            raise KeyError(record_id)
+        self.changes.pop(record_id, None)
+        self.cache.pop(record_id, None)
+        if record_id in self.added:
+            del self.added[record_id]
+        else:
+            self.removed.add(record_id)
+
+    def __contains__(self, record_id):
+        return record_id in self.changes or self.in_file(record_id)
+
+    def __iter__(self):
+        ids = self.mapped.ids
+        removed = self.removed
+        for place in self.mapped.order:
+            record_id = ids[place]
+            if record_id not in removed:
+                yield record_id
+        yield from self.added
+
+    def __len__(self):
+        return self.mapped.count - len(self.removed) + len(self.added)
+
+    def values(self):
+        return MappedRecordValues(self)
+
+    def items(self):
+        return MappedRecordItems(self)
+
+    def payloads(self):
+        """Yields (ID, pickled record) in book order; unchanged ones are copied."""
+        ids = self.mapped.ids
+        for place in self.mapped.order:
+            record_id = ids[place]
+            if record_id in self.removed:
+                continue
+            record = self.changes.get(record_id)
+            if record is None:
+                yield record_id, self.mapped.payload(place)
+            else:
+                yield record_id, pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        for record_id in self.added:
+            yield record_id, pickle.dumps(
+                self.changes[record_id], pickle.HIGHEST_PROTOCOL
+            )
+
+
+class MappedJournal(Journal):
+    """Journal of a mapped book; compacting it rewrites the mapped file."""
+
+    def __init__(self, filename, book):
+        super().__init__(filename, None)
+        self.book = book
+
+    def compact(self, background=True):
+        """Rewrites the book file with the changes and starts an empty journal."""
+        self.book.rewrite()
+
+    def reset(self):
+        """Drops the log once its changes are in the book file."""
+        if self.log is not None:
+            self.log.close()
+        for filename in (self.sealed_filename, self.log_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.log = open(self.log_filename, "ab")
+
+
+# Search indexes of AddressBook, built on first use.
+LAZY_INDEXES = (
+    "name_index",
+    "contact_index",
+    "birthday_index",
+    "fuzzy_index",
+    "name_trie",
+    "phone_index",
+    "domain_index",
+    "city_index",
+    "positions",
+    "next_position",
+)
+
+
+class MappedAddressBook(AddressBook):
+    """Address book read lazily from a memory-mapped file."""
+
+    def __init__(self, filename="address_book.abk"):
+        super().__init__()
+        for name in LAZY_INDEXES:
+            delattr(self, name)
+        self.filename = filename
+        self.data = MappedRecords(MappedFile(filename))
+        self.ids = self.data.mapped.allocator()
+        self.journal = MappedJournal(filename, self)
+        for entry in Journal.read_entries(self.journal.log_filename):
+            if entry[0] == "delete":
+                if self.data.pop(entry[1], None) is not None:
+                    self.ids.release(entry[1])
+            else:
+                self.ids.reserve(entry[1])
+                self.data[entry[1]] = entry[2]
+        self.journal.open()
+
+    def __getattr__(self, name):
+        # Only called for attributes not set yet: the indexes.
+        if name in LAZY_INDEXES:
+            self.rebuild_index()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def indexed(self):
+        return "name_index" in self.__dict__
+
+    def index_record(self, record_id, record):
+        """Updates the indexes, if built; they read every record when they are."""
+        if self.indexed():
+            super().index_record(record_id, record)
+
+    def unindex_record(self, record_id):
+        """Updates the indexes, if built."""
+        if self.indexed():
+            super().unindex_record(record_id)
+
+    def settle_indexes(self):
+        """Keeps up the indexes, if built."""
+        if self.indexed():
+            super().settle_indexes()
+
+    def update_record(self, record_id):
+        """Keeps the edited record among the changes, then reindexes and journals it."""
+        self.data[record_id] = self.data[record_id]
+        super().update_record(record_id)
+
+    def close(self):
+        """Closes the journal and unmaps the file."""
+        super().close()
+        self.data.mapped.close()
+
+    def rewrite(self):
+        """Writes the book file anew with the changes and empties the journal."""
+        self.journal.sync()
+        write_book_file(self.filename + ".new", self.data.payloads(), self.ids)
+        # The views must be released before the file under them is replaced.
+        self.data.mapped.close()
+        os.replace(self.filename + ".new", self.filename)
+        self.data = MappedRecords(MappedFile(self.filename), self.data.cache)
+        self.journal.reset()
+
+
+def convert_address_book(pickle_filename, mapped_filename):
+    """Writes a pickled address book, journal included, as a mapped book file.
+
+    The journal of an earlier mapped book file of that name is removed, as its
+    changes do not apply to the new one.
+    """
+    source = load_address_book(pickle_filename)
+    write_book_file(
+        mapped_filename,
+        (
+            (record_id, pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+            for record_id, record in source.data.items()
+        ),
+        source.ids,
+    )
+    source.close()
+    for filename in (mapped_filename + ".journal", mapped_filename + ".journal.sealed"):
+        if os.path.exists(filename):
+            os.remove(filename)
+    return len(source.data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Zapisuje książkę adresową z pliku .pkl w formacie mapowanym."
+    )
+    parser.add_argument("pickle_filename", nargs="?", default="address_book.pkl")
+    parser.add_argument("mapped_filename", nargs="?", default="address_book.abk")
+    args = parser.parse_args()
+    count = convert_address_book(args.pickle_filename, args.mapped_filename)
+    print(f"Zapisano {count} rekordów w {args.mapped_filename}.")
@@ -0,0 +1,456 @@
+"""Structured queries over the address book.
+
+A query is a list of conditions that must all hold:
+
+    name:kowal        the name contains the text
+    phone:^60         a phone number starts with the digits; with 60$ it ends
+                      with them, and plain digits may be anywhere in it
+    email:@gmail.com  an email address is in the domain; without the leading @
+                      an email address contains the text
+    city:Kraków       the city of the address, ignoring case and diacritics
+    bday<30           the birthday is in fewer than 30 days; bday<=30 also
+                      includes the 30th day
+    kowal             other words are searched for like find_record does
+
+Values with spaces are quoted, as in city:"Nowy Sącz".
+
+The planner asks every condition how many records its index would return,
+looks up the most selective ones and intersects the results, and checks the
+remaining conditions only on the records left. Books without these indexes
+may look the conditions up in their storage instead. explain() shows the plan and
+the time of each stage:
+
+    python query.py 'name:kowal city:Kraków' --explain
+"""
+
+import argparse
+import re
+import shlex
+import time
+from abc import ABC, abstractmethod
+from datetime import date
+
+from assistant_bot import BirthdayIndex, fold_text, load_address_book
+
+
+FIELD_PATTERN = re.compile(r"^(name|phone|email|city):|^bday<")
+BIRTHDAY_PATTERN = re.compile(r"bday(<=?)(\d+)")
+# An index is looked up only while its result is at most this many times
+# larger than the candidates left; checking those directly is cheaper.
+LOOKUP_RATIO = 8
+
+
+def is_structured(text):
+    """Checks if the search text uses the query syntax."""
+    return any(FIELD_PATTERN.match(word) for word in text.split())
+
+
+class Condition(ABC):
+    """One condition of a query.
+
+    A condition with an index estimates how many records it matches and looks
+    them up; exact ones need no further check of the records they return.
+    """
+
+    field = None
+    index_name = None
+    exact = True
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return f"{self.field}:{self.value}"
+
+    def estimate(self, book, today):
+        """Returns the number of records the index would return, or None without one."""
+        return None
+
+    @abstractmethod
+    def lookup(self, book, today):
+        """Returns the IDs of the records the index finds."""
+
+    @abstractmethod
+    def matches(self, record, today):
+        """Checks the condition on the record."""
+
+
+def ngram_estimate(index, text):
+    """Returns the size of the smallest posting list of the text, or None."""
+    grams = index.grams(text)
+    if not grams:
+        return None
+    return min(len(index.postings.get(gram, ())) for gram in grams)
+
+
+class NameCondition(Condition):
+    field = "name"
+    index_name = "n-gramy imion i nazwisk"
+    exact = False
+
+    def estimate(self, book, today):
+        return ngram_estimate(book.name_index, self.value)
+
+    def lookup(self, book, today):
+        return book.name_index.candidates(self.value)
+
+    def matches(self, record, today):
+        return self.value.lower() in record.name.value.lower()
+
+
+class PhoneCondition(Condition):
+    field = "phone"
+    index_name = "cyfry numerów telefonów"
+
+    def __init__(self, value):
+        super().__init__(value)
+        digits = value
+        self.where = "any"
+        if digits.startswith("^"):
+            digits, self.where = digits[1:], "prefix"
+        if digits.endswith("$"):
+            digits = digits[:-1]
+            self.where = "exact" if self.where == "prefix" else "suffix"
+        self.digits = digits
+        self.found = None
+
+    def estimate(self, book, today):
+        # A lookup is two bisections per start, so it is its own estimate.
+        self.found = self.lookup(book, today)
+        return len(self.found)
+
+    def lookup(self, book, today):
+        if self.found is not None:
+            return self.found
+        where = "prefix" if self.where == "exact" else self.where
+        return {
+            record_id
+            for record_id, phone_number in book.phone_index.search(self.digits, where)
+            if self.where != "exact" or phone_number == self.digits
+        }
+
+    def matches(self, record, today):
+        for phone_number in record.phone_numbers:
+            number = phone_number.value
+            if self.where == "prefix":
+                matched = number.startswith(self.digits)
+            elif self.where == "suffix":
+                matched = number.endswith(self.digits)
+            elif self.where == "exact":
+                matched = number == self.digits
+            else:
+                matched = self.digits in number
+            if matched:
+                return True
+        return False
+
+
+class EmailCondition(Condition):
+    field = "email"
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.domain = value[1:].casefold() if value.startswith("@") else None
+        self.index_name = "domeny email" if self.domain else "n-gramy adresów email"
+        self.exact = self.domain is not None
+
+    def estimate(self, book, today):
+        if self.domain is not None:
+            return len(book.domain_index.get(self.domain))
+        return ngram_estimate(book.contact_index, self.value)
+
+    def lookup(self, book, today):
+        if self.domain is not None:
+            return book.domain_index.get(self.domain)
+        return book.contact_index.candidates(self.value)
+
+    def matches(self, record, today):
+        if self.domain is not None:
+            return any(
+                email_address.domain.casefold() == self.domain
+                for email_address in record.email_addresses
+            )
+        return any(
+            self.value in email_address.value
+            for email_address in record.email_addresses
+        )
+
+
+class CityCondition(Condition):
+    field = "city"
+    index_name = "miasta"
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.city = fold_text(value)
+
+    def estimate(self, book, today):
+        return len(book.city_index.get(self.city))
+
+    def lookup(self, book, today):
+        return book.city_index.get(self.city)
+
+    def matches(self, record, today):
+        return (
+            record.address is not None and fold_text(record.address.city) == self.city
+        )
+
+
+class BirthdayCondition(Condition):
+    field = "bday"
+    index_name = "kalendarz urodzin"
+
+    def __init__(self, operator, days):
+        super().__init__(f"{operator}{days}")
+        self.days = days if operator == "<=" else days - 1
+
+    def __str__(self):
+        return f"bday{self.value}"
+
+    def buckets(self, book, today):
+        for _, _, buckets in BirthdayIndex.window(today, self.days):
+            for bucket in buckets:
+                yield book.birthday_index.buckets[bucket]
+
+    def estimate(self, book, today):
+        if self.days < 0:
+            return 0
+        return sum(len(record_ids) for record_ids in self.buckets(book, today))
+
+    def lookup(self, book, today):
+        if self.days < 0:
+            return set()
+        return set().union(*self.buckets(book, today))
+
+    def matches(self, record, today):
+        return (
+            record.birthdate is not None
+            and record.days_to_birthdate(today) <= self.days
+        )
+
+
+class TextCondition(Condition):
+    """A word without a field, matched against names, phones and emails."""
+
+    field = "tekst"
+    index_name = "n-gramy i cyfry telefonów"
+    exact = False
+
+    def __init__(self, value):
+        super().__init__(value)
+        self.found = None
+
+    def __str__(self):
+        return self.value
+
+    def estimate(self, book, today):
+        self.found = self.lookup(book, today)
+        return None if self.found is None else len(self.found)
+
+    def lookup(self, book, today):
+        if self.found is not None:
+            return self.found
+        name_ids = book.name_index.candidates(self.value)
+        contact_ids = book.contact_index.candidates(self.value)
+        if name_ids is None or contact_ids is None:
+            return None
+        phone_ids = {record_id for record_id, _ in book.phone_index.search(self.value)}
+        return name_ids | contact_ids | phone_ids
+
+    def matches(self, record, today):
+        return (
+            self.value.lower() in record.name.value.lower()
+            or any(
+                self.value in phone_number.value
+                for phone_number in record.phone_numbers
+            )
+            or any(
+                self.value in email_address.value
+                for email_address in record.email_addresses
+            )
+        )
+
+
+CONDITIONS = {
+    "name": NameCondition,
+    "phone": PhoneCondition,
+    "email": EmailCondition,
+    "city": CityCondition,
+}
+
+
+def parse_query(text):
+    """Parses the query text into a list of conditions."""
+    try:
+        words = shlex.split(text)
+    except ValueError:
+        raise ValueError("Niezamknięty cudzysłów w zapytaniu")
+    conditions = []
+    for word in words:
+        birthday = BIRTHDAY_PATTERN.fullmatch(word)
+        field, separator, value = word.partition(":")
+        if birthday:
+            conditions.append(BirthdayCondition(birthday[1], int(birthday[2])))
+        elif word.startswith("bday"):
+            raise ValueError(f"Niepoprawny warunek urodzin: {word}")
+        elif separator and field in CONDITIONS:
+            if not value:
+                raise ValueError(f"Brak wartości pola: {field}")
+            conditions.append(CONDITIONS[field](value))
+        else:
+            conditions.append(TextCondition(word))
+    return conditions
+
+
+class PlanStep:
+    """A condition of the plan with how it was evaluated."""
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.estimate = None
+        self.method = "filtr"
+        self.candidates = None
+
+
+class QueryPlan:
+    """Plan of a query over a book, with the timings of its last execution."""
+
+    def __init__(self, book, text, today=None):
+        self.book = book
+        self.text = text
+        self.today = today
+        self.steps = []
+        self.timings = []
+        self.checked = 0
+        self.results = None
+
+    def timed(self, stage, started):
+        """Records the time since started under the stage and returns the time now."""
+        now = time.perf_counter()
+        self.timings.append((stage, now - started))
+        return now
+
+    def storage_lookup(self, today):
+        """Returns the IDs the storage of the book finds for the query, or None."""
+        found = self.book.query_candidates(
+            [step.condition for step in self.steps], today
+        )
+        if found is None:
+            return None
+        record_ids, used = found
+        for step in self.steps:
+            if any(step.condition is condition for condition in used):
+                step.method = "baza danych"
+                step.candidates = len(record_ids)
+        return record_ids
+
+    def execute(self):
+        """Runs the query and returns the matching records in the order of the book."""
+        self.timings = []
+        today = self.today or date.today()
+        started = time.perf_counter()
+        self.steps = [PlanStep(condition) for condition in parse_query(self.text)]
+        started = self.timed("parsowanie", started)
+
+        if self.book.query_indexes:
+            for step in self.steps:
+                step.estimate = step.condition.estimate(self.book, today)
+        indexed = sorted(
+            (step for step in self.steps if step.estimate is not None),
+            key=lambda step: step.estimate,
+        )
+        started = self.timed("szacowanie", started)
+
+        candidates = None
+        for step in indexed:
+            if candidates is not None and (
+                not candidates or step.estimate > LOOKUP_RATIO * len(candidates)
+            ):
+                break
+            found = step.condition.lookup(self.book, today)
+            candidates = found if candidates is None else candidates & found
+            step.method = "indeks"
+            step.candidates = len(candidates)
+            started = self.timed(f"indeks {step.condition}", started)
+
+        record_ids = None
+        if candidates is not None:
+            record_ids = self.book.ordered_ids(candidates)
+        elif not self.book.query_indexes:
+            record_ids = self.storage_lookup(today)
+            started = self.timed("zapytanie do bazy", started)
+        if record_ids is None:
+            records = list(self.book.data.values())
+        else:
+            records = [self.book.data[record_id] for record_id in record_ids]
+        started = self.timed("pobranie rekordów", started)
+
+        # What the storage finds is checked again, as the indexes may find more.
+        checks = [
+            step.condition
+            for step in self.steps
+            if step.method != "indeks" or not step.condition.exact
+        ]
+        self.checked = len(records)
+        self.results = [
+            record
+            for record in records
+            if all(condition.matches(record, today) for condition in checks)
+        ]
+        self.timed("sprawdzanie warunków", started)
+        return self.results
+
+    def explain(self):
+        """Describes how the last execution ran the query and where the time went."""
+        if self.results is None:
+            self.execute()
+        lines = [f"Zapytanie: {self.text}"]
+        for number, step in enumerate(self.steps, start=1):
+            condition = step.condition
+            if step.method == "indeks":
+                recheck = "" if condition.exact else ", sprawdzany ponownie"
+                lines.append(
+                    f"{number}. {condition}: indeks {condition.index_name} "
+                    f"(szacunek {step.estimate}) -> {step.candidates} kandydatów"
+                    f"{recheck}"
+                )
+            elif step.method == "baza danych":
+                lines.append(
+                    f"{number}. {condition}: w zapytaniu do bazy danych "
+                    f"-> {step.candidates} kandydatów, sprawdzany ponownie"
+                )
+            elif step.estimate is not None:
+                lines.append(
+                    f"{number}. {condition}: filtr, indeks {condition.index_name} "
+                    f"pominięty (szacunek {step.estimate})"
+                )
+            else:
+                lines.append(f"{number}. {condition}: filtr, bez indeksu")
+        lines.append(
+            f"Sprawdzono {self.checked} rekordów, pasuje {len(self.results)}."
+        )
+        lines.append("Czasy etapów:")
+        for stage, seconds in self.timings:
+            lines.append(f"  {stage}: {seconds * 1000:.3f} ms")
+        total = sum(seconds for _, seconds in self.timings)
+        lines.append(f"  razem: {total * 1000:.3f} ms")
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Wyszukuje kontakty w książce adresowej zapytaniem."
+    )
+    parser.add_argument("query")
+    parser.add_argument("--book", default="address_book.pkl")
+    parser.add_argument("--explain", action="store_true", help="pokaż plan i czasy")
+    args = parser.parse_args()
+
+    book = load_address_book(args.book)
+    plan = QueryPlan(book, args.query)
+    today = date.today()
+    for record in plan.execute():
+        print(record.to_string(today))
+    if args.explain:
+        print(plan.explain())
+    book.close()
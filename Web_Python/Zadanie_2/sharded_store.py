@@ -0,0 +1,441 @@
+"""Address book partitioned across worker processes.
+
+Records are hash-partitioned by ID across shards, each a worker process owning
+a plain AddressBook with its own indexes. Searches are sent to every shard at
+once and the replies, each already in book order, are merged into one list in
+book order, so the results do not depend on the number of shards. Bulk adds
+send every shard its part in one message.
+
+The parent process keeps the IDs, their positions in the book, the name trie,
+whose completions must count the words of all shards and which is asked on
+every key press, and the journal. The journal has the same format as a
+pickled book, so a book saved in one mode opens in the other:
+
+    python assistant_bot.py --storage sharded --shards 4
+
+find_record throughput of both modes over a saved book is compared with:
+
+    python sharded_store.py kowal nowak 600 --shards 4
+"""
+
+import argparse
+import heapq
+import multiprocessing
+import os
+import time
+import weakref
+from collections.abc import ItemsView, MutableMapping, ValuesView
+from datetime import date, datetime
+from itertools import islice
+from operator import itemgetter
+
+from assistant_bot import (
+    AddressBook,
+    BookState,
+    Journal,
+    UpcomingBirthday,
+    load_address_book,
+)
+
+
+# Records fetched from the shards per message while iterating over the book.
+BATCH_SIZE = 1000
+
+
+class Shard:
+    """The records of one partition and their indexes, in a worker process.
+
+    Requests name a method of the shard, or of its book for the searches.
+    """
+
+    def __init__(self):
+        self.book = AddressBook()
+
+    def __getattr__(self, name):
+        return getattr(self.book, name)
+
+    def put(self, entries):
+        """Stores (position, record) pairs, replacing records with the same IDs."""
+        book = self.book
+        for position, record in entries:
+            book.data[record.id] = record
+            # The shard orders its results by the positions in the whole book.
+            book.positions.setdefault(record.id, position)
+            book.index_record(record.id, record)
+        book.settle_indexes()
+
+    def delete(self, record_ids):
+        """Removes the records with the IDs."""
+        for record_id in record_ids:
+            del self.book.data[record_id]
+            self.book.unindex_record(record_id)
+        self.book.settle_indexes()
+
+    def get(self, record_ids):
+        """Returns the records with the IDs."""
+        return [self.book.data[record_id] for record_id in record_ids]
+
+    def search_candidates(self, search_term, record_ids=frozenset()):
+        return list(self.book.search_candidates(search_term, record_ids))
+
+
+def serve_shard(connection):
+    """Answers (method, args) requests with (True, result) or (False, error).
+
+    A None request stops the worker.
+    """
+    shard = Shard()
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            reply = (True, getattr(shard, method)(*args))
+        except Exception as e:
+            reply = (False, e)
+        connection.send(reply)
+    connection.close()
+
+
+class ShardPool:
+    """Worker processes of the shards and the pipes to them."""
+
+    def __init__(self, count):
+        self.connections = []
+        self.workers = []
+        for _ in range(count):
+            connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=serve_shard, args=(worker_connection,), daemon=True
+            )
+            worker.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def shard_of(self, record_id):
+        """Returns the number of the shard owning the record ID."""
+        return hash(record_id) % len(self.connections)
+
+    def request(self, requests):
+        """Sends {shard: (method, args)} and returns {shard: result}.
+
+        All requests are sent before any reply is read, so the shards work on
+        them at the same time. An error of any shard is raised once all replied.
+        """
+        for shard, request in requests.items():
+            self.connections[shard].send(request)
+        results = {}
+        error = None
+        for shard in requests:
+            succeeded, result = self.connections[shard].recv()
+            if succeeded:
+                results[shard] = result
+            elif error is None:
+                error = result
+        if error is not None:
+            raise error
+        return results
+
+    def broadcast(self, method, *args):
+        """Sends the same request to every shard and returns their results."""
+        requests = {shard: (method, args) for shard in range(len(self.connections))}
+        return list(self.request(requests).values())
+
+    def close(self):
+        """Stops the workers."""
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+
+
+class ShardRecordValues(ValuesView):
+    def __iter__(self):
+        for _, record in self._mapping.batches():
+            yield record
+
+
+class ShardRecordItems(ItemsView):
+    def __iter__(self):
+        return self._mapping.batches()
+
+
+class ShardRecords(MutableMapping):
+    """Mapping of record IDs to the records kept by the shards.
+
+    The IDs and their positions in the book are kept here, so membership,
+    length and order need no shard. Records handed out are cached weakly, so
+    an edited record is the same object until it is written back.
+    """
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.positions = {}
+        self.next_position = 0
+        self.cache = weakref.WeakValueDictionary()
+
+    def adopt(self, record):
+        """Returns the cached copy of a record received from a shard, or caches it."""
+        cached = self.cache.get(record.id)
+        if cached is not None:
+            return cached
+        self.cache[record.id] = record
+        return record
+
+    def store(self, records):
+        """Sends the records, which have their IDs, to their shards in one go."""
+        entries = {}
+        for record in records:
+            position = self.positions.get(record.id)
+            if position is None:
+                position = self.positions[record.id] = self.next_position
+                self.next_position += 1
+            self.cache[record.id] = record
+            entries.setdefault(self.shards.shard_of(record.id), []).append(
+                (position, record)
+            )
+        self.shards.request(
+            {
+                shard: ("put", (shard_entries,))
+                for shard, shard_entries in entries.items()
+            }
+        )
+
+    def get_many(self, record_ids):
+        """Returns the records with the IDs, asking each shard once for the rest."""
+        records = [self.cache.get(record_id) for record_id in record_ids]
+        missing = {}
+        for index, record_id in enumerate(record_ids):
+            if records[index] is None:
+                missing.setdefault(self.shards.shard_of(record_id), []).append(index)
+        results = self.shards.request(
+            {
+                shard: ("get", ([record_ids[index] for index in indexes],))
+                for shard, indexes in missing.items()
+            }
+        )
+        for shard, indexes in missing.items():
+            for index, record in zip(indexes, results[shard]):
+                records[index] = self.adopt(record)
+        return records
+
+    def batches(self):
+        """Yields (ID, record) in book order, fetching the records in batches."""
+        size = len(self.positions)
+        record_ids = iter(self.positions)
+        while True:
+            batch = list(islice(record_ids, BATCH_SIZE))
+            if not batch:
+                return
+            for item in zip(batch, self.get_many(batch)):
+                if len(self.positions) != size:
+                    raise RuntimeError("book changed size during iteration")
+                yield item
+
+    def values(self):
+        return ShardRecordValues(self)
+
+    def items(self):
+        return ShardRecordItems(self)
+
+    def __getitem__(self, record_id):
+        if record_id not in self.positions:
+            raise KeyError(record_id)
+        return self.get_many([record_id])[0]
+
+    def __setitem__(self, record_id, record):
+        record.id = record_id
+        self.store([record])
+
+    def __delitem__(self, record_id):
+        if record_id not in self.positions:
+            raise KeyError(record_id)
+        self.shards.request(
+            {self.shards.shard_of(record_id): ("delete", ([record_id],))}
+        )
+        del self.positions[record_id]
+        self.cache.pop(record_id, None)
+
+    def __contains__(self, record_id):
+        return record_id in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+class ShardedAddressBook(AddressBook):
+    """Address book whose records and indexes are split across worker processes."""
+
+    # The shards run the queries with their own indexes.
+    query_indexes = False
+
+    def __init__(self, filename="address_book.pkl", shards=None):
+        super().__init__()
+        self.shards = ShardPool(shards or os.cpu_count() or 1)
+        self.data = ShardRecords(self.shards)
+        self.positions = self.data.positions
+        self.journal = Journal(filename, BookState)
+        if not self.journal.exists():
+            print("Plik nie istnieje, tworzenie nowej książki adresowej.")
+            return
+        try:
+            state = self.journal.load()
+            self.journal.open()
+            self.ids = state.ids
+            records = list(state.records.values())
+            del state
+            for record in records:
+                self.name_trie.add(record.id, record.name.value)
+            for start in range(0, len(records), BATCH_SIZE * len(self.shards)):
+                self.data.store(records[start : start + BATCH_SIZE * len(self.shards)])
+            if os.path.exists(self.journal.sealed_filename):
+                self.journal.compact()
+        except Exception as e:
+            print(f"Błąd przy ładowaniu książki adresowej: {e}")
+
+    def index_record(self, record_id, record):
+        """Updates the name trie; the shards index the records they store."""
+        self.name_trie.add(record_id, record.name.value)
+
+    def unindex_record(self, record_id):
+        """Updates the name trie; the shards unindex the records they delete."""
+        self.name_trie.remove(record_id)
+
+    def rebuild_index(self):
+        """The shards keep their own indexes."""
+
+    def add_records(self, records):
+        """Adds many records, sending every shard its part in one message."""
+        for record in records:
+            record.id = self.ids.allocate()
+            self.index_record(record.id, record)
+        self.data.store(records)
+        for record in records:
+            self.log_change("add", record.id, record)
+        self.id_changes += len(records)
+
+    def update_record(self, record_id):
+        """Sends the edited record back to its shard and journals it."""
+        record = self.data[record_id]
+        self.data[record_id] = record
+        self.index_record(record_id, record)
+        self.log_change("edit", record_id, record)
+
+    def merged(self, results, record_of=lambda item: item):
+        """Merges per-shard results in book order into one list in book order."""
+        position = self.positions.__getitem__
+        return list(
+            heapq.merge(*results, key=lambda item: position(record_of(item).id))
+        )
+
+    def adopted(self, records):
+        return [self.data.adopt(record) for record in records]
+
+    def find_record(self, search_term):
+        """Finds entries containing the exact phrase provided."""
+        return self.adopted(
+            self.merged(self.shards.broadcast("find_record", search_term))
+        )
+
+    def search_candidates(self, search_term, record_ids=frozenset()):
+        """Returns the records that may contain the phrase, in the order of the book."""
+        return self.adopted(
+            self.merged(
+                self.shards.broadcast("search_candidates", search_term, record_ids)
+            )
+        )
+
+    def find_phone_numbers(self, digits, where="any"):
+        """Finds the phone numbers with the digits, as (record, phone number) pairs."""
+        pairs = self.shards.broadcast("find_phone_numbers", digits, where)
+        return [
+            (self.data.adopt(record), phone_number)
+            for record, phone_number in self.merged(pairs, itemgetter(0))
+        ]
+
+    def find_similar_records(self, search_term, limit=5):
+        """Finds the records whose names are closest to the phrase, best first."""
+        found = [
+            pair
+            for pairs in self.shards.broadcast(
+                "find_similar_records", search_term, limit
+            )
+            for pair in pairs
+        ]
+        found.sort(key=lambda pair: (-pair[1], self.positions[pair[0].id]))
+        return [(self.data.adopt(record), score) for record, score in found[:limit]]
+
+    def query(self, text, today=None):
+        """Returns the records matching a query such as "name:kowal bday<30"."""
+        today = today or date.today()
+        return self.adopted(self.merged(self.shards.broadcast("query", text, today)))
+
+    def find_records_by_name(self, name):
+        """Finds records that match the given name and surname."""
+        pairs = self.shards.broadcast("find_records_by_name", name)
+        return [
+            (record_id, self.data.adopt(record))
+            for record_id, record in self.merged(pairs, itemgetter(1))
+        ]
+
+    def upcoming_birthdays(self, days, today=None):
+        """Returns the birthdays within the next days, soonest first."""
+        today = today or datetime.now().date()
+        position = self.positions.__getitem__
+        upcoming = heapq.merge(
+            *self.shards.broadcast("upcoming_birthdays", days, today),
+            key=lambda entry: (entry.days, position(entry.record.id)),
+        )
+        return [
+            UpcomingBirthday(self.data.adopt(entry.record), entry.birthday, entry.days)
+            for entry in upcoming
+        ]
+
+    def close(self):
+        """Closes the journal and stops the shards."""
+        super().close()
+        self.shards.close()
+
+
+def searches_per_second(book, terms, seconds):
+    """Runs find_record over the terms for about the given time."""
+    searches = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for term in terms:
+            book.find_record(term)
+        searches += len(terms)
+    return searches / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Porównuje wyszukiwanie w zwykłej i podzielonej książce."
+    )
+    parser.add_argument("terms", nargs="+", help="szukane frazy")
+    parser.add_argument("--book", default="address_book.pkl")
+    parser.add_argument("--shards", type=int)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    book = load_address_book(args.book)
+    rate = searches_per_second(book, args.terms, args.seconds)
+    print(f"Jeden proces: {rate:.0f} wyszukiwań/s")
+    book.close()
+    del book
+
+    book = ShardedAddressBook(args.book, args.shards)
+    rate = searches_per_second(book, args.terms, args.seconds)
+    print(f"{len(book.shards)} shardów: {rate:.0f} wyszukiwań/s")
+    book.close()
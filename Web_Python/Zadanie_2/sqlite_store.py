@@ -0,0 +1,563 @@
+"""SQLite storage backend for the assistant bot's address book.
+
+Records are kept in normalized tables and only built into Record objects when
+they are accessed, so the bot does not hold the whole book in memory. Names,
+phone numbers and email addresses are also kept in an FTS5 table using the
+trigram tokenizer, which answers the substring searches of find_record from an
+index. Phone digit searches use an index on the numbers and the same table.
+Fuzzy name search and name completion have no SQL counterpart, so their
+indexes are built from the tables on first use and kept up to date from then
+on.
+
+An existing pickled book (journal included) is imported with:
+
+    python sqlite_store.py address_book.pkl address_book.db
+"""
+
+import argparse
+import sqlite3
+import weakref
+from collections.abc import MutableMapping
+from datetime import datetime
+
+from assistant_bot import (
+    Address,
+    AddressBook,
+    BirthDate,
+    BirthdayIndex,
+    EmailAddress,
+    FuzzyNameIndex,
+    Name,
+    NameTrie,
+    PhoneDigitIndex,
+    PhoneNumber,
+    Record,
+    UpcomingBirthday,
+    fold_text,
+    load_address_book,
+)
+from query import (
+    BirthdayCondition,
+    CityCondition,
+    EmailCondition,
+    NameCondition,
+    PhoneCondition,
+    TextCondition,
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    birthdate TEXT,
+    birth_bucket INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_position ON records (position);
+CREATE INDEX IF NOT EXISTS records_birth_bucket ON records (birth_bucket);
+
+CREATE TABLE IF NOT EXISTS phones (
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    slot INTEGER NOT NULL,
+    number TEXT NOT NULL,
+    PRIMARY KEY (record_id, slot)
+);
+CREATE INDEX IF NOT EXISTS phones_number ON phones (number);
+
+CREATE TABLE IF NOT EXISTS emails (
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    slot INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    PRIMARY KEY (record_id, slot)
+);
+
+CREATE TABLE IF NOT EXISTS addresses (
+    record_id INTEGER PRIMARY KEY REFERENCES records (id) ON DELETE CASCADE,
+    street TEXT NOT NULL,
+    city TEXT NOT NULL,
+    postal_code TEXT NOT NULL,
+    country TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS free_ids (
+    id INTEGER PRIMARY KEY
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS records_fts
+    USING fts5 (name, contacts, tokenize = 'trigram');
+"""
+
+
+def fts_phrase(term, column=None):
+    """Quotes the term as an FTS5 phrase, optionally limited to one column."""
+    phrase = '"' + term.replace('"', '""') + '"'
+    if column is not None:
+        return f"{column} : {phrase}"
+    return phrase
+
+
+def condition_sql(condition, today):
+    """Returns an SQL condition on records with its parameters, or None.
+
+    The records it selects include all the records matching the query
+    condition, and may include a few more, as the full-text table ignores case.
+    """
+    if isinstance(condition, (NameCondition, TextCondition)):
+        if len(condition.value) < 3:
+            return None
+        column = "name" if isinstance(condition, NameCondition) else None
+        return (
+            "id IN (SELECT rowid FROM records_fts WHERE records_fts MATCH ?)",
+            [fts_phrase(condition.value, column)],
+        )
+    if isinstance(condition, PhoneCondition):
+        digits = condition.digits
+        if not (digits.isascii() and digits.isdigit()):
+            return None
+        if condition.where == "prefix":
+            # ":" follows "9", so the range holds every number with the prefix.
+            test, parameters = "number >= ? AND number < ?", [digits, digits + ":"]
+        elif condition.where == "suffix":
+            test, parameters = "number LIKE ?", ["%" + digits]
+        elif condition.where == "exact":
+            test, parameters = "number = ?", [digits]
+        else:
+            test, parameters = "instr(number, ?) > 0", [digits]
+        return f"id IN (SELECT record_id FROM phones WHERE {test})", parameters
+    if isinstance(condition, EmailCondition):
+        if condition.domain is None:
+            return (
+                "id IN (SELECT record_id FROM emails WHERE instr(address, ?) > 0)",
+                [condition.value],
+            )
+        if not condition.domain.isascii():
+            return None
+        # Addresses are ASCII with a single "@", so lower() folds their case.
+        return (
+            "id IN (SELECT record_id FROM emails "
+            "WHERE lower(substr(address, instr(address, '@') + 1)) = ?)",
+            [condition.domain],
+        )
+    if isinstance(condition, CityCondition):
+        return (
+            "id IN (SELECT record_id FROM addresses WHERE fold_text(city) = ?)",
+            [condition.city],
+        )
+    if isinstance(condition, BirthdayCondition):
+        buckets = [
+            bucket
+            for _, _, day_buckets in BirthdayIndex.window(today, condition.days)
+            for bucket in day_buckets
+        ]
+        if not buckets:
+            return "0", []
+        placeholders = ", ".join("?" * len(buckets))
+        return f"birth_bucket IN ({placeholders})", buckets
+    return None
+
+
+class SQLiteRecords(MutableMapping):
+    """Mapping of record IDs to the records stored in the database.
+
+    Records handed out are cached weakly, so an edited record is the same
+    object until it is written back with the mapping.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cache = weakref.WeakValueDictionary()
+
+    def __getitem__(self, record_id):
+        record = self.cache.get(record_id)
+        if record is None:
+            record = self.load(record_id)
+            self.cache[record_id] = record
+        return record
+
+    def load(self, record_id):
+        """Builds the record from its rows."""
+        row = self.connection.execute(
+            "SELECT name, birthdate FROM records WHERE id = ?", (record_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(record_id)
+        name, birthdate = row
+        record = Record(Name(name), BirthDate(birthdate) if birthdate else None)
+        record.id = record_id
+        for (number,) in self.connection.execute(
+            "SELECT number FROM phones WHERE record_id = ? ORDER BY slot", (record_id,)
+        ):
+            record.add_phone_number(PhoneNumber(number))
+        for (address,) in self.connection.execute(
+            "SELECT address FROM emails WHERE record_id = ? ORDER BY slot", (record_id,)
+        ):
+            record.add_email_address(EmailAddress(address))
+        row = self.connection.execute(
+            "SELECT street, city, postal_code, country FROM addresses "
+            "WHERE record_id = ?",
+            (record_id,),
+        ).fetchone()
+        if row is not None:
+            record.add_address(Address(*row))
+        return record
+
+    def __setitem__(self, record_id, record):
+        birthdate = record.birthdate.value if record.birthdate else None
+        birth_bucket = None
+        if birthdate:
+            parsed = record.birthdate.date
+            birth_bucket = BirthdayIndex.bucket(parsed.month, parsed.day)
+        self.connection.execute(
+            "INSERT INTO records (id, position, name, birthdate, birth_bucket) "
+            "VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM records), ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET name = excluded.name, "
+            "birthdate = excluded.birthdate, birth_bucket = excluded.birth_bucket",
+            (record_id, record.name.value, birthdate, birth_bucket),
+        )
+        self.delete_details(record_id)
+        self.connection.executemany(
+            "INSERT INTO phones (record_id, slot, number) VALUES (?, ?, ?)",
+            [
+                (record_id, slot, phone_number.value)
+                for slot, phone_number in enumerate(record.phone_numbers)
+            ],
+        )
+        self.connection.executemany(
+            "INSERT INTO emails (record_id, slot, address) VALUES (?, ?, ?)",
+            [
+                (record_id, slot, email_address.value)
+                for slot, email_address in enumerate(record.email_addresses)
+            ],
+        )
+        if record.address:
+            self.connection.execute(
+                "INSERT INTO addresses (record_id, street, city, postal_code, country) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    record_id,
+                    record.address.street,
+                    record.address.city,
+                    record.address.postal_code,
+                    record.address.country,
+                ),
+            )
+        contacts = " ".join(
+            [phone_number.value for phone_number in record.phone_numbers]
+            + [email_address.value for email_address in record.email_addresses]
+        )
+        self.connection.execute(
+            "INSERT INTO records_fts (rowid, name, contacts) VALUES (?, ?, ?)",
+            (record_id, record.name.value, contacts),
+        )
+        record.id = record_id
+        self.cache[record_id] = record
+
+    def delete_details(self, record_id):
+        """Removes the phones, emails, address and search entry of the record."""
+        for table in ("phones", "emails", "addresses"):
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE record_id = ?", (record_id,)
+            )
+        self.connection.execute("DELETE FROM records_fts WHERE rowid = ?", (record_id,))
+
+    def __delitem__(self, record_id):
+        if record_id not in self:
+            raise KeyError(record_id)
+        self.delete_details(record_id)
+        self.connection.execute("DELETE FROM records WHERE id = ?", (record_id,))
+        self.cache.pop(record_id, None)
+
+    def __contains__(self, record_id):
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM records WHERE id = ?", (record_id,)
+            ).fetchone()
+            is not None
+        )
+
+    def __iter__(self):
+        for (record_id,) in self.connection.execute(
+            "SELECT id FROM records ORDER BY position"
+        ):
+            yield record_id
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+
+class SQLiteIdAllocator:
+    """Record ID allocator keeping released IDs in the free_ids table."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def allocate(self):
+        """Returns the smallest free ID and marks it as used."""
+        (record_id,) = self.connection.execute("SELECT MIN(id) FROM free_ids").fetchone()
+        if record_id is None:
+            (record_id,) = self.connection.execute(
+                "SELECT COALESCE(MAX(id), 0) + 1 FROM records"
+            ).fetchone()
+        else:
+            self.connection.execute("DELETE FROM free_ids WHERE id = ?", (record_id,))
+        return record_id
+
+    def release(self, record_id):
+        """Returns the ID to the pool."""
+        self.connection.execute(
+            "INSERT OR IGNORE INTO free_ids (id) VALUES (?)", (record_id,)
+        )
+
+
+class SQLiteJournal:
+    """Stands in for the address book journal; every logged change is a commit."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def append(self, entry):
+        """Commits the change the entry describes."""
+        self.connection.commit()
+
+    def sync(self):
+        """Commits pending changes."""
+        self.connection.commit()
+
+    def should_compact(self):
+        """SQLite manages its own write-ahead log."""
+        return False
+
+    def close(self):
+        """Commits and closes the database."""
+        self.connection.commit()
+        self.connection.close()
+
+
+class SQLiteAddressBook(AddressBook):
+    """Address book stored in an SQLite database and queried through its indexes."""
+
+    # The in-memory indexes are empty or built lazily, so queries scan the records.
+    query_indexes = False
+
+    def __init__(self, filename="address_book.db"):
+        super().__init__()
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.create_function("fold_text", 1, fold_text, deterministic=True)
+        self.connection.executescript(SCHEMA)
+        self.data = SQLiteRecords(self.connection)
+        self.journal = SQLiteJournal(self.connection)
+        self.ids = SQLiteIdAllocator(self.connection)
+        self.fuzzy_index = None
+        self.name_trie = None
+
+    def index_record(self, record_id, record):
+        """Updates the name indexes held in memory, if built; SQLite keeps the rest."""
+        if self.fuzzy_index is not None:
+            self.fuzzy_index.add(record_id, record.name.value)
+        if self.name_trie is not None:
+            self.name_trie.add(record_id, record.name.value)
+
+    def unindex_record(self, record_id):
+        """Updates the name indexes held in memory, if built; SQLite keeps the rest."""
+        if self.fuzzy_index is not None:
+            self.fuzzy_index.remove(record_id)
+        if self.name_trie is not None:
+            self.name_trie.remove(record_id)
+
+    def settle_indexes(self):
+        """The indexes held in memory need no upkeep between searches."""
+
+    def names(self):
+        """Yields (ID, name) for every record."""
+        yield from self.connection.execute("SELECT id, name FROM records")
+
+    def rebuild_index(self):
+        """The database keeps its own indexes."""
+
+    def add_records(self, records):
+        """Adds many records in a single transaction."""
+        for record in records:
+            record.id = self.ids.allocate()
+            self.data[record.id] = record
+            self.index_record(record.id, record)
+        self.id_changes += len(records)
+        self.connection.commit()
+
+    def remove_record(self, record_id):
+        """Removes the record and frees its ID in a single transaction."""
+        with self.connection:
+            del self.data[record_id]
+            self.ids.release(record_id)
+        self.id_changes += 1
+        self.unindex_record(record_id)
+
+    def update_record(self, record_id):
+        """Writes the edited record back to the database."""
+        record = self.data[record_id]
+        self.data[record_id] = record
+        self.index_record(record_id, record)
+        self.log_change("edit", record_id)
+
+    def matching_ids(self, match):
+        """Returns the IDs of the records matching the FTS5 query, in book order."""
+        return [
+            record_id
+            for (record_id,) in self.connection.execute(
+                "SELECT records.id FROM records_fts "
+                "JOIN records ON records.id = records_fts.rowid "
+                "WHERE records_fts MATCH ? ORDER BY records.position",
+                (match,),
+            )
+        ]
+
+    def query_candidates(self, conditions, today):
+        """Selects the records that may match the query conditions in one query."""
+        used = []
+        tests = []
+        parameters = []
+        for condition in conditions:
+            sql = condition_sql(condition, today)
+            if sql is not None:
+                used.append(condition)
+                tests.append(sql[0])
+                parameters.extend(sql[1])
+        if not used:
+            return None
+        record_ids = [
+            record_id
+            for (record_id,) in self.connection.execute(
+                f"SELECT id FROM records WHERE {' AND '.join(tests)} "
+                "ORDER BY position",
+                parameters,
+            )
+        ]
+        return record_ids, used
+
+    def search_candidates(self, search_term, record_ids=frozenset()):
+        """Returns the records that may contain the phrase, in the order of the book.
+
+        The full-text table covers phone numbers too, so the IDs found by the
+        digit index are among the matches already.
+        """
+        if len(search_term) < 3:
+            return self.data.values()
+        record_ids = self.matching_ids(fts_phrase(search_term))
+        return [self.data[record_id] for record_id in record_ids]
+
+    def find_phone_numbers(self, digits, where="any"):
+        """Finds the phone numbers with the digits, as (record, phone number) pairs.
+
+        Prefixes are a range of the index on the numbers. Other searches for
+        three or more digits only check the numbers of the records the
+        full-text table finds; fewer digits match so many numbers that the
+        phones table is read through.
+        """
+        if not (digits.isascii() and digits.isdigit()):
+            return []
+        if len(digits) > PhoneDigitIndex.DIGITS:
+            return []
+        if where == "prefix":
+            # ":" follows "9", so the range holds every number with the prefix.
+            rows = self.connection.execute(
+                "SELECT record_id, number FROM phones "
+                "WHERE number >= ? AND number < ? ORDER BY record_id, slot",
+                (digits, digits + ":"),
+            )
+        else:
+            pattern = "%" + digits if where == "suffix" else "%" + digits + "%"
+            if len(digits) >= 3:
+                rows = self.connection.execute(
+                    "SELECT record_id, number FROM phones "
+                    "WHERE record_id IN "
+                    "(SELECT rowid FROM records_fts WHERE records_fts MATCH ?) "
+                    "AND number LIKE ? ORDER BY record_id, slot",
+                    (fts_phrase(digits, "contacts"), pattern),
+                )
+            else:
+                rows = self.connection.execute(
+                    "SELECT record_id, number FROM phones "
+                    "WHERE number LIKE ? ORDER BY record_id, slot",
+                    (pattern,),
+                )
+        return [(self.data[record_id], number) for record_id, number in rows.fetchall()]
+
+    def find_similar_records(self, search_term, limit=5):
+        """Finds the records whose names are closest to the phrase, best first."""
+        if self.fuzzy_index is None:
+            self.fuzzy_index = FuzzyNameIndex()
+            for record_id, name in self.names():
+                self.fuzzy_index.add(record_id, name)
+        return super().find_similar_records(search_term, limit)
+
+    def complete_name(self, prefix, limit=5):
+        """Returns the most common words of names starting with the prefix."""
+        if self.name_trie is None:
+            self.name_trie = NameTrie()
+            for record_id, name in self.names():
+                self.name_trie.add(record_id, name)
+        return super().complete_name(prefix, limit)
+
+    def find_records_by_name(self, name):
+        """Finds records that match the given name and surname."""
+        if len(name) < 3:
+            record_ids = self.data.keys()
+        else:
+            record_ids = self.matching_ids(fts_phrase(name, "name"))
+        matching_records = []
+        for record_id in record_ids:
+            record = self.data[record_id]
+            if name.lower() in record.name.value.lower():
+                matching_records.append((record_id, record))
+        return matching_records
+
+    def upcoming_birthdays(self, days, today=None):
+        """Returns the birthdays within the next days, soonest first."""
+        today = today or datetime.now().date()
+        days_by_bucket = {}
+        for day, offset, buckets in BirthdayIndex.window(today, int(days)):
+            for bucket in buckets:
+                days_by_bucket[bucket] = (day, offset)
+        if not days_by_bucket:
+            return []
+        placeholders = ", ".join("?" * len(days_by_bucket))
+        rows = self.connection.execute(
+            "SELECT id, birth_bucket FROM records "
+            f"WHERE birth_bucket IN ({placeholders}) ORDER BY position",
+            list(days_by_bucket),
+        ).fetchall()
+        rows.sort(key=lambda row: days_by_bucket[row[1]][1])
+        upcoming_birthdays = []
+        for record_id, bucket in rows:
+            birthday, days_to = days_by_bucket[bucket]
+            upcoming_birthdays.append(
+                UpcomingBirthday(self.data[record_id], birthday, days_to)
+            )
+        return upcoming_birthdays
+
+
+def import_address_book(pickle_filename, database_filename):
+    """Copies a pickled address book, journal included, into an SQLite database."""
+    source = load_address_book(pickle_filename)
+    book = SQLiteAddressBook(database_filename)
+    with book.connection:
+        for record_id, record in source.data.items():
+            book.data[record_id] = record
+        for record_id in source.ids.free:
+            book.ids.release(record_id)
+    source.close()
+    book.close()
+    return len(source.data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Importuje książkę adresową z pliku .pkl do bazy SQLite."
+    )
+    parser.add_argument("pickle_filename", nargs="?", default="address_book.pkl")
+    parser.add_argument("database_filename", nargs="?", default="address_book.db")
+    args = parser.parse_args()
+    count = import_address_book(args.pickle_filename, args.database_filename)
+    print(f"Zaimportowano {count} rekordów do {args.database_filename}.")
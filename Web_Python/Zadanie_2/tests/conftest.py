@@ -0,0 +1,77 @@
+"""Fixtures shared by the tests of the assistant bot and its storage modules."""
+
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules import each other by name, as when run from their directory.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from assistant_bot import (  # noqa: E402
+    Address,
+    BirthDate,
+    EmailAddress,
+    Name,
+    PhoneNumber,
+    Record,
+)
+
+
+FIRST_NAMES = ["Jan", "Anna", "Łukasz", "Zofia", "Piotr", "Małgorzata", "Ewa"]
+LAST_NAMES = ["Kowalski", "Nowak", "Wiśniewska", "Żółkiewski", "Lewandowska"]
+CITIES = ["Kraków", "Łódź", "Gdańsk", "Poznań"]
+DOMAINS = ["wp.pl", "onet.pl", "firma.pl"]
+# Birthdates around the edges of the year, besides random ones.
+EDGE_BIRTHDATES = ["2000-02-29", "1999-02-28", "1990-03-01", "1985-12-31", "1970-01-01"]
+
+
+def make_record(rng):
+    """Returns a random record; about half the fields are left empty."""
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    birthdate = None
+    if rng.random() < 0.7:
+        if rng.random() < 0.3:
+            birthdate = rng.choice(EDGE_BIRTHDATES)
+        else:
+            birthdate = f"{rng.randint(1950, 2010)}-{rng.randint(1, 12):02d}-"
+            birthdate += f"{rng.randint(1, 28):02d}"
+    record = Record(Name(name), BirthDate(birthdate) if birthdate else None)
+    for _ in range(rng.choice([0, 1, 1, 2])):
+        # Few distinct numbers, so some are shared and many digits repeat.
+        number = f"{rng.choice([5, 6, 7])}{rng.randint(0, 99_999_999):08d}"
+        record.add_phone_number(PhoneNumber(number))
+    for _ in range(rng.choice([0, 1, 2])):
+        local_part = name.split()[0].lower() + str(rng.randint(1, 20))
+        record.add_email_address(
+            EmailAddress(f"{local_part}@{rng.choice(DOMAINS)}".replace("ł", "l"))
+        )
+    if rng.random() < 0.5:
+        record.add_address(
+            Address("Długa 1", rng.choice(CITIES), "30-001", "Polska")
+        )
+    return record
+
+
+@pytest.fixture
+def make_records():
+    """Returns a function making the same random records for the same seed."""
+
+    def make(count=300, seed=7):
+        rng = random.Random(seed)
+        return [make_record(rng) for _ in range(count)]
+
+    return make
+
+
+@pytest.fixture
+def search_terms(make_records):
+    """Returns terms of every kind the searches are asked for."""
+    terms = ["kow", "Kowalski", "ANNA", "łukasz", "lukasz", "a", "wp.pl", "@onet"]
+    terms += ["xyz", "", "5", "12", "123", "5123", "999999999", "Jan Nowak"]
+    for record in make_records(40, seed=11):
+        terms.append(record.name.value.split()[1][:4])
+        for phone_number in record.phone_numbers:
+            terms += [phone_number.value, phone_number.value[2:6]]
+    return terms
@@ -0,0 +1,486 @@
+import calendar
+import os
+import shutil
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+from assistant_bot import (
+    AddressBook,
+    BirthDate,
+    BookState,
+    FuzzyNameIndex,
+    IdAllocator,
+    Journal,
+    Name,
+    PhoneDigitIndex,
+    PhoneNumber,
+    Record,
+    fold_text,
+    load_address_book,
+    save_address_book,
+)
+from bench_fuzzy import QUERIES, build_index, search_times
+
+DATA = Path(__file__).parent / "data"
+
+
+def ids(records):
+    return [record.id for record in records]
+
+
+def brute_find_record(book, term):
+    """Returns the IDs of the records with the phrase, checking every record."""
+    digits = term.isascii() and term.isdigit() and len(term) <= 9
+    return [
+        record.id
+        for record in book.data.values()
+        if digits and any(term in phone.value for phone in record.phone_numbers)
+        or term.lower() in record.name.value.lower()
+        or any(term in email.value for email in record.email_addresses)
+    ]
+
+
+def change(book, make_records):
+    """Deletes, edits and adds records, reusing some of the freed IDs."""
+    for record_id in (3, 50, 51, 299):
+        book.remove_record(record_id)
+    record = book.data[10]
+    record.edit_name(Name("Grzegorz Brzęczyszczykiewicz"))
+    record.add_phone_number(PhoneNumber("600123456"))
+    book.update_record(10)
+    record = book.data[11]
+    for phone_number in record.phone_numbers:
+        record.remove_phone_number(phone_number)
+    book.update_record(11)
+    book.add_records(make_records(count=3, seed=99))
+    book.add_records([Record(Name("Łucja Ćwik"))])
+
+
+@pytest.fixture
+def book(make_records):
+    book = AddressBook()
+    book.add_records(make_records())
+    return book
+
+
+@pytest.fixture
+def terms(search_terms):
+    return search_terms + ["Brzęczy", "600123", "3456", "Łucja", "ćwik"]
+
+
+def test_find_record_matches_brute_force(book, terms, make_records):
+    for term in terms:
+        assert ids(book.find_record(term)) == brute_find_record(book, term), term
+    change(book, make_records)
+    for term in terms:
+        assert ids(book.find_record(term)) == brute_find_record(book, term), term
+
+
+def brute_find_phone_numbers(book, digits, where):
+    """Returns sorted (ID, number) pairs with the digits, checking every number."""
+    if not (digits.isascii() and digits.isdigit()) or len(digits) > 9:
+        return []
+    matches = {
+        "prefix": str.startswith,
+        "suffix": str.endswith,
+        "any": str.__contains__,
+    }
+    return sorted(
+        (record.id, phone_number.value)
+        for record in book.data.values()
+        for phone_number in record.phone_numbers
+        if matches[where](phone_number.value, digits)
+    )
+
+
+@pytest.mark.parametrize("where", ["any", "prefix", "suffix"])
+def test_find_phone_numbers_matches_brute_force(book, terms, make_records, where):
+    def check():
+        for term in terms:
+            found = sorted(
+                (record.id, number)
+                for record, number in book.find_phone_numbers(term, where)
+            )
+            assert found == brute_find_phone_numbers(book, term, where), term
+
+    # The numbers of the few changes stay pending until a rebuild sorts them in.
+    check()
+    book.phone_index.rebuild()
+    check()
+    change(book, make_records)
+    check()
+    book.phone_index.rebuild()
+    check()
+
+
+def test_phone_searches_only_read_the_index(book, terms, monkeypatch):
+    for record_id in range(1, 200, 2):
+        record = book.data[record_id]
+        record.add_phone_number(PhoneNumber(f"{record_id:09d}"))
+        book.update_record(record_id)
+        assert len(book.phone_index.pending) <= PhoneDigitIndex.PENDING_LIMIT
+
+    def sort_in(self):
+        raise AssertionError("searches should not sort the index")
+
+    monkeypatch.setattr(PhoneDigitIndex, "settle", sort_in)
+    monkeypatch.setattr(PhoneDigitIndex, "rebuild", sort_in)
+    for term in terms:
+        found = sorted(
+            (record.id, number) for record, number in book.find_phone_numbers(term)
+        )
+        assert found == brute_find_phone_numbers(book, term, "any"), term
+
+
+def brute_similar_scores(book, term):
+    """Returns the score of every record close to the phrase, comparing each word."""
+    index = book.fuzzy_index
+    query_words = index.tokens(term)
+    scores = {}
+    for record in book.data.values():
+        total = 0
+        for query_word in query_words:
+            grams = index.grams(query_word)
+            best = 0
+            for word in index.tokens(record.name.value):
+                shared = len(grams & index.grams(word))
+                similarity = shared / (len(grams) + len(index.grams(word)) - shared)
+                if similarity >= index.min_similarity:
+                    best = max(best, similarity)
+            total += best
+        if total:
+            scores[record.id] = total / len(query_words)
+    return scores
+
+
+def test_similar_records_match_brute_force(book, make_records):
+    terms = ["Jan Kowalski", "lukasz wisniewska", "Kowalsky", "anna nowak zofia"]
+    terms += ["Zofia Żółkiewski", "Brzeczyszczykiewicz grzegorz", "xyz", ""]
+
+    def check():
+        for term in terms:
+            for limit in (1, 5, 20):
+                found = book.find_similar_records(term, limit)
+                scores = brute_similar_scores(book, term)
+                best = sorted(scores.values(), reverse=True)[:limit]
+                assert [round(score, 9) for _, score in found] == [
+                    round(score, 9) for score in best
+                ], (term, limit)
+                for record, score in found:
+                    assert score == pytest.approx(scores[record.id]), term
+
+    check()
+    change(book, make_records)
+    check()
+
+
+def test_similar_records_find_rare_names_among_common_ones():
+    index = FuzzyNameIndex()
+    for key in range(3 * FuzzyNameIndex.MAX_CANDIDATES):
+        index.add(key, ["Jan Kowalski", "Anna Kowalska", "Jan Nowak"][key % 3])
+    index.add("rzadki", "Tomasz Kowalski")
+    # Far more keys share the words than are scored, yet the only full match wins.
+    assert index.search("tomasz kowalski", 1) == [("rzadki", 1.0)]
+    found = index.search("Jan Kowalski", 3)
+    assert [score for _, score in found] == [1.0, 1.0, 1.0]
+    assert all(key % 3 == 0 for key, _ in found)
+
+
+def test_similar_records_stay_fast_with_common_words():
+    index = build_index(200000)
+    for query in QUERIES:
+        assert min(search_times(index, query, repeat=3)) < 0.05, query
+
+
+def test_cursors_page_through_the_book_in_id_order(book):
+    book.remove_record(3)
+    book.add_records([Record(Name("Łucja Ćwik"))])  # reuses ID 3, last in the book
+    pages = list(book.cursor(page_size=7))
+    assert [len(page) for page in pages] == [7] * 42 + [6]
+    assert ids(record for page in pages for record in page) == sorted(book.data)
+    assert ids(book.cursor(page_size=3, after_key=2).next_page()) == [3, 4, 5]
+
+
+def test_cursor_resumes_after_a_deleted_record(book):
+    cursor = book.cursor(page_size=5)
+    assert ids(cursor.next_page()) == [1, 2, 3, 4, 5]
+    book.remove_record(5)
+    book.remove_record(6)
+    assert ids(cursor.next_page()) == [7, 8, 9, 10, 11]
+    # A new cursor after a deleted ID starts at the next ID in the book.
+    assert ids(book.cursor(page_size=2, after_key=5).next_page()) == [7, 8]
+    book.remove_record(11)
+    book.add_records([Record(Name("Łucja Ćwik"))])  # takes ID 5 again
+    assert ids(cursor.next_page()) == [12, 13, 14, 15, 16]
+    assert ids(book.cursor(page_size=2, after_key=4).next_page()) == [5, 7]
+
+
+def test_cursor_shows_records_added_between_pages(book):
+    book.remove_record(20)
+    cursor = book.cursor(page_size=7)
+    assert ids(cursor.next_page()) == [1, 2, 3, 4, 5, 6, 7]
+    # The book keeps its size, but ID 20 is back and ID 30 gone.
+    book.remove_record(30)
+    book.add_records([Record(Name("Łucja Ćwik"))])
+    rest = ids(record for page in cursor for record in page)
+    assert rest == sorted(book.data)[7:]
+    assert 20 in rest and 30 not in rest
+
+
+def brute_upcoming_birthdays(book, days, today):
+    """Returns (ID, birthday, days to it) for every day of the window in turn.
+
+    Feb 29 birthdays fall on Feb 28 in common years; a record is listed once,
+    on its first birthday in the window.
+    """
+    found = []
+    listed = set()
+    for offset in range(min(days, 365) + 1):
+        day = today + timedelta(days=offset)
+        for record in book.data.values():
+            if record.birthdate is None or record.id in listed:
+                continue
+            born = record.birthdate.date
+            if (born.month, born.day) == (2, 29) and not calendar.isleap(day.year):
+                birthday = date(day.year, 2, 28)
+            else:
+                birthday = date(day.year, born.month, born.day)
+            if birthday == day:
+                found.append((record.id, day, offset))
+                listed.add(record.id)
+    return found
+
+
+@pytest.mark.parametrize(
+    "today",
+    [
+        date(2026, 2, 27),  # Feb 29 birthdays on Feb 28 of a common year
+        date(2028, 2, 27),  # and on Feb 29 of a leap year
+        date(2026, 12, 29),  # across the end of the year
+        date(2027, 12, 20),  # into a leap year
+        date(2027, 3, 1),  # a whole year, back to the same day
+    ],
+)
+def test_upcoming_birthdays_match_brute_force(book, make_records, today):
+    for days in (0, 1, 3, 30, 365, 400):
+        found = [
+            (entry.record.id, entry.birthday, entry.days)
+            for entry in book.upcoming_birthdays(days, today)
+        ]
+        assert found == brute_upcoming_birthdays(book, days, today), days
+    change(book, make_records)
+    found = [
+        (entry.record.id, entry.birthday, entry.days)
+        for entry in book.upcoming_birthdays(30, today)
+    ]
+    assert found == brute_upcoming_birthdays(book, 30, today)
+
+
+@pytest.fixture
+def birthday_book():
+    book = AddressBook()
+    book.add_records(
+        [
+            Record(Name(name), BirthDate(birthdate))
+            for name, birthdate in [
+                ("Sylwia Grudniowa", "1990-12-31"),
+                ("Nowy Styczeń", "1985-01-01"),
+                ("Przemysław Przestępny", "2000-02-29"),
+                ("Luty Ostatni", "1970-02-28"),
+                ("Marta Marcowa", "1999-03-01"),
+            ]
+        ]
+    )
+    return book
+
+
+def birthdays(book, today, days):
+    return [
+        (entry.record.name.value.split()[0], entry.birthday, entry.days)
+        for entry in book.upcoming_birthdays(days, today)
+    ]
+
+
+def test_birthdays_run_into_the_next_year(birthday_book):
+    assert birthdays(birthday_book, date(2026, 12, 30), 3) == [
+        ("Sylwia", date(2026, 12, 31), 1),
+        ("Nowy", date(2027, 1, 1), 2),
+    ]
+    assert birthdays(birthday_book, date(2027, 1, 1), 3) == [
+        ("Nowy", date(2027, 1, 1), 0),
+    ]
+
+
+def test_feb_29_birthdays_fall_on_feb_28_in_common_years(birthday_book):
+    assert birthdays(birthday_book, date(2026, 2, 27), 2) == [
+        ("Przemysław", date(2026, 2, 28), 1),
+        ("Luty", date(2026, 2, 28), 1),
+        ("Marta", date(2026, 3, 1), 2),
+    ]
+    assert birthdays(birthday_book, date(2028, 2, 28), 1) == [
+        ("Luty", date(2028, 2, 28), 0),
+        ("Przemysław", date(2028, 2, 29), 1),
+    ]
+    record = birthday_book.data[3]
+    assert record.days_to_birthdate(date(2026, 3, 1)) == 364
+    assert record.days_to_birthdate(date(2027, 3, 1)) == 365
+
+
+def test_birthday_windows_into_a_leap_year_and_over_a_whole_year(birthday_book):
+    assert birthdays(birthday_book, date(2027, 12, 31), 60) == [
+        ("Sylwia", date(2027, 12, 31), 0),
+        ("Nowy", date(2028, 1, 1), 1),
+        ("Luty", date(2028, 2, 28), 59),
+        ("Przemysław", date(2028, 2, 29), 60),
+    ]
+    # A year later is the same day again, which is not listed twice.
+    assert birthdays(birthday_book, date(2026, 3, 1), 365) == [
+        ("Marta", date(2026, 3, 1), 0),
+        ("Sylwia", date(2026, 12, 31), 305),
+        ("Nowy", date(2027, 1, 1), 306),
+        ("Przemysław", date(2027, 2, 28), 364),
+        ("Luty", date(2027, 2, 28), 364),
+    ]
+    assert birthdays(birthday_book, date(2026, 3, 1), 1000) == birthdays(
+        birthday_book, date(2026, 3, 1), 365
+    )
+
+
+def brute_complete(book, prefix, limit=5):
+    """Returns the folded words of names with the prefix, most common first."""
+    counts = {}
+    for record in book.data.values():
+        for word in {fold_text(word) for word in record.name.value.split()}:
+            counts[word] = counts.get(word, 0) + 1
+    folded = fold_text(prefix)
+    words = sorted(
+        (-count, word) for word, count in counts.items() if word.startswith(folded)
+    )
+    return [word for _, word in words[:limit]]
+
+
+def test_complete_name_matches_brute_force(book, make_records):
+    prefixes = ["", "a", "ł", "l", "luk", "ŁUK", "kow", "ż", "zo", "ma", "x", "Ł"]
+    prefixes += ["Brz", "grz", "ćw", "Nowakowski"]
+
+    def check():
+        for prefix in prefixes:
+            for limit in (1, 5):
+                found = [fold_text(word) for word in book.complete_name(prefix, limit)]
+                assert found == brute_complete(book, prefix, limit), prefix
+
+    check()
+    change(book, make_records)
+    check()
+    for record_id in list(book.data)[:150]:
+        book.remove_record(record_id)
+    check()
+
+
+def contents(book):
+    """Returns what a book holds, comparable between books."""
+    return (
+        [(record_id, str(record)) for record_id, record in book.data.items()],
+        book.ids.high_water,
+        book.ids.free,
+    )
+
+
+def test_id_allocator_hands_out_the_smallest_free_id():
+    allocator = IdAllocator()
+    assert [allocator.allocate() for _ in range(4)] == [1, 2, 3, 4]
+    allocator.release(3)
+    allocator.release(1)
+    allocator.release(3)
+    assert [allocator.allocate() for _ in range(3)] == [1, 3, 5]
+    # IDs above the high-water mark were never handed out.
+    allocator.release(9)
+    assert allocator.high_water == 5
+    assert allocator.allocate() == 6
+
+
+def test_id_allocator_reserves_ids_taken_elsewhere():
+    allocator = IdAllocator.from_ids({2, 5})
+    assert allocator.high_water == 5
+    assert allocator.free == {1, 3, 4}
+    allocator.reserve(3)
+    allocator.reserve(8)
+    assert allocator.free == {1, 4, 6, 7}
+    # The reserved 3 is still on the heap and is skipped.
+    assert [allocator.allocate() for _ in range(5)] == [1, 4, 6, 7, 9]
+    assert IdAllocator.from_ids(set()).allocate() == 1
+
+
+def test_replayed_journal_frees_and_reserves_ids():
+    state = BookState({1: "a", 2: "b", 4: "d"})
+    assert state.ids.free == {3}
+    for entry in [("delete", 2), ("delete", 2), ("add", 6, "f"), ("add", 3, "c")]:
+        state.apply(entry)
+    assert sorted(state.records) == [1, 3, 4, 6]
+    assert [state.ids.allocate() for _ in range(3)] == [2, 5, 7]
+
+
+def test_load_baseline_book(tmp_path):
+    filename = str(tmp_path / "address_book.pkl")
+    shutil.copy(DATA / "baseline_address_book.pkl", filename)
+    book = load_address_book(filename)
+    assert [(record.id, record.name.value) for record in book.data.values()] == [
+        (1, "Jan Kowalski"),
+        (3, "Łukasz Wiśniewski"),
+        (4, "Zofia Żółkiewska"),
+        (5, "Piotr Lewandowski"),
+    ]
+    assert ids(book.find_record("501234")) == [4]
+    assert ids(book.find_record("firma.pl")) == [3]
+    book.add_records([Record(Name("Anna Nowak"))])
+    assert book.data[2].name.value == "Anna Nowak"
+    save_address_book(book, filename)
+    book.close()
+
+    reloaded = load_address_book(filename)
+    assert contents(reloaded) == contents(book)
+    reloaded.close()
+
+
+def test_journal_replay_and_compaction(tmp_path, make_records, monkeypatch):
+    filename = str(tmp_path / "address_book.pkl")
+    book = load_address_book(filename)
+    book.add_records(make_records())
+    save_address_book(book, filename)
+    change(book, make_records)
+    save_address_book(book, filename)
+    assert os.path.getsize(filename + ".journal") > 0
+
+    replayed = load_address_book(filename)
+    assert contents(replayed) == contents(book)
+    replayed.close()
+
+    monkeypatch.setattr(Journal, "should_compact", lambda journal: True)
+    book.remove_record(7)
+    save_address_book(book, filename)
+    book.close()
+    assert not os.path.exists(filename + ".journal.sealed")
+    assert os.path.getsize(filename + ".journal") == 0
+    compacted = load_address_book(filename)
+    assert contents(compacted) == contents(book)
+    compacted.close()
+
+
+def test_load_finishes_interrupted_compaction(tmp_path, make_records):
+    filename = str(tmp_path / "address_book.pkl")
+    book = load_address_book(filename)
+    book.add_records(make_records(count=20))
+    save_address_book(book, filename)
+    book.remove_record(5)
+    book.close()
+    # Sealed, but the process stopped before the new snapshot was written.
+    os.replace(filename + ".journal", filename + ".journal.sealed")
+    reloaded = load_address_book(filename)
+    reloaded.close()
+    assert contents(reloaded) == contents(book)
+    assert not os.path.exists(filename + ".journal.sealed")
+    compacted = load_address_book(filename)
+    assert contents(compacted) == contents(book)
+    compacted.close()
@@ -0,0 +1,215 @@
+import contextlib
+import io
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import assistant_bot
+from assistant_bot import (
+    AddressBook,
+    AssistantBot,
+    LazyLoad,
+    Name,
+    Record,
+    UserInterface,
+    print_lines,
+)
+
+BOT_PATH = Path(__file__).resolve().parent.parent / "assistant_bot.py"
+
+
+class ScriptedInterface(UserInterface):
+    """Answers prompts from a list and records what was shown, in order."""
+
+    def __init__(self, answers, shown):
+        self.answers = list(answers)
+        self.shown = shown
+
+    def display_contacts(self, contacts):
+        self.shown.append(("contacts", list(contacts)))
+
+    def display_notes(self, notes):
+        self.shown.append(("notes", list(notes)))
+
+    def display_message(self, message):
+        self.shown.append(("message", message))
+
+    def get_input(self, prompt):
+        self.shown.append(("input", prompt))
+        return self.answers.pop(0)
+
+
+class ClosedBook(AddressBook):
+    closed = False
+
+    def close(self):
+        super().close()
+        self.closed = True
+
+
+def test_startup_profile_follows_first_menu(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shown = []
+    bot = AssistantBot(ScriptedInterface(["3"], shown), startup_profile=True)
+    real_print = print
+
+    def recording_print(*args, **kwargs):
+        shown.append(("print", " ".join(map(str, args))))
+        real_print(*args, **kwargs)
+
+    monkeypatch.setattr("builtins.print", recording_print)
+    bot.main()
+    kinds = [kind for kind, _ in shown]
+    assert kinds[:3] == ["message", "print", "print"]
+    assert "Wyjście (3)" in shown[0][1]
+    assert shown[1][1] == "Profil startu:"
+    first_input = kinds.index("input")
+    assert any("pierwsze menu" in text for _, text in shown[:first_input])
+    assert any("nie wczytano" in text for _, text in shown[:first_input])
+    assert bot.first_menu_seconds > 0
+
+
+def test_exit_closes_the_book(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book = ClosedBook()
+    bot = AssistantBot(ScriptedInterface(["3"], []))
+    bot.book_loader = LazyLoad(lambda: book)
+    bot.book_loader.start()
+    bot.main()
+    assert book.closed
+
+
+def test_background_load_prints_only_when_the_value_is_asked_for(capsys):
+    def loader():
+        print("Plik nie istnieje, tworzenie nowej książki adresowej.")
+        return "book"
+
+    loader_thread = LazyLoad(loader)
+    loader_thread.start()
+    loader_thread.thread.join()
+    assert loader_thread.loaded
+    assert capsys.readouterr().out == ""
+    assert loader_thread.get() == "book"
+    assert capsys.readouterr().out == (
+        "Plik nie istnieje, tworzenie nowej książki adresowej.\n"
+    )
+    assert loader_thread.get() == "book"
+    assert capsys.readouterr().out == ""
+
+
+def test_background_load_error_is_reported_and_the_load_retried(capsys):
+    calls = []
+
+    def loader():
+        calls.append(threading.get_ident())
+        if len(calls) == 1:
+            raise OSError("dysk niedostępny")
+        return "book"
+
+    loader_thread = LazyLoad(loader)
+    loader_thread.start()
+    loader_thread.thread.join()
+    assert not loader_thread.loaded
+    assert capsys.readouterr().out == ""
+    assert loader_thread.get() == "book"
+    assert "dysk niedostępny" in capsys.readouterr().out
+    assert calls[1] == threading.get_ident()
+
+
+def test_load_without_start_runs_once():
+    calls = []
+    loader = LazyLoad(lambda: calls.append(1) or len(calls))
+    assert not loader.started()
+    assert loader.get() == 1
+    assert loader.get() == 1
+    assert loader.started() and loader.seconds is not None
+
+
+def test_completion_does_not_wait_for_the_book(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    book = AddressBook()
+    with contextlib.redirect_stdout(io.StringIO()):
+        book.add_record(Record(Name("Jan Kowalski")))
+    release = threading.Event()
+    bot = AssistantBot(ScriptedInterface([], []))
+    bot.book_loader = LazyLoad(lambda: release.wait() and book)
+    assert bot.complete_name("Jan") == []
+    assert bot.book_loader.started() and not bot.book_loader.loaded
+    assert bot.complete_name("Jan") == []
+    release.set()
+    bot.book_loader.thread.join()
+    assert bot.complete_name("Kow") == ["Kowalski"]
+
+
+def run_bot(cwd, *flags):
+    return subprocess.run(
+        [sys.executable, str(BOT_PATH), *flags],
+        input="3\n",
+        capture_output=True,
+        text=True,
+        cwd=cwd,
+        timeout=60,
+        check=True,
+    ).stdout
+
+
+def test_startup_profile_flag(tmp_path):
+    output = run_bot(tmp_path, "--startup-profile")
+    profile = output[output.index("Profil startu:") :]
+    assert "importy" in profile
+    assert "pierwsze menu" in profile
+    assert "nie wczytano" in profile
+    assert output.count("Profil startu:") == 2
+
+
+def test_startup_profile_flag_with_preload(tmp_path):
+    output = run_bot(tmp_path, "--startup-profile", "--preload")
+    assert "w tle" in output[output.index("Profil startu:") :]
+    assert "nie wczytano" not in output
+
+
+class RecordingOutput:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+
+
+def test_print_lines_writes_a_chunk_at_a_time(monkeypatch):
+    output = RecordingOutput()
+    monkeypatch.setattr(sys, "stdout", output)
+    monkeypatch.setattr(assistant_bot, "OUTPUT_CHUNK", 3)
+    taken = []
+
+    def lines():
+        for number in range(7):
+            taken.append(number)
+            yield f"linia {number}"
+
+    print_lines(lines())
+    assert output.writes == [
+        "linia 0\nlinia 1\nlinia 2\n",
+        "linia 3\nlinia 4\nlinia 5\n",
+        "linia 6\n",
+    ]
+    assert taken == list(range(7))
+    print_lines([])
+    assert len(output.writes) == 3
+
+
+def test_print_lines_takes_one_chunk_before_writing(monkeypatch):
+    output = RecordingOutput()
+    monkeypatch.setattr(sys, "stdout", output)
+    monkeypatch.setattr(assistant_bot, "OUTPUT_CHUNK", 2)
+    taken_at_write = []
+
+    def lines():
+        for number in range(5):
+            taken_at_write.append(len(output.writes))
+            yield str(number)
+
+    print_lines(lines())
+    # Lines 0-1 are taken before the first write, 2-3 before the second.
+    assert taken_at_write == [0, 0, 1, 1, 2]
@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+
+import pytest
+
+import book_server
+from assistant_bot import Journal, load_address_book
+from book_server import BookClient, BookServer
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / "book.pkl")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_requests_change_and_search_the_book(filename):
+    async def session():
+        server = BookServer(load_address_book(filename), filename, save_interval=0.01)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        saver = asyncio.create_task(server.save_periodically())
+        port = listener.sockets[0].getsockname()[1]
+        client = await BookClient.connect("127.0.0.1", port)
+        try:
+            first = await client.call("add", name="Jan Kowalski", phones=["123456789"])
+            second = await client.call("add", name="Anna Nowak")
+            await client.call("edit", id=second, phones=["987654321"])
+            found = await client.call("find", term="987654")
+            with pytest.raises(ValueError):
+                await client.call("add", name="Zły Numer", phones=["12"])
+            await client.call("delete", id=first)
+            with pytest.raises(ValueError):
+                await client.call("delete", id=first)
+            await asyncio.sleep(0.05)
+        finally:
+            await client.close()
+            saver.cancel()
+            listener.close()
+            await listener.wait_closed()
+        server.book.close()
+        return found
+
+    found = run(session())
+    assert [(record["name"], record["phones"]) for record in found] == [
+        ("Anna Nowak", ["987654321"])
+    ]
+    book = load_address_book(filename)
+    assert [record.name.value for record in book.data.values()] == ["Anna Nowak"]
+    book.close()
+
+
+class Saved(Exception):
+    pass
+
+
+def test_compaction_keeps_changes_out(filename, monkeypatch):
+    book = load_address_book(filename)
+    server = BookServer(book, filename, save_interval=0)
+    server.changed = True
+    locks = []
+    saves = []
+
+    def locked(kind, lock):
+        @contextlib.asynccontextmanager
+        async def hold():
+            async with lock():
+                locks.append(kind)
+                yield
+
+        return hold
+
+    monkeypatch.setattr(server.lock, "reading", locked("read", server.lock.reading))
+    monkeypatch.setattr(server.lock, "writing", locked("write", server.lock.writing))
+    monkeypatch.setattr(Journal, "should_compact", lambda journal: True)
+
+    def save(book, filename):
+        saves.append(locks[-1])
+        raise Saved
+
+    monkeypatch.setattr(book_server, "save_address_book", save)
+    book.journal = Journal(filename, None)
+    with pytest.raises(Saved):
+        run(server.save_periodically())
+    assert locks == ["read", "write"]
+    assert saves == ["write"]
+    book.close()
+
+
+def test_unexpected_errors_are_answered(filename):
+    book = load_address_book(filename)
+    server = BookServer(book, filename)
+
+    def broken(request):
+        raise RuntimeError("awaria")
+
+    server.operations["find"] = (broken, False)
+    server.operations["add"] = (broken, True)
+
+    async def session():
+        return [
+            await server.respond('{"op": "find", "term": "kow"}'),
+            await server.respond('{"op": "add", "name": "Jan"}'),
+            # The locks were let go, so other requests still run.
+            await server.respond('{"op": "birthdays", "days": 7}'),
+        ]
+
+    assert run(session()) == [
+        {"ok": False, "error": "Błąd serwera: RuntimeError('awaria')"},
+        {"ok": False, "error": "Błąd serwera: RuntimeError('awaria')"},
+        {"ok": True, "result": []},
+    ]
+    book.close()
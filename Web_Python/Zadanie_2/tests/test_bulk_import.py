@@ -0,0 +1,76 @@
+import pytest
+
+from assistant_bot import AddressBook
+from bulk_import import import_contacts, read_checkpoint
+
+CSV_SOURCE = (
+    "﻿name,phone,email,birthdate,street,city,postal_code,country\r\n"
+    "Jan Kowalski,123456789,jan@example.com,1990-01-02,Długa 1,Kraków,30-001,PL\r\n"
+    "Bez Telefonu,12,,,,,,\r\n"
+    '"Anna ""Ania"" Nowak",987654321;111222333,,2000-02-29,"Ulica\r\n'
+    'w dwóch liniach",Gdańsk,80-001,PL\r\n'
+    "\r\n"
+    "Łukasz Wiśniewski,,lukasz@example.com,,,,,\r\n"
+    ",500600700,,,,,,\r\n"
+    "Zofia Żółkiewska,500600700,,1985-12-31,,,,\r\n"
+)
+
+VCARD_SOURCE = (
+    "BEGIN:VCARD\r\nVERSION:3.0\r\nFN:Jan Kowalski\r\nTEL:+48 123 456 789\r\n"
+    "END:VCARD\r\n"
+    "BEGIN:VCARD\r\nFN:Anna\r\n  Nowak\r\nBDAY:20000229\r\nEND:VCARD\r\n"
+    "BEGIN:VCARD\r\nFN:Zły Telefon\r\nTEL:12\r\nEND:VCARD\r\n"
+    "BEGIN:VCARD\r\nN:Wiśniewski;Łukasz\r\nEMAIL:lukasz@example.com\r\n"
+    "ADR:;;Długa 1;Kraków;;30-001;PL\r\nEND:VCARD\r\n"
+    "BEGIN:VCARD\r\nFN:Zofia Żółkiewska\r\nEND:VCARD\r\n"
+)
+
+
+def contents(book):
+    return [str(record) for record in book.data.values()]
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.mark.parametrize(
+    "name, text", [("kontakty.csv", CSV_SOURCE), ("kontakty.vcf", VCARD_SOURCE)]
+)
+def test_resume_seeks_past_committed_rows(tmp_path, monkeypatch, name, text):
+    monkeypatch.chdir(tmp_path)  # the book is saved to the current directory
+    source = tmp_path / name
+    source.write_bytes(text.encode("utf-8"))
+    expected = AddressBook()
+    expected_counts = import_contacts(expected, str(source), chunk_size=2)
+    (tmp_path / (name + ".offset")).unlink()
+
+    book = AddressBook()
+    add_records = book.add_records
+    chunks = []
+
+    def add_two_chunks(records):
+        if len(chunks) == 2:
+            raise Interrupted
+        chunks.append(records)
+        add_records(records)
+
+    monkeypatch.setattr(book, "add_records", add_two_chunks)
+    with pytest.raises(Interrupted):
+        import_contacts(book, str(source), chunk_size=2)
+    assert read_checkpoint(str(source) + ".offset")[0] == 4
+    monkeypatch.setattr(book, "add_records", add_records)
+
+    # Blank out the committed rows: a resumed import must not read them again.
+    data = source.read_bytes()
+    header_end = data.index(b"\n") + 1 if name.endswith(".csv") else 0
+    offset = read_checkpoint(str(source) + ".offset")[1]
+    blanked = bytes(
+        byte if byte in b"\r\n" else ord("x") for byte in data[header_end:offset]
+    )
+    source.write_bytes(data[:header_end] + blanked + data[offset:])
+    resumed = import_contacts(book, str(source), chunk_size=2, resume=True)
+    assert contents(book) == contents(expected)
+    assert resumed[0] + resumed[1] == sum(expected_counts) - 4
+    assert read_checkpoint(str(source) + ".offset")[1] == len(text.encode("utf-8"))
+
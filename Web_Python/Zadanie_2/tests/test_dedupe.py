@@ -0,0 +1,97 @@
+from itertools import combinations
+
+import pytest
+
+import dedupe
+from assistant_bot import (
+    Address,
+    AddressBook,
+    BirthDate,
+    EmailAddress,
+    Name,
+    PhoneNumber,
+    Record,
+)
+from dedupe import MergeCandidate, find_duplicates, merge_duplicates
+
+
+def pairs(candidates):
+    return [
+        (candidate.first_id, candidate.second_id, round(candidate.confidence, 9))
+        for candidate in candidates
+    ]
+
+
+def every_pair(book, threshold):
+    """Scores every pair of records and returns those above the threshold."""
+    contacts = [dedupe.contact_of(*item) for item in book.data.items()]
+    found = []
+    for first, second in combinations(contacts, 2):
+        confidence, _ = dedupe.score(
+            first,
+            second,
+            dedupe.name_grams(first[1]),
+            dedupe.name_grams(second[1]),
+        )
+        if confidence >= threshold:
+            found.append((first[0], second[0], round(confidence, 9)))
+    return sorted(found, key=lambda pair: (-pair[2], pair[0], pair[1]))
+
+
+@pytest.fixture
+def book(make_records):
+    book = AddressBook()
+    book.add_records(make_records(count=120, seed=3))
+    return book
+
+
+def test_window_over_the_whole_book_finds_every_pair(book):
+    # With the window as long as the book, the neighbourhood is every pair.
+    found = find_duplicates(book, threshold=0.4, window=len(book.data), workers=1)
+    assert pairs(found) == every_pair(book, 0.4)
+
+
+def test_workers_find_the_same_pairs(book, monkeypatch):
+    expected = pairs(find_duplicates(book, threshold=0.3, workers=1))
+    assert expected
+    # Small tasks, so the book is split between processes and blocks batched.
+    monkeypatch.setattr(dedupe, "TASK_SIZE", 10)
+    tasks = list(
+        dedupe.comparison_tasks(
+            [dedupe.contact_of(*item) for item in book.data.items()], 8, 0.3
+        )
+    )
+    assert any(len(parts) > 1 for parts, _ in tasks)
+    assert pairs(find_duplicates(book, threshold=0.3, workers=2)) == expected
+
+
+def test_merge_duplicates_joins_linked_records():
+    book = AddressBook()
+    first = Record(Name("Jan Kowalski"))
+    first.add_phone_number(PhoneNumber("600100200"))
+    second = Record(Name("Kowalski Jan"), BirthDate("1990-05-01"))
+    second.add_phone_number(PhoneNumber("600100200"))
+    second.add_email_address(EmailAddress("jan@example.com"))
+    third = Record(Name("Jan Kowalsky"))
+    third.add_email_address(EmailAddress("JAN@example.com"))
+    third.add_phone_number(PhoneNumber("700100200"))
+    third.add_address(Address("Długa 1", "Kraków", "30-001", "Polska"))
+    fourth = Record(Name("Anna Nowak"))
+    fifth = Record(Name("Anna Nowakowa"))
+    book.add_records([first, second, third, fourth, fifth])
+
+    candidates = [
+        MergeCandidate(2, 3, 0.95, ()),
+        MergeCandidate(1, 3, 0.91, ()),
+        MergeCandidate(4, 5, 0.6, ()),
+    ]
+    assert merge_duplicates(book, candidates, threshold=0.9) == [(1, [2, 3])]
+    assert list(book.data) == [1, 4, 5]
+    kept = book.data[1]
+    assert kept.name.value == "Jan Kowalski"
+    assert [phone.value for phone in kept.phone_numbers] == ["600100200", "700100200"]
+    assert [email.value for email in kept.email_addresses] == ["jan@example.com"]
+    assert kept.birthdate.value == "1990-05-01"
+    assert kept.address.city == "Kraków"
+    assert [record.id for record in book.find_record("700100")] == [1]
+    assert book.find_record("Kowalsky") == []
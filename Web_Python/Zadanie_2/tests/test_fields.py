@@ -0,0 +1,96 @@
+import pickle
+from datetime import date
+
+import pytest
+
+import validation
+from assistant_bot import (
+    Address,
+    BirthDate,
+    EmailAddress,
+    Name,
+    PhoneNumber,
+    Record,
+)
+
+NOT_PHONE_NUMBERS = [
+    "12345678\n",
+    "123456789\n",
+    " 123456789",
+    "123456789 ",
+    "12345678 ",
+    "+12345678",
+    "1234_5678",
+    "١٢٣٤٥٦٧٨٩",  # Arabic-Indic digits
+    "１２３４５６７８９",  # fullwidth digits
+    "12345678",
+    "1234567890",
+    "12345678a",
+    "",
+]
+
+
+def test_phone_number_keeps_its_digits():
+    phone_number = PhoneNumber("012345678")
+    assert phone_number.value == "012345678"
+    assert pickle.loads(pickle.dumps(phone_number)).value == "012345678"
+
+
+@pytest.mark.parametrize("value", NOT_PHONE_NUMBERS)
+def test_phone_number_takes_only_nine_ascii_digits(value):
+    assert not validation.is_valid_phone(value)
+    with pytest.raises(ValueError):
+        PhoneNumber(value)
+    phone_number = PhoneNumber("600100200")
+    with pytest.raises(ValueError):
+        phone_number.value = value
+    assert phone_number.value == "600100200"
+
+
+def test_phone_mask_matches_single_checks():
+    values = ["600100200", "000000000"] + NOT_PHONE_NUMBERS
+    assert validation.phone_mask(values) == [True, True] + [False] * len(
+        NOT_PHONE_NUMBERS
+    )
+
+
+def test_record_text_is_rendered_once_a_day():
+    record = Record(Name("Jan Kowalski"), BirthDate("1990-03-05"))
+    record.id = 4
+    today = date(2026, 3, 1)
+    text = record.to_string(today)
+    assert text == (
+        "ID: 4, Imię i nazwisko: Jan Kowalski, Numery telefonów: , "
+        "Adresy email: , Urodziny: 1990-03-05, Dni do urodzin: 4"
+    )
+    assert record.to_string(today) is text
+    assert record.to_string(date(2026, 3, 2)).endswith("Dni do urodzin: 3")
+    record.id = 5
+    assert record.to_string(date(2026, 3, 2)).startswith("ID: 5,")
+
+
+@pytest.mark.parametrize(
+    "method, value, shown",
+    [
+        ("add_phone_number", PhoneNumber("600100200"), "600100200"),
+        ("add_email_address", EmailAddress("jan@wp.pl"), "jan@wp.pl"),
+        ("edit_name", Name("Anna Nowak"), "Anna Nowak"),
+        ("edit_birthdate", BirthDate("1990-03-02"), "Dni do urodzin: 1"),
+        ("add_address", Address("Długa 1", "Kraków", "30-001", "Polska"), "Długa 1"),
+    ],
+)
+def test_record_text_is_rendered_again_after_a_change(method, value, shown):
+    record = Record(Name("Jan Kowalski"), BirthDate("1990-03-05"))
+    today = date(2026, 3, 1)
+    before = record.to_string(today)
+    getattr(record, method)(value)
+    assert shown not in before
+    assert shown in record.to_string(today)
+
+
+def test_pickled_record_leaves_its_text_behind():
+    record = Record(Name("Jan Kowalski"))
+    record.to_string(date(2026, 3, 1))
+    copy = pickle.loads(pickle.dumps(record))
+    assert copy.rendered is None
+    assert copy.to_string(date(2026, 3, 1)) == record.to_string(date(2026, 3, 1))
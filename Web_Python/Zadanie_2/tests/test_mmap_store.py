@@ -0,0 +1,98 @@
+import pickle
+from datetime import date
+
+import pytest
+
+from assistant_bot import AddressBook, Name, PhoneNumber, save_address_book
+from mmap_store import MappedAddressBook, convert_address_book
+
+
+def ids(records):
+    return [record.id for record in records]
+
+
+def contents(book):
+    """Returns the records of a book in book order, comparable between books."""
+    return [(record_id, str(record)) for record_id, record in book.data.items()]
+
+
+def change(book):
+    """Deletes records, one of them the last, and edits one."""
+    for record_id in (3, 50, 51, 300):
+        book.remove_record(record_id)
+    record = book.data[10]
+    record.edit_name(Name("Grzegorz Brzęczyszczykiewicz"))
+    record.add_phone_number(PhoneNumber("600123456"))
+    book.update_record(10)
+
+
+@pytest.fixture
+def reference(make_records):
+    reference = AddressBook()
+    reference.add_records(make_records())
+    change(reference)
+    return reference
+
+
+@pytest.fixture
+def filename(tmp_path, make_records):
+    """Returns a mapped book file with the changes of change in its journal."""
+    filename = str(tmp_path / "book.abk")
+    book = MappedAddressBook(filename)
+    book.add_records(make_records())
+    book.rewrite()
+    change(book)
+    save_address_book(book)
+    book.close()
+    return filename
+
+
+@pytest.fixture
+def book(filename):
+    book = MappedAddressBook(filename)
+    yield book
+    book.close()
+
+
+def test_replayed_book_matches_reference(book, reference, search_terms):
+    assert contents(book) == contents(reference)
+    for term in search_terms + ["Brzęczy", "600123"]:
+        assert ids(book.find_record(term)) == ids(reference.find_record(term)), term
+    for today in (date(2026, 2, 27), date(2026, 12, 29)):
+        for days in (1, 30):
+            assert [
+                (entry.record.id, entry.birthday)
+                for entry in book.upcoming_birthdays(days, today)
+            ] == [
+                (entry.record.id, entry.birthday)
+                for entry in reference.upcoming_birthdays(days, today)
+            ]
+
+
+@pytest.mark.parametrize("rewrite", [False, True])
+def test_released_ids_survive_reopening(filename, reference, rewrite):
+    book = MappedAddressBook(filename)
+    if rewrite:
+        book.rewrite()
+    book.close()
+    book = MappedAddressBook(filename)
+    assert contents(book) == contents(reference)
+    assert book.ids.high_water == reference.ids.high_water == 300
+    assert book.ids.free == reference.ids.free == {3, 50, 51, 300}
+    # The highest ID was released; it is handed out only after the lower ones.
+    allocated = [book.ids.allocate() for _ in range(5)]
+    assert allocated == [reference.ids.allocate() for _ in range(5)]
+    assert allocated == [3, 50, 51, 300, 301]
+    book.close()
+
+
+def test_convert_drops_stale_journal(tmp_path, filename, make_records):
+    records = dict(enumerate(make_records(count=20), 1))
+    pickle_filename = str(tmp_path / "book.pkl")
+    with open(pickle_filename, "wb") as file:
+        pickle.dump(records, file)
+    assert convert_address_book(pickle_filename, filename) == 20
+    book = MappedAddressBook(filename)
+    assert [record_id for record_id, _ in contents(book)] == list(range(1, 21))
+    assert book.ids.allocate() == 21
+    book.close()
@@ -0,0 +1,236 @@
+import random
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from assistant_bot import Journal, Note, Notebook, Tag
+
+DATA = Path(__file__).parent / "data"
+
+
+def snapshot(notebook):
+    """Returns what a notebook holds, comparable between notebooks."""
+    return sorted(
+        (note.id, note.content, note.created_at, list(note.tags))
+        for note in notebook.notes.values()
+    )
+
+
+@pytest.fixture
+def baseline_notes(tmp_path):
+    """Returns a copy of a notes file saved by the original version of the bot."""
+    filename = tmp_path / "notes.pkl"
+    shutil.copy(DATA / "baseline_notes.pkl", filename)
+    return str(filename)
+
+
+def test_load_baseline_notes(baseline_notes):
+    notebook = Notebook()
+    notebook.load_notes(baseline_notes)
+    assert [(note.id, note.content) for note in notebook.notes.values()] == [
+        (1, "Zadzwonić do Jana"),
+        (2, "Kupić mleko"),
+        (3, "Urodziny Anny w lutym"),
+    ]
+    assert notebook.notes[1].tags == {"praca": None, "pilne": None}
+    assert notebook.state.next_id == 4
+    tags = Tag(notebook)
+    assert [note.id for note in tags.search_tag("pilne")] == [1, 3]
+    assert [note.id for note, _ in notebook.search_notes("mleko")] == [2]
+    notebook.close()
+
+
+def test_indexes_saved_for_legacy_notes(baseline_notes, monkeypatch):
+    notebook = Notebook()
+    notebook.load_notes(baseline_notes)
+    notebook.edit_note(2, "Kupić mleko i chleb")
+    notebook.save_notes(baseline_notes)
+    notebook.close()
+    assert Path(baseline_notes + ".index").exists()
+
+    def rebuild(self):
+        raise AssertionError("the saved indexes should have been used")
+
+    monkeypatch.setattr(Notebook, "rebuild_indexes", rebuild)
+    reloaded = Notebook()
+    reloaded.load_notes(baseline_notes)
+    assert snapshot(reloaded) == snapshot(notebook)
+    assert [note.id for note, _ in reloaded.search_notes("chleb")] == [2]
+    reloaded.close()
+
+
+def test_journal_replay_and_compaction(tmp_path, monkeypatch):
+    filename = str(tmp_path / "notes.pkl")
+    notebook = Notebook()
+    notebook.load_notes(filename)
+    tags = Tag(notebook)
+    for number in range(30):
+        notebook.add_note(f"Notatka numer {number}")
+        tags.add_tag(number + 1, f"tag{number % 3}")
+    notebook.save_notes(filename)
+    notebook.delete_note(5)
+    notebook.edit_note(7, "Zmieniona notatka")
+    notebook.save_notes(filename)
+
+    replayed = Notebook()
+    replayed.load_notes(filename)
+    assert snapshot(replayed) == snapshot(notebook)
+    replayed.close()
+
+    monkeypatch.setattr(Journal, "should_compact", lambda journal: True)
+    notebook.add_note("Po kompaktowaniu")
+    notebook.save_notes(filename)
+    notebook.close()
+    assert not Path(filename + ".journal.sealed").exists()
+    assert Path(filename + ".journal").stat().st_size == 0
+    compacted = Notebook()
+    compacted.load_notes(filename)
+    assert snapshot(compacted) == snapshot(notebook)
+    assert [note.id for note in Tag(compacted).search_tag("tag1")] == [
+        number + 1 for number in range(30) if number % 3 == 1 and number + 1 != 5
+    ]
+    assert [note.id for note, _ in compacted.search_notes("zmieniona")] == [7]
+    compacted.close()
+
+
+TAGS = ["praca", "dom", "pilne", "zakupy", "urodziny", "łódź"]
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    """Returns a notebook of notes created out of order, with random tags."""
+    rng = random.Random(5)
+    notebook = Notebook()
+    notebook.load_notes(str(tmp_path / "notes.pkl"))
+    tags = Tag(notebook)
+    for minutes in rng.sample(range(60 * 24 * 90), 200):
+        note = Note(f"Notatka {rng.choice(['mleko', 'chleb', 'spotkanie'])}")
+        note.id = notebook.state.next_id
+        note.created_at = START + timedelta(minutes=minutes)
+        notebook.change("add", note)
+        for tag in rng.sample(TAGS, rng.choice([0, 1, 1, 2, 3])):
+            tags.add_tag(note.id, tag)
+    yield notebook
+    notebook.close()
+
+
+def change_notes(notebook):
+    """Deletes some notes and tags others, so tags lose and gain notes."""
+    for note_id in range(1, 200, 7):
+        notebook.delete_note(note_id)
+    tags = Tag(notebook)
+    for note_id in range(2, 200, 11):
+        if note_id in notebook.notes:
+            tags.add_tag(note_id, "nowy")
+
+
+def test_tag_index_matches_brute_force(notebook):
+    queries = [["praca"], ["praca", "pilne"], ["dom", "łódź", "pilne"], ["brak"]]
+    queries += [["nowy"], ["nowy", "dom"], []]
+
+    def check(notebook):
+        tags = Tag(notebook)
+        for query in queries:
+            for match_all in (True, False):
+                expected = [
+                    note.id
+                    for note in sorted(notebook.notes.values(), key=lambda n: n.id)
+                    if query
+                    and (all if match_all else any)(tag in note.tags for tag in query)
+                ]
+                found = tags.search_tags(query, match_all)
+                assert [note.id for note in found] == expected, (query, match_all)
+        expected = {}
+        for note in sorted(notebook.notes.values(), key=lambda n: n.id):
+            for tag in note.tags:
+                expected.setdefault(tag, []).append(note.id)
+        found = {
+            tag: [note.id for note in notes] for tag, notes in tags.sort_tags().items()
+        }
+        assert list(found) == sorted(expected)
+        assert found == expected
+
+    check(notebook)
+    change_notes(notebook)
+    check(notebook)
+    filename = notebook.journal.filename
+    notebook.save_notes(filename)
+    reloaded = Notebook()
+    reloaded.load_notes(filename)
+    check(reloaded)
+    reloaded.close()
+
+
+def brute_find_notes(notebook, start, end, tags, match_all, query_ids, offset, limit):
+    """Returns the IDs of a page of matching notes, newest first, checking each."""
+    found = [
+        note
+        for note in notebook.notes.values()
+        if (start is None or note.created_at >= start)
+        and (end is None or note.created_at < end)
+        and (not tags or (all if match_all else any)(tag in note.tags for tag in tags))
+        and (query_ids is None or note.id in query_ids)
+    ]
+    found.sort(key=lambda note: note.created_at, reverse=True)
+    return [note.id for note in found[offset : offset + limit]]
+
+
+def test_find_notes_matches_brute_force(notebook):
+    ranges = [
+        (None, None),
+        (START + timedelta(days=30), None),
+        (None, START + timedelta(days=10)),
+        (START + timedelta(days=20), START + timedelta(days=21)),
+        (START + timedelta(days=200), None),
+    ]
+
+    def check(notebook):
+        for start, end in ranges:
+            for tags, match_all in (((), True), (["praca", "dom"], False)):
+                for query in ("", "mleko"):
+                    query_ids = notebook.search_index.matches(query) if query else None
+                    for offset, limit in ((0, 10), (5, 20), (0, 500)):
+                        found = notebook.find_notes(
+                            start, end, tags, match_all, query, offset, limit
+                        )
+                        assert [note.id for note in found] == brute_find_notes(
+                            notebook,
+                            start,
+                            end,
+                            tags,
+                            match_all,
+                            query_ids,
+                            offset,
+                            limit,
+                        ), (start, end, tags, query, offset)
+
+    check(notebook)
+    change_notes(notebook)
+    check(notebook)
+    filename = notebook.journal.filename
+    notebook.save_notes(filename)
+    reloaded = Notebook()
+    reloaded.load_notes(filename)
+    check(reloaded)
+    reloaded.close()
+
+
+def test_notes_added_after_failed_load_are_saved(tmp_path):
+    filename = str(tmp_path / "notes.pkl")
+    with open(filename, "wb") as file:
+        file.write(b"to nie jest pikla")
+    notebook = Notebook()
+    notebook.load_notes(filename)
+    notebook.add_note("Zapisana mimo błędu")
+    notebook.save_notes(filename)
+    notebook.close()
+
+    reloaded = Notebook()
+    reloaded.load_notes(filename)
+    assert [note.content for note in reloaded.notes.values()] == [
+        "Zapisana mimo błędu"
+    ]
+    reloaded.close()
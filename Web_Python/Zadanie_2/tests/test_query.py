@@ -0,0 +1,119 @@
+from datetime import date
+
+import pytest
+
+from assistant_bot import AddressBook, Name, PhoneNumber, Record
+from query import Condition, QueryPlan, parse_query
+
+
+@pytest.fixture
+def book(make_records):
+    book = AddressBook()
+    book.add_records(make_records())
+    record = Record(Name("Grzegorz Brzęczyszczykiewicz"))
+    record.add_phone_number(PhoneNumber("600123456"))
+    book.add_records([record])
+    return book
+
+
+def run(book, text, today, indexes=True):
+    """Returns the IDs the query finds, with the indexes or by checking every record."""
+    book.query_indexes = indexes
+    try:
+        return [record.id for record in QueryPlan(book, text, today).execute()]
+    finally:
+        del book.query_indexes
+
+
+QUERIES = [
+    "name:kow",
+    "name:kow city:Kraków",
+    "email:@firma.pl city:kraków",
+    "email:anna phone:5",
+    "phone:^60 phone:56$",
+    "phone:600123456$",
+    # A word without a field matches a name, a phone number or an email.
+    "kow",
+    "123 wp.pl",
+    "anna city:Łódź",
+    # The birthday conditions are ranges of days.
+    "bday<0",
+    "bday<=0",
+    "bday<3",
+    "bday<=3",
+    "bday<30 city:Gdańsk",
+    "bday<=365",
+    "bday<400 name:nowak",
+    "name:xyz bday<30",
+]
+
+
+@pytest.mark.parametrize(
+    "today", [date(2026, 2, 27), date(2026, 12, 29), date(2028, 2, 28)]
+)
+def test_indexed_queries_match_a_full_scan(book, today):
+    for text in QUERIES:
+        assert run(book, text, today) == run(book, text, today, False), text
+    assert run(book, "phone:600123456$", today) == [301]
+
+
+def test_condition_needs_lookup_and_matches():
+    class Unfinished(Condition):
+        def matches(self, record, today):
+            return True
+
+    with pytest.raises(TypeError):
+        Unfinished("wartość")
+
+
+def test_planner_looks_up_the_most_selective_index_first(book):
+    plan = QueryPlan(book, "city:Kraków phone:600123456$", date(2026, 3, 1))
+    plan.execute()
+    city, phone = plan.steps
+    assert phone.method == "indeks" and phone.estimate == 1
+    # The city matches far more records than are left, so they are checked instead.
+    assert city.method == "filtr" and city.estimate > 8
+    assert [stage for stage, _ in plan.timings][2] == "indeks phone:600123456$"
+    assert plan.checked == 1
+    lines = plan.explain().splitlines()
+    assert lines[0] == "Zapytanie: city:Kraków phone:600123456$"
+    assert lines[1].startswith("1. city:Kraków: filtr, indeks miasta pominięty")
+    assert lines[2] == (
+        "2. phone:600123456$: indeks cyfry numerów telefonów (szacunek 1) "
+        "-> 1 kandydatów"
+    )
+    assert lines[3] == "Sprawdzono 1 rekordów, pasuje 0."
+
+
+def test_planner_intersects_indexes_and_rechecks_inexact_ones(book):
+    plan = QueryPlan(book, "name:kow email:@firma.pl", date(2026, 3, 1))
+    found = plan.execute()
+    name, email = plan.steps
+    assert name.method == email.method == "indeks"
+    assert not name.condition.exact and email.condition.exact
+    # The smaller index is looked up first and the other narrows its result.
+    assert name.estimate < email.estimate
+    assert name.candidates == name.estimate
+    assert email.candidates == plan.checked < name.estimate
+    explained = plan.explain()
+    assert "name:kow: indeks n-gramy imion i nazwisk" in explained
+    assert "sprawdzany ponownie" in explained.splitlines()[1]
+    assert f"pasuje {len(found)}." in explained
+
+
+def test_explain_without_indexes_filters_every_record(book):
+    book.query_indexes = False
+    plan = QueryPlan(book, 'name:kow city:"Kraków"', date(2026, 3, 1))
+    lines = plan.explain().splitlines()
+    assert lines[1:3] == [
+        "1. name:kow: filtr, bez indeksu",
+        "2. city:Kraków: filtr, bez indeksu",
+    ]
+    assert lines[3].startswith(f"Sprawdzono {len(book.data)} rekordów")
+    assert lines[-1].startswith("  razem: ")
+
+
+@pytest.mark.parametrize("text", ['city:"Nowy', "name:", "bday>3", "bday<x"])
+def test_malformed_queries_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_query(text)
@@ -0,0 +1,89 @@
+from datetime import date
+
+import pytest
+
+from assistant_bot import AddressBook, Name, PhoneNumber, save_address_book
+from sharded_store import ShardedAddressBook
+
+
+def ids(records):
+    return [record.id for record in records]
+
+
+def contents(book):
+    return [(record_id, str(record)) for record_id, record in book.data.items()]
+
+
+def change(book, make_records):
+    """Deletes, edits and adds records, reusing some of the freed IDs."""
+    for record_id in (3, 50, 51, 299):
+        book.remove_record(record_id)
+    record = book.data[10]
+    record.edit_name(Name("Grzegorz Brzęczyszczykiewicz"))
+    record.add_phone_number(PhoneNumber("600123456"))
+    book.update_record(10)
+    book.add_records(make_records(count=3, seed=99))
+
+
+@pytest.fixture
+def books(tmp_path, make_records):
+    """Returns a reference book and a book of three shards with the same records."""
+    reference = AddressBook()
+    reference.add_records(make_records())
+    book = ShardedAddressBook(str(tmp_path / "book.pkl"), shards=3)
+    book.add_records(make_records())
+    yield reference, book
+    book.close()
+
+
+def check(reference, book, terms):
+    assert contents(book) == contents(reference)
+    for term in terms:
+        assert ids(book.find_record(term)) == ids(reference.find_record(term)), term
+        for where in ("any", "prefix", "suffix"):
+            # The reference lists edited numbers last, the shards in book order.
+            assert sorted(
+                (record.id, number)
+                for record, number in book.find_phone_numbers(term, where)
+            ) == sorted(
+                (record.id, number)
+                for record, number in reference.find_phone_numbers(term, where)
+            ), (term, where)
+        assert book.complete_name(term) == reference.complete_name(term), term
+    for today in (date(2026, 2, 27), date(2026, 12, 29)):
+        for days in (0, 3, 30, 365):
+            assert [
+                (entry.record.id, entry.birthday, entry.days)
+                for entry in book.upcoming_birthdays(days, today)
+            ] == [
+                (entry.record.id, entry.birthday, entry.days)
+                for entry in reference.upcoming_birthdays(days, today)
+            ], (today, days)
+    for text in ("name:kow", "city:Kraków bday<30", "email:wp.pl"):
+        assert ids(book.query(text, date(2026, 3, 1))) == ids(
+            reference.query(text, date(2026, 3, 1))
+        ), text
+
+
+def test_sharded_book_matches_reference(books, search_terms, make_records):
+    reference, book = books
+    check(reference, book, search_terms)
+    change(reference, make_records)
+    change(book, make_records)
+    check(reference, book, search_terms + ["Brzęczy", "600123"])
+
+
+def test_reopened_sharded_book_matches_reference(
+    tmp_path, books, search_terms, make_records
+):
+    reference, book = books
+    change(reference, make_records)
+    change(book, make_records)
+    save_address_book(book)
+    book.close()
+    reopened = ShardedAddressBook(str(tmp_path / "book.pkl"), shards=2)
+    try:
+        check(reference, reopened, search_terms)
+        assert reopened.ids.allocate() == reference.ids.allocate()
+    finally:
+        reopened.close()
@@ -0,0 +1,170 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from assistant_bot import AddressBook, Name, PhoneNumber
+from query import QueryPlan
+from sqlite_store import SQLiteAddressBook
+
+
+@pytest.fixture
+def books(tmp_path, make_records):
+    """Returns a reference book and an SQLite book with the same records."""
+    reference = AddressBook()
+    reference.add_records(make_records())
+    book = SQLiteAddressBook(str(tmp_path / "book.db"))
+    book.add_records(make_records())
+    yield reference, book
+    book.close()
+
+
+def ids(records):
+    return [record.id for record in records]
+
+
+def change_both(reference, book):
+    """Deletes and edits the same records in both books."""
+    for record_id in (3, 50, 51, 299):
+        reference.remove_record(record_id)
+        book.remove_record(record_id)
+    for current in (reference, book):
+        record = current.data[10]
+        record.edit_name(Name("Grzegorz Brzęczyszczykiewicz"))
+        record.add_phone_number(PhoneNumber("600123456"))
+        current.update_record(10)
+
+
+def test_find_record_matches_reference(books, search_terms):
+    reference, book = books
+    for term in search_terms:
+        assert ids(book.find_record(term)) == ids(reference.find_record(term)), term
+    change_both(reference, book)
+    for term in search_terms + ["Brzęczy", "600123", "3456"]:
+        assert ids(book.find_record(term)) == ids(reference.find_record(term)), term
+
+
+@pytest.mark.parametrize("where", ["any", "prefix", "suffix"])
+def test_find_phone_numbers_matches_reference(books, search_terms, where):
+    reference, book = books
+    change_both(reference, book)
+    for term in search_terms:
+        expected = sorted(
+            (record.id, number)
+            for record, number in reference.find_phone_numbers(term, where)
+        )
+        found = sorted(
+            (record.id, number)
+            for record, number in book.find_phone_numbers(term, where)
+        )
+        assert found == expected, term
+
+
+def test_find_phone_numbers_skips_words(books):
+    _, book = books
+    assert book.find_phone_numbers("Kowalska") == []
+    assert book.find_phone_numbers("1234567890") == []
+
+
+@pytest.mark.parametrize(
+    "today", [date(2026, 2, 27), date(2028, 2, 28), date(2026, 12, 29)]
+)
+def test_upcoming_birthdays_match_reference(books, today):
+    reference, book = books
+    for days in (0, 1, 3, 30, 365):
+        expected = [
+            (entry.record.id, entry.birthday, entry.days)
+            for entry in reference.upcoming_birthdays(days, today)
+        ]
+        found = [
+            (entry.record.id, entry.birthday, entry.days)
+            for entry in book.upcoming_birthdays(days, today)
+        ]
+        assert found == expected, days
+
+
+def test_reopened_book_keeps_records_and_free_ids(tmp_path, make_records):
+    filename = str(tmp_path / "book.db")
+    book = SQLiteAddressBook(filename)
+    book.add_records(make_records(20))
+    book.remove_record(20)
+    book.remove_record(5)
+    book.close()
+
+    book = SQLiteAddressBook(filename)
+    assert len(book.data) == 18
+    assert [record.name.value for record in book.data.values()] == [
+        record.name.value
+        for record_id, record in enumerate(make_records(20), start=1)
+        if record_id not in (5, 20)
+    ]
+    assert [book.ids.allocate(), book.ids.allocate()] == [5, 20]
+    book.close()
+
+
+QUERIES = [
+    "name:kow city:Kraków",
+    "name:Brzęczy",
+    "email:@firma.pl",
+    "email:@FIRMA.PL phone:5",
+    "email:anna",
+    "phone:^60 phone:56$",
+    "phone:600123456$",
+    "123 wp.pl",
+    "an city:łódź",
+    "bday<0",
+    "bday<=3",
+    "bday<30 city:Gdańsk",
+    "bday<400 name:nowak",
+]
+
+
+@pytest.mark.parametrize("today", [date(2026, 2, 27), date(2026, 12, 29)])
+def test_queries_match_reference(books, today):
+    reference, book = books
+    change_both(reference, book)
+    for text in QUERIES:
+        assert ids(book.query(text, today)) == ids(reference.query(text, today)), text
+
+
+def test_query_builds_only_the_records_the_database_finds(books, monkeypatch):
+    reference, book = books
+    change_both(reference, book)
+    loaded = []
+    load = book.data.load
+
+    def counting_load(record_id):
+        loaded.append(record_id)
+        return load(record_id)
+
+    monkeypatch.setattr(book.data, "load", counting_load)
+    plan = QueryPlan(book, "name:grzegorz phone:600123456$", date(2026, 3, 1))
+    assert [record.id for record in plan.execute()] == loaded == [10]
+    assert plan.checked == 1
+    assert "w zapytaniu do bazy danych -> 1 kandydatów" in plan.explain()
+
+
+def test_removal_and_free_id_are_committed_together(tmp_path, make_records):
+    filename = str(tmp_path / "book.db")
+    book = SQLiteAddressBook(filename)
+    book.add_records(make_records(5))
+    book.remove_record(2)
+    other = sqlite3.connect(filename)
+    assert other.execute("SELECT id FROM records ORDER BY id").fetchall() == [
+        (1,),
+        (3,),
+        (4,),
+        (5,),
+    ]
+    assert other.execute("SELECT id FROM free_ids").fetchall() == [(2,)]
+    other.close()
+
+    def failing_release(record_id):
+        raise sqlite3.OperationalError("database is locked")
+
+    book.ids.release = failing_release
+    with pytest.raises(sqlite3.OperationalError):
+        book.remove_record(3)
+    assert 3 in book.data
+    assert book.data[3].name.value == make_records(5)[2].name.value
+    book.close()
@@ -1,7 +1,13 @@
 from collections import UserDict
-import re
+import calendar
 import pickle
-from datetime import datetime, timedelta
+import sys
+from datetime import date
+from pathlib import Path
+
+# validation.py lives one directory up, next to the main.py of the repository root.
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from validation import is_valid_date, is_valid_email, is_valid_phone, parse_date
 
 class Field:
     """Base class for entry fields."""
@@ -31,8 +37,7 @@ class Phone(Field):
     @staticmethod
     def validate_phone(value):
         """Checks if the phone number is valid (9 digits, format 123456789)."""
-        pattern = re.compile(r"^\d{9}$")
-        return pattern.match(value) is not None
+        return is_valid_phone(value)
 
 class Email(Field):
     """Class for email address with validation."""
@@ -45,25 +50,35 @@ class Email(Field):
     @staticmethod
     def validate_email(value):
         """Checks if the email is valid."""
-        pattern = re.compile(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$")
-        return pattern.match(value) is not None
+        return is_valid_email(value)
 
 class Birthday(Field):
-    """Class for birthday with validation."""
+    """Class for birthday with validation; the date is parsed once and kept next to the text."""
     @Field.value.setter
     def value(self, new_value):
-        if not self.validate_birthday(new_value):
+        birth_date = parse_date(new_value)
+        if birth_date is None:
             raise ValueError("Niepoprawna data urodzenia")
         self._value = new_value
+        self.date = birth_date
+
+    def __setstate__(self, state):
+        # Entries saved before the parsed date was kept only hold the text.
+        self.__dict__.update(state)
+        if "date" not in state:
+            self.date = parse_date(self._value)
 
     @staticmethod
     def validate_birthday(value):
         """Checks if the birthday is valid."""
-        try:
-            datetime.strptime(value, "%Y-%m-%d")
-            return True
-        except ValueError:
-            return False
+        return is_valid_date(value)
+
+
+def birthday_in_year(birth_date, year):
+    """Returns the birthday in the given year; Feb 29 moves to Feb 28 in common years."""
+    if birth_date.month == 2 and birth_date.day == 29 and not calendar.isleap(year):
+        return date(year, 2, 28)
+    return birth_date.replace(year=year)
 
 
 class Record:
@@ -104,26 +119,32 @@ class Record:
         """Changes the first and last name."""
         self.name = new_name
 
-    def days_to_birthday(self):
-        """Returns the number of days to the next birthday."""
+    def days_to_birthday(self, today=None):
+        """Returns the number of days to the next birthday, 0 on the birthday itself.
+
+        Listings pass the same today to every entry instead of asking the clock each time.
+        """
         if not self.birthday or not self.birthday.value:
             return "Brak daty urodzenia"
-        today = datetime.now()
-        bday = datetime.strptime(self.birthday.value, "%Y-%m-%d")
-        next_birthday = bday.replace(year=today.year)
-        if today > next_birthday:
-            next_birthday = next_birthday.replace(year=today.year + 1)
-        return (next_birthday - today).days
-
-    def __str__(self):
-        """Returns a string representation of the entry."""
+        today = today or date.today()
+        next_birthday = birthday_in_year(self.birthday.date, today.year)
+        if next_birthday < today:
+            next_birthday = birthday_in_year(self.birthday.date, today.year + 1)
+        return next_birthday.toordinal() - today.toordinal()
+
+    def to_string(self, today=None):
+        """Returns a string representation of the entry, counting days to the birthday from today."""
         phones = ', '.join(phone.value for phone in self.phones)
         emails = ', '.join(email.value for email in self.emails)
         birthday_str = f", Urodziny: {self.birthday.value}" if self.birthday else ""
-        days_to_bday_str = f", Dni do urodzin: {self.days_to_birthday()}" if self.birthday else ""
+        days_to_bday_str = f", Dni do urodzin: {self.days_to_birthday(today)}" if self.birthday else ""
         return f"Imię i nazwisko: {self.name.value}, " \
                f"Telefony: {phones}, Email: {emails}{birthday_str}{days_to_bday_str}"
 
+    def __str__(self):
+        """Returns a string representation of the entry."""
+        return self.to_string()
+
 class AddressBook(UserDict):
     """Class for the address book."""
     def add_record(self, record: Record):
@@ -161,8 +182,9 @@ class AddressBook(UserDict):
         if not self.data:
             print("Książka adresowa jest pusta.")
             return
+        today = date.today()
         for name, record in self.data.items():
-            print(record)
+            print(record.to_string(today))
 
     def __iter__(self):
         """Returns an iterator over the address book records."""
@@ -313,8 +335,9 @@ def main():
         elif action == 'znajdź' or action == "z":
             search = input("Wpisz szukaną frazę: ")
             found = book.find_record(search)
+            today = date.today()
             for record in found:
-                print(record)
+                print(record.to_string(today))
         elif action == 'usuń' or action == "u":
             name = input("Podaj imię i nazwisko do usunięcia: ")
             book.delete_record(name)
@@ -325,8 +348,9 @@ def main():
             while True:
                 try:
                     records = next(iterator)
+                    today = date.today()
                     for record in records:
-                        print(record)
+                        print(record.to_string(today))
                     if input("Naciśnij Enter, aby kontynuować lub wpisz 'q' aby zakończyć: ") == 'q':
                         break
                 except StopIteration:
@@ -1,7 +1,10 @@
 from collections import UserDict
-import re
+from itertools import dropwhile, islice
+import calendar
 import pickle
-from datetime import datetime, timedelta
+from datetime import date
+
+from validation import is_valid_date, is_valid_email, is_valid_phone, parse_date
 
 class Field:
     """Base class for entry fields."""
@@ -22,8 +25,7 @@ class Phone(Field):
     @staticmethod
     def validate_phone(value):
         """Checks if the phone number is valid (9 digits, format 123456789)."""
-        pattern = re.compile(r"^\d{9}$")
-        return pattern.match(value) is not None
+        return is_valid_phone(value)
 
 class Email(Field):
     """Class for email address with validation."""
@@ -35,24 +37,34 @@ class Email(Field):
     @staticmethod
     def validate_email(value):
         """Checks if the email is valid."""
-        pattern = re.compile(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$")
-        return pattern.match(value) is not None
+        return is_valid_email(value)
 
 class Birthday(Field):
-    """Class for birthday with validation."""
+    """Class for birthday with validation; the date is parsed once and kept next to the text."""
     def __init__(self, value):
-        if not self.validate_birthday(value):
+        birth_date = parse_date(value)
+        if birth_date is None:
             raise ValueError("Niepoprawna data urodzenia")
         super().__init__(value)
+        self.date = birth_date
+
+    def __setstate__(self, state):
+        # Entries saved before the parsed date was kept only hold the text.
+        self.__dict__.update(state)
+        if "date" not in state:
+            self.date = parse_date(self.value)
 
     @staticmethod
     def validate_birthday(value):
         """Checks if the birthday is valid."""
-        try:
-            datetime.strptime(value, "%Y-%m-%d")
-            return True
-        except ValueError:
-            return False
+        return is_valid_date(value)
+
+
+def birthday_in_year(birth_date, year):
+    """Returns the birthday in the given year; Feb 29 moves to Feb 28 in common years."""
+    if birth_date.month == 2 and birth_date.day == 29 and not calendar.isleap(year):
+        return date(year, 2, 28)
+    return birth_date.replace(year=year)
 
 
 class Record:
@@ -93,37 +105,132 @@ class Record:
         """Changes the first and last name."""
         self.name = new_name
 
-    def days_to_birthday(self):
-        """Returns the number of days to the next birthday."""
+    def days_to_birthday(self, today=None):
+        """Returns the number of days to the next birthday, 0 on the birthday itself.
+
+        Listings pass the same today to every entry instead of asking the clock each time.
+        """
         if not self.birthday or not self.birthday.value:
             return "Brak daty urodzenia"
-        today = datetime.now()
-        bday = datetime.strptime(self.birthday.value, "%Y-%m-%d")
-        next_birthday = bday.replace(year=today.year)
-        if today > next_birthday:
-            next_birthday = next_birthday.replace(year=today.year + 1)
-        return (next_birthday - today).days
-
-    def __str__(self):
-        """Returns a string representation of the entry."""
+        today = today or date.today()
+        next_birthday = birthday_in_year(self.birthday.date, today.year)
+        if next_birthday < today:
+            next_birthday = birthday_in_year(self.birthday.date, today.year + 1)
+        return next_birthday.toordinal() - today.toordinal()
+
+    def to_string(self, today=None):
+        """Returns a string representation of the entry, counting days to the birthday from today."""
         phones = ', '.join(phone.value for phone in self.phones)
         emails = ', '.join(email.value for email in self.emails)
         birthday_str = f", Urodziny: {self.birthday.value}" if self.birthday else ""
-        days_to_bday_str = f", Dni do urodzin: {self.days_to_birthday()}" if self.birthday else ""
+        days_to_bday_str = f", Dni do urodzin: {self.days_to_birthday(today)}" if self.birthday else ""
         return f"Imię i nazwisko: {self.name.value}, " \
                f"Telefony: {phones}, Email: {emails}{birthday_str}{days_to_bday_str}"
 
+    def __str__(self):
+        """Returns a string representation of the entry."""
+        return self.to_string()
+
+class NGramIndex:
+    """Inverted index from character n-grams to the keys of the entries containing them."""
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = {}
+        self.grams_by_key = {}
+
+    def grams(self, text):
+        """Returns the set of case-folded n-grams of the text."""
+        text = text.casefold()
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def add(self, key, texts):
+        """Indexes the texts under the given key, replacing what was indexed before."""
+        self.remove(key)
+        grams = set()
+        for text in texts:
+            grams |= self.grams(text)
+        self.grams_by_key[key] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        """Drops the key from the index."""
+        for gram in self.grams_by_key.pop(key, ()):
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def candidates(self, term):
+        """Returns the keys sharing all n-grams of the term, or None if the term is shorter than n."""
+        grams = self.grams(term)
+        if not grams:
+            return None
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        found = set(postings[0])
+        for keys in postings[1:]:
+            if not found:
+                break
+            found &= keys
+        return found
+
+
 class AddressBook(UserDict):
     """Class for the address book."""
+    def __init__(self):
+        super().__init__()
+        self.name_index = NGramIndex()
+        self.contact_index = NGramIndex()
+        self.positions = {}
+        self.next_position = 0
+
+    def index_record(self, key, record):
+        """Adds the entry to the search indexes."""
+        if key not in self.positions:
+            self.positions[key] = self.next_position
+            self.next_position += 1
+        self.name_index.add(key, [record.name.value])
+        self.contact_index.add(key, [phone.value for phone in record.phones]
+                               + [email.value for email in record.emails])
+
+    def unindex_record(self, key):
+        """Removes the entry from the search indexes."""
+        self.name_index.remove(key)
+        self.contact_index.remove(key)
+        self.positions.pop(key, None)
+
+    def reindex_record(self, key):
+        """Refreshes the search indexes after the entry under the key was edited."""
+        self.index_record(key, self.data[key])
+
+    def rebuild_index(self):
+        """Indexes all entries from scratch, e.g. after loading the book from a file."""
+        self.name_index = NGramIndex()
+        self.contact_index = NGramIndex()
+        self.positions = {}
+        self.next_position = 0
+        for key, record in self.data.items():
+            self.index_record(key, record)
+
     def add_record(self, record: Record):
         """Adds an entry to the address book."""
         self.data[record.name.value] = record
+        self.index_record(record.name.value, record)
         print("Dodano wpis.")
 
+    def search_candidates(self, search_term):
+        """Returns the entries that may contain the phrase, in the order of the book."""
+        name_keys = self.name_index.candidates(search_term)
+        contact_keys = self.contact_index.candidates(search_term)
+        if name_keys is None or contact_keys is None:
+            return self.data.values()
+        keys = sorted(name_keys | contact_keys, key=self.positions.__getitem__)
+        return [self.data[key] for key in keys]
+
     def find_record(self, search_term):
         """Finds entries containing the exact phrase provided."""
         found_records = []
-        for record in self.data.values():
+        for record in self.search_candidates(search_term):
             if search_term.lower() in record.name.value.lower():
                 found_records.append(record)
                 continue
@@ -141,6 +248,7 @@ class AddressBook(UserDict):
         """Deletes a record by name."""
         if name in self.data:
             del self.data[name]
+            self.unindex_record(name)
             print(f"Usunięto wpis: {name}.")
         else:
             print(f"Wpis o nazwie {name} nie istnieje.")
@@ -150,21 +258,68 @@ class AddressBook(UserDict):
         if not self.data:
             print("Książka adresowa jest pusta.")
             return
+        today = date.today()
         for name, record in self.data.items():
-            print(record)
+            print(record.to_string(today))
+
+    def cursor(self, page_size=5, after_key=None):
+        """Returns a cursor paging through the records, optionally after the given key."""
+        return AddressBookCursor(self, page_size, after_key)
+
+    def __iter__(self):
+        """Returns an iterator over pages of the address book records."""
+        return self.cursor()
+
+
+class AddressBookCursor:
+    """Pages through the entries of a book, a fixed number at a time.
+
+    Every cursor keeps its own position, so several of them can page through
+    the same book at once. A page costs only its own size; only resuming
+    after a key walks the book to find the place.
+    """
+    def __init__(self, book, page_size=5, after_key=None):
+        self.book = book
+        self.page_size = page_size
+        self.last_key = after_key
+        self.last_position = book.positions.get(after_key)
+        self.items = None
+
+    def seek(self):
+        """Returns an iterator over the entries after the last key shown."""
+        items = iter(self.book.data.items())
+        if self.last_position is not None:
+            return dropwhile(
+                lambda item: self.book.positions[item[0]] <= self.last_position, items)
+        if self.last_key is not None:
+            for key, _ in items:
+                if key == self.last_key:
+                    break
+        return items
+
+    def next_page(self):
+        """Returns the next page of records, empty at the end of the book."""
+        if self.items is None:
+            self.items = self.seek()
+        try:
+            page = list(islice(self.items, self.page_size))
+        except RuntimeError:
+            # The book changed size since the last page; continue after the last key.
+            self.items = self.seek()
+            page = list(islice(self.items, self.page_size))
+        if page:
+            self.last_key = page[-1][0]
+            self.last_position = self.book.positions.get(self.last_key)
+        return [record for _, record in page]
 
     def __iter__(self):
-        """Returns an iterator over the address book records."""
-        self.current = 0
         return self
 
     def __next__(self):
-        if self.current < len(self.data):
-            records = list(self.data.values())[self.current:self.current+5]
-            self.current += 5
-            return records
-        else:
+        records = self.next_page()
+        if not records:
             raise StopIteration
+        return records
 
 
 def edit_record(book):
@@ -201,6 +356,7 @@ def edit_record(book):
         else:
             print("Brak numerów telefonu.")
 
+        book.reindex_record(name_to_edit)
         print("Wpis zaktualizowany.")
     else:
         print("Wpisu nie znaleziono.")
@@ -219,6 +375,7 @@ def load_address_book(filename='address_book.pkl'):
             data = pickle.load(file)
         book = AddressBook()
         book.data = data
+        book.rebuild_index()
         print("Przywrócono książkę adresową.")
         return book
     except FileNotFoundError:
@@ -302,8 +459,9 @@ def main():
         elif action == 'znajdź' or action == "z":
             search = input("Wpisz szukaną frazę: ")
             found = book.find_record(search)
+            today = date.today()
             for record in found:
-                print(record)
+                print(record.to_string(today))
         elif action == 'usuń' or action == "u":
             name = input("Podaj imię i nazwisko do usunięcia: ")
             book.delete_record(name)
@@ -314,8 +472,9 @@ def main():
             while True:
                 try:
                     records = next(iterator)
+                    today = date.today()
                     for record in records:
-                        print(record)
+                        print(record.to_string(today))
                     if input("Naciśnij Enter, aby kontynuować lub wpisz 'q' aby zakończyć: ") == 'q':
                         break
                 except StopIteration:
@@ -0,0 +1,67 @@
+"""Validation rules shared by the address book scripts.
+
+The patterns are compiled once, and dates are checked with a pattern and a
+table of month lengths instead of building a datetime. Every rule also has a
+column form that checks a whole list of values in one call and returns a list
+of booleans, for bulk loads and re-validation sweeps.
+"""
+
+import re
+from datetime import date
+
+
+# ASCII digits only: \d takes digits of any script and $ a trailing newline.
+PHONE_PATTERN = re.compile(r"[0-9]{9}")
+EMAIL_PATTERN = re.compile(r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$")
+# The YYYY-MM-DD forms datetime.strptime(value, "%Y-%m-%d") accepts.
+DATE_PATTERN = re.compile(
+    r"(\d{4})-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])"
+)
+DAYS_IN_MONTH = (31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def is_valid_phone(value):
+    """Checks if the phone number is valid (9 digits, format 123456789)."""
+    return PHONE_PATTERN.fullmatch(value) is not None
+
+
+def is_valid_email(value):
+    """Checks if the email is valid."""
+    return EMAIL_PATTERN.match(value) is not None
+
+
+def parse_date(value):
+    """Returns the date written as YYYY-MM-DD, or None if it is not valid."""
+    match = DATE_PATTERN.fullmatch(value)
+    if match is None:
+        return None
+    year, month, day = int(match[1]), int(match[2]), int(match[3])
+    if year == 0 or day > DAYS_IN_MONTH[month - 1]:
+        return None
+    if month == 2 and day == 29 and not (
+        year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    ):
+        return None
+    return date(year, month, day)
+
+
+def is_valid_date(value):
+    """Checks if the date is a valid YYYY-MM-DD date."""
+    return parse_date(value) is not None
+
+
+def phone_mask(values):
+    """Validates a column of phone numbers, returning one boolean per value."""
+    match = PHONE_PATTERN.fullmatch
+    return [match(value) is not None for value in values]
+
+
+def email_mask(values):
+    """Validates a column of email addresses, returning one boolean per value."""
+    match = EMAIL_PATTERN.match
+    return [match(value) is not None for value in values]
+
+
+def date_mask(values):
+    """Validates a column of dates, returning one boolean per value."""
+    return [parse_date(value) is not None for value in values]